@@ -0,0 +1,1679 @@
+"""
+benchmarkCellCurvature.py
+
+Time the stages of the cell curvature pipeline on the sample images
+and check that faster implementations agree with the reference ones.
+Each benchmark prints one row per image so the runtime can be compared
+against the number of cells in the image. The pipeline suite also runs
+on synthetic images of crescent shaped cells, whose curvature is known,
+and its results can be saved and compared between versions.
+
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import importlib
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import multiprocessing
+
+import numpy as np
+import SimpleITK as sitk
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+import calculatingCellCurvature as ccc
+
+#=========================================================================
+# Function Definitions
+#=========================================================================
+
+def timeCall(func, *args, **kwargs):
+    """
+    Call a function and measure how long it takes.
+
+    Inputs:
+    - func: the function to call
+    - args, kwargs: the arguments to pass to the function
+
+    Returns:
+    - result: the value returned by the function
+    - elapsed: the wall time of the call in seconds (float)
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def loadLabelMap(inputFn):
+    """
+    Run the pipeline up to the label map for one image.
+
+    Inputs:
+    - inputFn: the path to the image file (string)
+
+    Returns:
+    - labelMap: the label map image (sitk Image)
+    """
+    image = ccc.loadImage(inputFn)
+    segmentedImage = ccc.segmentCells(image)
+    labelMap = ccc.convertBinToLabelMap(segmentedImage)
+    plt.close('all')
+    return labelMap
+
+
+def contourEachFullMask(labelMap):
+    """
+    Reference contour extraction: build a full size mask of the image
+    for each label and contour the whole mask with plt.contour.
+
+    Inputs:
+    - labelMap: the label map image (sitk Image)
+
+    Returns:
+    - contours: the contour of each cell (list of arrays)
+    """
+    labelArray = sitk.GetArrayFromImage(labelMap)
+    contours = []
+    for label in range(1, np.amax(labelArray)+1):
+        contourObj = plt.contour(sitk.GetArrayFromImage(labelMap==label))
+        contours.append(contourObj.allsegs[0][0])
+    return contours
+
+
+def contoursMatch(contoursA, contoursB):
+    """
+    Check that two lists of contours hold the same vertices.
+
+    Inputs:
+    - contoursA, contoursB: the contours to compare (lists of arrays)
+
+    Returns:
+    - match: whether every pair of contours is equal (boolean)
+    """
+    if len(contoursA) != len(contoursB):
+        return False
+    return all(a.shape == b.shape and np.allclose(a, b)
+               for a, b in zip(contoursA, contoursB))
+
+
+def benchmarkContourExtraction(inputFns):
+    """
+    Compare the per-label full image masks against the bounding box
+    crops for contour extraction.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+
+    Effects:
+    - Prints the number of cells, the time taken by each method, the
+    speed up and whether the contours match for every image
+    """
+    print('Contour extraction')
+    print('%-20s %6s %10s %10s %8s %6s' % ('image', 'cells', 'full (s)', 'crop (s)', 'speedup', 'match'))
+    for inputFn in inputFns:
+        labelMap = loadLabelMap(inputFn)
+
+        fullContours, fullTime = timeCall(contourEachFullMask, labelMap)
+        plt.close('all')
+        (labels, cropContours), cropTime = timeCall(ccc.extractCellContours, labelMap,
+                                                    contourEngine='contourpy')
+        plt.close('all')
+
+        name = inputFn.split('/')[-1]
+        print('%-20s %6d %10.3f %10.3f %7.1fx %6s' % (name, len(labels), fullTime, cropTime,
+                                                     fullTime/cropTime,
+                                                     contoursMatch(fullContours, cropContours)))
+
+
+def sameRing(ringA, ringB):
+    """
+    Check that two closed rings visit the same vertices in the same
+    cyclic order, whatever vertex they start at and whichever way they
+    run.
+
+    Inputs:
+    - ringA, ringB: closed rings, first vertex repeated at the end
+                    (Nx2 arrays)
+
+    Returns:
+    - same: whether the rings match (boolean)
+    """
+    ringA = np.asarray(ringA)[:-1]
+    ringB = np.asarray(ringB)[:-1]
+    if ringA.shape != ringB.shape or len(ringA) == 0:
+        return ringA.shape == ringB.shape
+    for candidate in (ringB, ringB[::-1]):
+        for shift in np.nonzero(np.all(candidate == ringA[0], axis=1))[0]:
+            if np.array_equal(np.roll(candidate, -shift, axis=0), ringA):
+                return True
+    return False
+
+
+def sameLine(lineA, lineB):
+    """
+    Inputs:
+    - lineA, lineB: open contours (Nx2 arrays)
+
+    Returns:
+    - same: whether the contours visit the same vertices in the same
+            order, whichever way they run (boolean)
+    """
+    lineA = np.asarray(lineA)
+    lineB = np.asarray(lineB)
+    return np.array_equal(lineA, lineB) or np.array_equal(lineA, lineB[::-1])
+
+
+def benchmarkContourEngines(inputFns):
+    """
+    Compare the marching squares tracer, which traces every cell in
+    one pass over the label map, against contouring each cell crop
+    with contourpy and, if it has been built, with the compiled
+    tracer in dataverse_files/find_contours.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+
+    Effects:
+    - Prints the number of cells, the time taken by each engine, the
+    number of outer and inner rings and how many of the cells away
+    from the image border, and on it, have the same contour as with
+    contourpy (on the border, all engines leave the contour open;
+    contourpy keeps its first piece and the tracers the longest,
+    which differ for cells touching the border in several places)
+    """
+    engines = ['marchingSquares', 'findContours']
+    try:
+        # Loads the compiled library, which may not have been built
+        importlib.import_module('dataverse_files.find_contours')
+    except (ImportError, IOError) as err:
+        print('Skipping the findContours engine:', err)
+        engines.remove('findContours')
+
+    print('Contour engines')
+    print('%-20s %6s %6s %6s %10s' % ('image', 'cells', 'outer', 'inner', 'crop (s)')
+          + ''.join(' %18s %11s %11s' % (engine+' (s)', 'same', 'same border') for engine in engines))
+    for inputFn in inputFns:
+        labelMap = loadLabelMap(inputFn)
+        cells = ccc.getCellStatistics(labelMap)
+        width, height = labelMap.GetSize()
+        onBorder = ((cells['xStart'] == 0) | (cells['yStart'] == 0)
+                    | (cells['xEnd'] == width) | (cells['yEnd'] == height))
+
+        (labels, cropContours), cropTime = timeCall(ccc.extractCellContours, labelMap,
+                                                    contourEngine='contourpy')
+        row = ''
+        for engine in engines:
+            (labels, engineContours), engineTime = timeCall(ccc.extractCellContours, labelMap,
+                                                            cells=cells, contourEngine=engine)
+            numSame = sum(sameRing(crop, contour)
+                          for crop, contour, border in zip(cropContours, engineContours, onBorder)
+                          if not border)
+            numSameBorder = sum(sameLine(crop, contour)
+                                for crop, contour, border in zip(cropContours, engineContours, onBorder)
+                                if border)
+            row += ' %18.3f %5d / %-4d %5d / %-4d' % (engineTime, numSame, np.sum(~onBorder),
+                                                      numSameBorder, np.sum(onBorder))
+
+        name = inputFn.split('/')[-1]
+        print('%-20s %6d %6d %6d %10.3f' % (name, len(labels), cells['numOuterRings'].sum(),
+                                            cells['numInnerRings'].sum(), cropTime) + row)
+
+
+def makeBlobField(numBlobs, blobSize=4, spacing=7):
+    """
+    Make a synthetic binary segmentation holding a grid of separate
+    square blobs.
+
+    Inputs:
+    - numBlobs: the minimum number of blobs in the image (int)
+    - blobSize: the side length of each blob in pixels (int)
+    - spacing: the distance between the blob corners in pixels (int)
+
+    Returns:
+    - segImage: the binary segmentation image (sitk Image)
+    - numBlobs: the number of blobs in the image (int)
+    """
+    blobsPerSide = int(np.ceil(np.sqrt(numBlobs)))
+    segArray = np.zeros((blobsPerSide*spacing, blobsPerSide*spacing), dtype=np.uint8)
+    for offset in range(blobSize):
+        for other in range(blobSize):
+            segArray[offset::spacing, other::spacing] = 1
+    return sitk.GetImageFromArray(segArray), blobsPerSide*blobsPerSide
+
+
+def benchmarkLabelCapacity(numBlobs=5000):
+    """
+    Label a synthetic field with more cells than fit in 8 bits and
+    check that every cell keeps its own label.
+
+    Inputs:
+    - numBlobs: the minimum number of blobs in the field (int)
+
+    Effects:
+    - Prints the number of blobs, the label pixel type, the number of
+    separate labels found and the time taken to label the field
+
+    Raises:
+    - RuntimeError: if the labels or bounding boxes do not match the
+    blobs one to one, as when the labels wrap around their pixel type
+    """
+    segImage, numBlobs = makeBlobField(numBlobs)
+    labelMap, labelTime = timeCall(ccc.convertBinToLabelMap, segImage)
+
+    boundingBoxes = ccc.getCellBoundingBoxes(labelMap)
+    numLabels = len(np.unique(sitk.GetArrayViewFromImage(labelMap))) - 1
+
+    print('Label capacity')
+    print('%-8s %-28s %8s %8s %10s %6s' % ('blobs', 'pixel type', 'labels', 'boxes', 'label (s)', 'match'))
+    match = numLabels == len(boundingBoxes) == numBlobs
+    print('%-8d %-28s %8d %8d %10.3f %6s' % (numBlobs, labelMap.GetPixelIDTypeAsString(),
+                                              numLabels, len(boundingBoxes), labelTime, match))
+    if not match:
+        raise RuntimeError('%d blobs were labelled as %d labels with %d bounding boxes'
+                           % (numBlobs, numLabels, len(boundingBoxes)))
+
+
+def calculateContourCurvatureLoop(contourPixels):
+    """
+    Reference curvature calculation for one contour: clips the
+    curvature and rounds the points one at a time in Python.
+
+    Inputs:
+    - contourPixels: the x, y coordinates of the contour (Nx2 array)
+
+    Returns:
+    - contourCurvature: the curvature of the contour (array of floats)
+    - contourPixels: the (row, column) locations of the curvature
+                     (list of lists of ints)
+    """
+    contourPixels = np.asarray(contourPixels)
+    dx = np.gradient(contourPixels[:, 0])
+    dy = np.gradient(contourPixels[:, 1])
+    dx2 = np.gradient(dx)
+    dy2 = np.gradient(dy)
+    contourCurvature = np.abs(dx2*dy - dx*dy2)/(dx*dx + dy*dy)**1.5
+    for i in range(len(contourCurvature)):
+        if contourCurvature[i] > 1.0:
+            contourCurvature[i] = 1.0
+    contourPixels = [[int(round(pt[1])), int(round(pt[0]))] for pt in contourPixels]
+    return contourCurvature, contourPixels
+
+
+def curvatureEachContourLoop(contours):
+    """
+    Reference curvature stage: calculate the curvature of each contour
+    separately and extend master lists of curvatures and points.
+
+    Inputs:
+    - contours: the contour of each cell (list of arrays)
+
+    Returns:
+    - curvatures: the curvature of every point (list of floats)
+    - curves: the location of every point (list of lists of ints)
+    """
+    curvatures = []
+    curves = []
+    for contour in contours:
+        singleCurvature, singleCurve = calculateContourCurvatureLoop(contour)
+        curvatures.extend(singleCurvature)
+        curves.extend(singleCurve)
+    return curvatures, curves
+
+
+def benchmarkCurvature(inputFns, repeats=20):
+    """
+    Compare the per-contour Python loop against the batched NumPy
+    calculation of the contour curvatures.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+    - repeats: the number of times each method is run per image (int)
+
+    Effects:
+    - Prints the number of contour points, the throughput of each
+    method in points per second and whether the results match for
+    every image
+    """
+    print('Curvature calculation')
+    print('%-20s %8s %14s %14s %8s %6s' % ('image', 'points', 'loop (pts/s)', 'batch (pts/s)', 'speedup', 'match'))
+    for inputFn in inputFns:
+        labels, contours = ccc.extractCellContours(loadLabelMap(inputFn))
+        plt.close('all')
+        numPoints = sum(len(contour) for contour in contours)
+
+        (loopCurvatures, loopCurves), loopTime = timeCall(
+            lambda: [curvatureEachContourLoop(contours) for i in range(repeats)][-1])
+        (batchCurvatures, batchCurves, offsets), batchTime = timeCall(
+            lambda: [ccc.calculateContourCurvatures(contours) for i in range(repeats)][-1])
+
+        match = (np.allclose(loopCurvatures, batchCurvatures, rtol=1e-6, equal_nan=True)
+                 and np.array_equal(loopCurves, batchCurves))
+        name = inputFn.split('/')[-1]
+        print('%-20s %8d %14.3g %14.3g %7.1fx %6s' % (name, numPoints,
+                                                      numPoints*repeats/loopTime,
+                                                      numPoints*repeats/batchTime,
+                                                      loopTime/batchTime, match))
+
+
+def removeRepeatedPoints(contour):
+    """
+    Drop the points of a contour that repeat the point after them, as
+    calculate_curvature does before fitting.
+
+    Inputs:
+    - contour: the x, y coordinates of the contour (Nx2 array)
+
+    Returns:
+    - contour: the contour without repeated points (Nx2 array)
+    """
+    contour = np.asarray(contour, dtype=np.float64)
+    keep = np.ones(len(contour), dtype=bool)
+    keep[:-1] = np.any(contour[:-1] != contour[1:], axis=1)
+    return contour[keep]
+
+
+def fitCurvatureEachContourLoop(contours, fitLen=5, order=3, weighted=False):
+    """
+    Reference polynomial fit curvature: run calculate_curvature from
+    dataverse_files/curvature_algorithm.py on each contour, which fits
+    the polynomials of one point at a time. The ends of each contour,
+    within fitLen points, are left out.
+
+    Inputs:
+    - contours: the contour of each cell, without repeated points
+                (list of Nx2 arrays)
+    - fitLen, order, weighted: the fit settings (see
+                               ccc.fitContourCurvatures)
+
+    Returns:
+    - curvatures: the signed curvature of each contour (list of arrays)
+    """
+    from dataverse_files.curvature_algorithm import calculate_curvature
+    return [calculate_curvature(contour, None, curv_at_same=True, pad=fitLen,
+                                fit_len=fitLen, order=order, weighted=weighted)[0]
+            for contour in contours]
+
+
+def benchmarkCurvatureFit(inputFns, fitLen=5, weighted=False):
+    """
+    Compare calculate_curvature, looping over the points of each
+    contour, against the batched polynomial fit of all contours. The
+    contours are opened (their closing point is dropped) so that both
+    leave out the same ends.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+    - fitLen, weighted: the fit settings (see
+                        ccc.fitContourCurvatures)
+
+    Effects:
+    - Prints the number of contour points, the throughput of each
+    method in points per second and whether the curvatures match for
+    every image
+    """
+    print('Polynomial fit curvature (weighted=%s)' % weighted)
+    print('%-20s %8s %14s %14s %8s %6s' % ('image', 'points', 'loop (pts/s)', 'batch (pts/s)', 'speedup', 'match'))
+    for inputFn in inputFns:
+        labels, contours = ccc.extractCellContours(loadLabelMap(inputFn))
+        contours = [removeRepeatedPoints(contour[:-1]) for contour in contours]
+        lengths = [len(contour) for contour in contours]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        points = np.concatenate(contours)
+
+        loopCurvatures, loopTime = timeCall(fitCurvatureEachContourLoop, contours,
+                                                  fitLen=fitLen, weighted=weighted)
+        batchCurvatures, batchTime = timeCall(ccc.fitContourCurvatures, points, offsets,
+                                              fitLen=fitLen, weighted=weighted)
+
+        # The loop leaves out fitLen points at the start of each
+        # contour and fitLen+1 at the end
+        batchCurvatures = [batchCurvatures[start+fitLen:end-fitLen-1]
+                           for start, end in zip(offsets[:-1], offsets[1:])]
+        match = all(np.allclose(loop, batch, rtol=1e-6, atol=1e-6)
+                    for loop, batch in zip(loopCurvatures, batchCurvatures))
+        name = inputFn.split('/')[-1]
+        print('%-20s %8d %14.3g %14.3g %7.1fx %6s' % (name, len(points),
+                                                      len(points)/loopTime,
+                                                      len(points)/batchTime,
+                                                      loopTime/batchTime, match))
+
+
+def benchmarkStageCache(inputFns):
+    """
+    Time processing each image with an empty stage cache and again
+    with the cache filled by the first run, and check that both runs
+    save the same results.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+
+    Effects:
+    - Prints the number of cells, the time taken by the cold and warm
+    runs, the speed up and whether the saved tables match for every
+    image, followed by the cache statistics
+    """
+    workDir = tempfile.mkdtemp()
+    try:
+        cache = ccc.StageCache(workDir+'/cache')
+        print('Stage cache')
+        print('%-20s %6s %10s %10s %8s %6s' % ('image', 'cells', 'cold (s)', 'warm (s)', 'speedup', 'match'))
+        for inputFn in inputFns:
+            numCells, coldTime = timeCall(ccc.processImage, inputFn, outDir=workDir+'/cold/',
+                                          makeFigures=False, cache=cache)
+            numCells, warmTime = timeCall(ccc.processImage, inputFn, outDir=workDir+'/warm/',
+                                          makeFigures=False, cache=cache)
+
+            imageName = inputFn.split('/')[-1].split('.')[0]
+            match = all(np.load(workDir+'/cold/'+imageName+'/'+fn).tobytes()
+                        == np.load(workDir+'/warm/'+imageName+'/'+fn).tobytes()
+                        for fn in (ccc.CELLS_FN, ccc.POINTS_FN))
+            name = inputFn.split('/')[-1]
+            print('%-20s %6d %10.3f %10.3f %7.1fx %6s' % (name, numCells, coldTime, warmTime,
+                                                         coldTime/warmTime, match))
+        print(cache.getReport())
+    finally:
+        shutil.rmtree(workDir)
+
+
+def loadImageArrayRoundTrip(inputFn):
+    """
+    Reference ingestion: read the image and take its first channel by
+    copying all channels into an array and the channel back into an
+    image.
+
+    Inputs:
+    - inputFn: the path to the image file (string)
+
+    Returns:
+    - image: the single channel image (sitk Image)
+    """
+    image = sitk.ReadImage(inputFn)
+    if image.GetNumberOfComponentsPerPixel() in (3, 4):
+        imageArray = sitk.GetArrayFromImage(image)
+        image = sitk.GetImageFromArray(imageArray[:,:,0])
+    return image
+
+
+def segmentCellsArrayRoundTrip(origImage):
+    """
+    Reference segmentation: pick the darkest Otsu class through a
+    copy of the Otsu image as an array, widened to int64, and open
+    the int64 image.
+
+    Inputs:
+    - origImage: the single channel image (sitk Image)
+
+    Returns:
+    - segImage: the segmented image (sitk Image)
+    """
+    thresholdFilter = sitk.OtsuMultipleThresholdsImageFilter()
+    thresholdFilter.SetNumberOfThresholds(ccc.OTSU_NUM_THRESHOLDS)
+    otsuArray = sitk.GetArrayFromImage(thresholdFilter.Execute(origImage))
+    segImage = sitk.GetImageFromArray(1*(otsuArray==0))
+    openingFilter = sitk.BinaryMorphologicalOpeningImageFilter()
+    openingFilter.SetKernelRadius(ccc.OPENING_KERNEL_RADIUS)
+    openingFilter.SetKernelType(getattr(sitk, ccc.OPENING_KERNEL_TYPE))
+    return openingFilter.Execute(segImage)
+
+
+def getPeakMemoryMB():
+    """
+    Get the peak resident memory of this process. On Linux this is
+    read from /proc, because ru_maxrss carries over the peak of the
+    parent process into a freshly started one.
+
+    Returns:
+    - peakMB: the peak resident memory in MB (float)
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    import resource
+    # ru_maxrss is in kB on Linux and in bytes on OS X
+    scale = 2**20 if sys.platform == 'darwin' else 2**10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def runIngestion(method, inputFn):
+    """
+    Load and segment an image and measure how much the peak resident
+    memory of the process grows. Meant to run in a fresh process, so
+    that the peak belongs to this image alone.
+
+    Inputs:
+    - method: 'roundTrip' for the reference array round trips, or
+              'views' for the pipeline (string)
+    - inputFn: the path to the image file (string)
+
+    Returns:
+    - peakMB: the growth of the peak resident memory in MB (float)
+    - elapsed: the wall time of loading and segmenting (float)
+    - digest: a hash of the segmentation, to compare the methods
+              (string)
+    """
+    peakBefore = getPeakMemoryMB()
+    start = time.perf_counter()
+    if method == 'roundTrip':
+        segImage = segmentCellsArrayRoundTrip(loadImageArrayRoundTrip(inputFn))
+    else:
+        segImage = ccc.segmentCells(ccc.loadImage(inputFn))
+    elapsed = time.perf_counter() - start
+    peakAfter = getPeakMemoryMB()
+    digest = hashlib.sha256(np.packbits(sitk.GetArrayViewFromImage(segImage) != 0)).hexdigest()
+    return peakAfter - peakBefore, elapsed, digest
+
+
+def benchmarkCurvatureSummary(inputFns, numPoints=10**7, chunkSize=2**20):
+    """
+    Check the streaming curvature summaries against numpy: summarize
+    the curvatures of every image on its own, merge the summaries and
+    compare the statistics of the merged summary with those of all
+    curvatures at once. Then time summarizing a large synthetic set
+    of curvatures a chunk at a time.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+    - numPoints: the number of synthetic curvatures (int)
+    - chunkSize: the number of curvatures added at a time (int)
+
+    Effects:
+    - Prints each statistic of the merged summary next to the exact
+    value, and the rate of summarizing the synthetic curvatures
+    """
+    allCurvatures = []
+    merged = ccc.CurvatureSummary()
+    for inputFn in inputFns:
+        contours = ccc.extractCellContours(loadLabelMap(inputFn))[1]
+        curvatures = ccc.calculateContourCurvatures(contours)[0]
+        allCurvatures.append(curvatures)
+        # Go through JSON, as the summaries of the workers do
+        state = json.loads(json.dumps(ccc.CurvatureSummary().add(curvatures).toDict()))
+        merged.merge(ccc.CurvatureSummary.fromDict(state))
+    allCurvatures = np.concatenate(allCurvatures).astype(np.float64)
+    allCurvatures = allCurvatures[~np.isnan(allCurvatures)]
+
+    statistics = merged.getStatistics()
+    exact = {'count': len(allCurvatures), 'min': allCurvatures.min(), 'mean': allCurvatures.mean(),
+             'max': allCurvatures.max(), 'std': allCurvatures.std()}
+    for percentile in (5, 25, 50, 75, 95):
+        name = 'median' if percentile == 50 else 'p%d' % percentile
+        exact[name] = np.percentile(allCurvatures, percentile)
+    print('Curvature summary (%d images merged, quantiles to within %.1e)'
+          % (len(inputFns), 1.0/ccc.SUMMARY_NUM_BINS))
+    print('%-10s %14s %14s %10s' % ('statistic', 'summary', 'exact', 'error'))
+    for name, value in exact.items():
+        print('%-10s %14.6g %14.6g %10.2e' % (name, statistics[name], value,
+                                              abs(statistics[name]-value)))
+
+    rng = np.random.default_rng(0)
+    summary = ccc.CurvatureSummary()
+    start = time.perf_counter()
+    for chunkStart in range(0, numPoints, chunkSize):
+        summary.add(rng.random(min(chunkSize, numPoints-chunkStart)))
+    elapsed = time.perf_counter() - start
+    print('%d synthetic curvatures summarized at %.3g points/s (including generating them)'
+          % (numPoints, numPoints/elapsed))
+
+
+def benchmarkCellFilter(inputFns, cellFilter=None):
+    """
+    Time contouring and curvature with and without rejecting debris
+    and clumps first, and count the rejections for each reason.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+    - cellFilter: the filter to apply; by default, one that rejects
+                  small debris, clumps and cells on the edge of the
+                  image (CellFilter)
+
+    Effects:
+    - Prints, for each image and contour engine, the number of
+    components, the time of the shape, contouring and curvature
+    stages for every component and with the filter, and the
+    rejections for each reason
+    """
+    if cellFilter is None:
+        cellFilter = ccc.CellFilter(minArea=100, minSolidity=0.6, rejectBorder=True)
+
+    def measureAll(labelMap, cells, contourEngine):
+        cells = ccc.measureCellShapes(labelMap, cells)
+        contours = ccc.extractCellContours(labelMap, cells=cells, contourEngine=contourEngine)[1]
+        return ccc.calculateContourCurvatures(contours)
+
+    def measureKept(labelMap, cells, contourEngine):
+        cells, counts = cellFilter.apply(labelMap, cells, verbose=False)
+        contours = ccc.extractCellContours(labelMap, cells=cells, contourEngine=contourEngine)[1]
+        return ccc.calculateContourCurvatures(contours), counts
+
+    rows = []
+    for inputFn in inputFns:
+        labelMap = loadLabelMap(inputFn)
+        cells = ccc.getCellStatistics(labelMap)
+        for contourEngine in ('marchingSquares', 'contourpy'):
+            allTime = timeCall(measureAll, labelMap, cells.copy(), contourEngine)[1]
+            (curvatures, counts), keptTime = timeCall(measureKept, labelMap, cells.copy(),
+                                                      contourEngine)
+            rows.append((os.path.basename(inputFn), contourEngine, len(cells), allTime, keptTime,
+                         allTime/keptTime,
+                         ', '.join('%s %d' % (reason, counts[reason]) for reason in ccc.FILTER_REASONS)))
+
+    print('Cell filter')
+    print('%-14s %-16s %6s %10s %10s %8s   %s' % ('image', 'engine', 'cells', 'all (s)',
+                                               'filtered (s)', 'speedup', 'rejected'))
+    for row in rows:
+        print('%-14s %-16s %6d %10.3f %12.3f %7.1fx   %s' % row)
+
+
+def benchmarkParameterSweep(inputFns, grid=None):
+    """
+    Time a parameter sweep of each image, which shares the stage
+    results of the configurations, against running every
+    configuration of the grid on its own.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+    - grid: the values to try for each parameter; by default, two
+            Otsu threshold counts, three opening radii and every
+            curvature engine with two fit lengths (dict)
+
+    Effects:
+    - Prints, for each image, the number of configurations and of
+    stage results computed, the time of the shared and independent
+    runs and whether their summaries match
+    """
+    if grid is None:
+        grid = {'numThresholds': [2, 3], 'kernelRadius': [1, 2, 3],
+                'curvatureEngine': list(ccc.CURVATURE_ENGINES), 'fitLen': [3, 5]}
+    configurations = ccc.getSweepConfigurations(grid)
+
+    def getStates(results):
+        return [{name: summary.toDict() for name, summary in result['summaries'].items()}
+                for result in results]
+
+    rows = []
+    for inputFn in inputFns:
+        (sharedResults, numComputed), sharedTime = timeCall(ccc.sweepImage, inputFn,
+                                                            configurations)
+        independentResults, independentTime = timeCall(
+            lambda: [ccc.sweepImage(inputFn, [configuration])[0][0]
+                     for configuration in configurations])
+        rows.append((os.path.basename(inputFn), len(configurations), sum(numComputed.values()),
+                     sharedTime, independentTime, independentTime/sharedTime,
+                     getStates(sharedResults) == getStates(independentResults)))
+
+    print('Parameter sweep')
+    print('%-14s %8s %8s %10s %16s %8s %6s' % ('image', 'configs', 'stages', 'shared (s)',
+                                               'independent (s)', 'speedup', 'match'))
+    for row in rows:
+        print('%-14s %8d %8d %10.3f %16.3f %7.1fx %6s' % row)
+
+
+def benchmarkService(inputFns):
+    """
+    Time analyzing each image by starting the script for it, as one
+    would without the service, against sending it to a warm analysis
+    service running in this process.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+
+    Effects:
+    - Prints, for each image, the time of a fresh run of the script
+    (without figures), the latency of the service and the speedup,
+    then the latency percentiles the service reports
+    """
+    workDir = tempfile.mkdtemp()
+    service = ccc.AnalysisService(workDir)
+    server = ccc.startServiceServer(service)
+    serverThread = threading.Thread(target=server.serve_forever, daemon=True)
+    serverThread.start()
+    url = 'http://%s:%d' % server.server_address[:2]
+    scriptFn = os.path.join(os.path.dirname(os.path.abspath(ccc.__file__)), 'calculatingCellCurvature.py')
+
+    rows = []
+    try:
+        for inputFn in inputFns:
+            coldTime = timeCall(subprocess.run, [sys.executable, scriptFn, '--inFn', inputFn,
+                                                 '--outDir', workDir, '--noFigures'],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)[1]
+            result, warmTime = timeCall(ccc.submitToService, url, inputFn)
+            rows.append((os.path.basename(inputFn), result['numCells'], coldTime, warmTime,
+                         coldTime/warmTime))
+        status = json.loads(urllib.request.urlopen(url+'/status').read())
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+        shutil.rmtree(workDir)
+
+    print('Analysis service')
+    print('%-14s %6s %10s %12s %8s' % ('image', 'cells', 'script (s)', 'service (s)', 'speedup'))
+    for row in rows:
+        print('%-14s %6d %10.3f %12.3f %7.1fx' % row)
+    for name in ('wait', 'processing', 'total'):
+        latency = status[name+'Latency']
+        if latency is not None:
+            print('%-10s latency: p50 %.3f s, p90 %.3f s, p99 %.3f s' % (name, latency['p50'],
+                                                                     latency['p90'], latency['p99']))
+
+
+# Modules the script imported at load before they were imported lazily
+EAGER_MODULES = ('SimpleITK', 'matplotlib.pyplot', 'contourpy', 'http.server')
+
+# Run in a fresh interpreter: import the script, then analyze the image
+# saved in the .npy file given as the first argument
+COLD_START_CODE = """
+import sys, time, json
+start = time.perf_counter()
+%s
+import calculatingCellCurvature as ccc
+imported = time.perf_counter()
+loaded = [name for name in %r if name in sys.modules]
+cells, points, rejected = ccc.measureCellArray(ccc.np.load(sys.argv[1]))
+done = time.perf_counter()
+print(json.dumps({'importTime': imported - start, 'firstTime': done - imported,
+                  'numCells': len(cells), 'loaded': loaded}))
+"""
+
+
+def runColdStart(arrayFn, eager):
+    """
+    Import the script in a fresh interpreter and analyze one image
+    with the library API.
+
+    Inputs:
+    - arrayFn: the path to a .npy file of the image pixels (string)
+    - eager: flag to indicate whether to import EAGER_MODULES before
+             the script, as it used to at load (boolean)
+
+    Returns:
+    - result: the import time, the time of the first result, the
+              number of cells and the EAGER_MODULES loaded by the
+              import (dict)
+    """
+    imports = 'import ' + ', '.join(EAGER_MODULES) if eager else ''
+    env = dict(os.environ)
+    scriptDir = os.path.dirname(os.path.abspath(ccc.__file__))
+    env['PYTHONPATH'] = os.pathsep.join([scriptDir] + [path for path in [env.get('PYTHONPATH')] if path])
+    output = subprocess.run([sys.executable, '-c', COLD_START_CODE % (imports, EAGER_MODULES), arrayFn],
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            check=True).stdout
+    return json.loads(output)
+
+
+def benchmarkColdStart(inputFns, repeats=5):
+    """
+    Time importing the script and analyzing the first image through
+    the library API in a fresh interpreter, with the heavy modules
+    imported lazily against importing them all at load.
+
+    Inputs:
+    - inputFns: the paths of the images to benchmark (list of strings)
+    - repeats: the number of fresh interpreters per case; the fastest
+               counts (int)
+
+    Effects:
+    - Prints the import time and the time to the first result of each
+    case, and the heavy modules that importing the script loaded
+    """
+    if not inputFns:
+        return
+    workDir = tempfile.mkdtemp()
+    arrayFn = os.path.join(workDir, 'image.npy')
+    np.save(arrayFn, sitk.GetArrayFromImage(ccc.loadImage(inputFns[0])))
+    try:
+        results = {}
+        for name, eager in (('eager', True), ('lazy', False)):
+            runs = [runColdStart(arrayFn, eager) for i in range(repeats)]
+            results[name] = (min(run['importTime'] for run in runs),
+                             min(run['firstTime'] for run in runs),
+                             runs[0]['numCells'], runs[0]['loaded'])
+    finally:
+        shutil.rmtree(workDir)
+
+    print('Cold start (%s, fastest of %d)' % (os.path.basename(inputFns[0]), repeats))
+    print('%-8s %11s %16s %6s' % ('imports', 'import (s)', 'first result (s)', 'cells'))
+    for name, (importTime, firstTime, numCells, loaded) in results.items():
+        print('%-8s %11.3f %16.3f %6d' % (name, importTime, firstTime, numCells))
+    print('Loaded by importing the script: %s' % (', '.join(results['lazy'][3]) or 'none of '
+                                                  + ', '.join(EAGER_MODULES)))
+
+
+def stitchSample(inputFn, stitchSize, outFn):
+    """
+    Stitch copies of a sample image into one large square image.
+
+    Inputs:
+    - inputFn: the path to the sample image (string)
+    - stitchSize: the side length of the stitched image (int)
+    - outFn: the path the stitched image is written to (string)
+
+    Returns:
+    - numChannels: the number of channels of the image (int)
+    """
+    tile = sitk.GetArrayFromImage(sitk.ReadImage(inputFn))
+    reps = (stitchSize // tile.shape[0] + 1, stitchSize // tile.shape[1] + 1) + (1,)*(tile.ndim-2)
+    stitched = np.tile(tile, reps)[:stitchSize, :stitchSize]
+    sitk.WriteImage(sitk.GetImageFromArray(stitched, isVector=stitched.ndim == 3), outFn)
+    return tile.shape[2] if tile.ndim == 3 else 1
+
+
+def benchmarkIngestionMemory(inputFn, stitchSize=8192):
+    """
+    Stitch copies of an RGBA sample image into one large image and
+    compare the peak memory of loading and segmenting it through the
+    array round trips against the pipeline, which stays in SimpleITK
+    images and 8-bit pixels. Each method runs in its own fresh
+    process.
+
+    Inputs:
+    - inputFn: the path to the RGBA sample image (string)
+    - stitchSize: the side length of the stitched image (int)
+
+    Effects:
+    - Prints the peak memory growth and time of each method and
+    whether the segmentations match
+    """
+    workDir = tempfile.mkdtemp()
+    try:
+        # An uncompressed format, so that reading is quick and the
+        # same for both methods
+        stitchedFn = workDir+'/stitched.mha'
+        numChannels = stitchSample(inputFn, stitchSize, stitchedFn)
+
+        print('Ingestion memory (%dx%d, %d channels)' % (stitchSize, stitchSize, numChannels))
+        print('%-12s %10s %10s %6s' % ('method', 'peak (MB)', 'time (s)', 'match'))
+        context = multiprocessing.get_context('spawn')
+        digests = []
+        for method in ('roundTrip', 'views'):
+            with context.Pool(1) as pool:
+                peakMB, elapsed, digest = pool.apply(runIngestion, (method, stitchedFn))
+            digests.append(digest)
+            print('%-12s %10.1f %10.3f %6s' % (method, peakMB, elapsed, digest == digests[0]))
+    finally:
+        shutil.rmtree(workDir)
+
+
+def benchmarkMosaicTiling(inputFn, stitchSize=4096, tileSizes=(512, 2048),
+                          overlap=ccc.MOSAIC_TILE_OVERLAP, numWorkers=None):
+    """
+    Stitch copies of a sample image into a mosaic and time processing
+    it in one piece against processing it in tiles, and check that
+    the tiled runs save the same results.
+
+    Inputs:
+    - inputFn: the path to the sample image (string)
+    - stitchSize: the side length of the mosaic (int)
+    - tileSizes: the tile sizes to try (tuple of ints)
+    - overlap: how far each tile's window reaches past the tile (int)
+    - numWorkers: the number of worker processes of the tiled runs;
+                  defaults to the number of CPUs (int)
+
+    Effects:
+    - Prints the number of cells, the time taken and whether the saved
+    tables match the untiled run for every tile size
+    """
+    workDir = tempfile.mkdtemp()
+    try:
+        # Streamed a tile at a time by the tiled runs
+        mosaicFn = workDir+'/mosaic.mha'
+        stitchSample(inputFn, stitchSize, mosaicFn)
+
+        rows = []
+        numCells, elapsed = timeCall(ccc.processImage, mosaicFn, outDir=workDir+'/whole/',
+                                     makeFigures=False)
+        rows.append(('whole', numCells, elapsed, True))
+        for tileSize in tileSizes:
+            outDir = workDir+'/tiles-%d/' % tileSize
+            numCells, elapsed = timeCall(ccc.processMosaic, mosaicFn, outDir=outDir,
+                                         makeFigures=False, tileSize=tileSize, overlap=overlap,
+                                         numWorkers=numWorkers)
+            match = all(np.load(workDir+'/whole/mosaic/'+fn).tobytes()
+                        == np.load(outDir+'mosaic/'+fn).tobytes()
+                        for fn in (ccc.CELLS_FN, ccc.POINTS_FN))
+            rows.append(('tiles of %d' % tileSize, numCells, elapsed, match))
+
+        print('Mosaic tiling (%dx%d, overlap %d)' % (stitchSize, stitchSize, overlap))
+        print('%-14s %6s %10s %6s' % ('method', 'cells', 'time (s)', 'match'))
+        for row in rows:
+            print('%-14s %6d %10.3f %6s' % row)
+    finally:
+        shutil.rmtree(workDir)
+
+
+def saveCurvatureOverlayPylab(origImage, curves, curvatures, figFilePath='./'):
+    """
+    Reference overlay: fill a float image of NaNs with the curvatures
+    in a loop over the contour points and draw it over the image in a
+    35x25 inch pylab figure with a colorbar.
+
+    Inputs:
+    - origImage: the original greyscale image (sitk Image)
+    - curves: the (row, column) locations of the cell curves
+              (Nx2 array of ints)
+    - curvatures: the curvatures of the curves (array of floats)
+    - figFilePath: the path to the location where the figure
+                   will be saved (string)
+    """
+    import pylab
+
+    pylab.figure(figsize=(35,25))
+    pylab.set_cmap('gray')
+    pylab.imshow(sitk.GetArrayFromImage(origImage))
+
+    shape = origImage.GetSize()
+    overlay = np.zeros((shape[1], shape[0]))
+    overlay[overlay == 0.0] = np.nan
+    for (row, column), curvature in zip(curves, curvatures):
+        if 0 <= row < shape[1] and 0 <= column < shape[0]:
+            overlay[row, column] = curvature if curvature < 1 else 1
+
+    pylab.imshow(overlay, 'rainbow', alpha=1)
+    pylab.colorbar()
+    pylab.savefig(figFilePath+'curvatures.png', bbox_inches='tight')
+    pylab.close('all')
+
+
+def runOverlay(method, inputFn, outDir):
+    """
+    Draw the curvature overlay of an image from its saved results and
+    measure how much the peak resident memory of the process grows.
+    Meant to run in a fresh process, so that the peak belongs to the
+    overlay alone.
+
+    Inputs:
+    - method: 'pylab' for the reference figure, or 'raster' for the
+              pipeline (string)
+    - inputFn: the path to the image file (string)
+    - outDir: the directory holding the saved results (string)
+
+    Returns:
+    - peakMB: the growth of the peak resident memory in MB (float)
+    - elapsed: the wall time of drawing and saving the overlay (float)
+    """
+    figPath = ccc.getFigurePath(inputFn, outDir)
+    image = ccc.loadImage(inputFn)
+    points = np.load(figPath+ccc.POINTS_FN)
+    curves = np.rint(np.column_stack([points['y'], points['x']])).astype(np.int32)
+    curvatures = points['curvature']
+
+    peakBefore = getPeakMemoryMB()
+    start = time.perf_counter()
+    if method == 'pylab':
+        saveCurvatureOverlayPylab(image, curves, curvatures, figFilePath=figPath)
+    else:
+        ccc.saveCurvatureOverlay(image, curves, curvatures, figFilePath=figPath)
+    elapsed = time.perf_counter() - start
+    return getPeakMemoryMB() - peakBefore, elapsed
+
+
+def benchmarkOverlayRendering(inputFn):
+    """
+    Compare the time and peak memory of drawing the curvature overlay
+    of an image as a pylab figure against rasterizing it straight
+    into an RGB image. Each method runs in its own fresh process.
+
+    Inputs:
+    - inputFn: the path to the image (string)
+
+    Effects:
+    - Prints the peak memory growth and time of each method
+    """
+    workDir = tempfile.mkdtemp()
+    try:
+        ccc.processImage(inputFn, outDir=workDir+'/', makeFigures=False)
+        print('Overlay rendering (%s)' % inputFn.split('/')[-1])
+        print('%-12s %10s %10s' % ('method', 'peak (MB)', 'time (s)'))
+        context = multiprocessing.get_context('spawn')
+        for method in ('pylab', 'raster'):
+            with context.Pool(1) as pool:
+                peakMB, elapsed = pool.apply(runOverlay, (method, inputFn, workDir+'/'))
+            print('%-12s %10.1f %10.3f' % (method, peakMB, elapsed))
+    finally:
+        shutil.rmtree(workDir)
+
+
+def makeSpotField(numSpots, size=512, noise=3.0, seed=0):
+    """
+    Make a synthetic fluorescence image holding round gaussian spots
+    of random width and brightness at sub-pixel positions.
+
+    Inputs:
+    - numSpots: the number of spots in the image (int)
+    - size: the side length of the image in pixels (int)
+    - noise: the standard deviation of the background noise (float)
+    - seed: the seed of the random number generator (int)
+
+    Returns:
+    - image: the image (2D float array)
+    - positions: the (column, row) pixel nearest each spot centre
+                 (Nx2 int array)
+    """
+    rng = np.random.default_rng(seed)
+    image = rng.normal(100.0, noise, (size, size))
+    positions = rng.integers(8, size-8, (numSpots, 2))
+    centres = positions + rng.uniform(-0.5, 0.5, (numSpots, 2))
+    sigmas = rng.uniform(0.8, 2.5, numSpots)
+    amplitudes = rng.uniform(20, 200, numSpots)
+    offsets = np.arange(-8, 9)
+    for (col, row), (x, y), sigma, amplitude in zip(positions, centres, sigmas, amplitudes):
+        rows = row + offsets[:, None]
+        cols = col + offsets[None, :]
+        image[rows, cols] += amplitude*np.exp(-((rows-y)**2 + (cols-x)**2)/(2*sigma**2))
+    return image, positions
+
+
+def benchmarkSpotFitting(numSpots=1000, numLoopSpots=50):
+    """
+    Compare quantifying spots one at a time with return_peak_intensity
+    from dataverse_files/fit_peak.py, which subtracts the background
+    and runs leastsq for every spot, against quantify_spots, which
+    subtracts the background once and fits all spots together.
+
+    Inputs:
+    - numSpots: the number of spots in the synthetic image (int)
+    - numLoopSpots: the number of spots quantified one at a time (int)
+
+    Effects:
+    - Prints the number of spots, the throughput of each method in
+    spots per second and whether the integrated intensities of the
+    spots quantified both ways match
+    """
+    from dataverse_files import fit_peak
+
+    image, positions = makeSpotField(numSpots)
+    loopIntensities, loopTime = timeCall(
+        lambda: [fit_peak.return_peak_intensity(image, position)
+                 for position in positions[:numLoopSpots]])
+    spots, batchTime = timeCall(fit_peak.quantify_spots, image, positions)
+    batchIntensities = spots['amplitude']*spots['sigma']**2
+
+    print('Spot fitting')
+    print('%-8s %14s %15s %8s %6s' % ('spots', 'loop (spots/s)', 'batch (spots/s)', 'speedup', 'match'))
+    loopRate = numLoopSpots/loopTime
+    batchRate = numSpots/batchTime
+    print('%-8d %14.3g %15.3g %7.1fx %6s' % (numSpots, loopRate, batchRate, batchRate/loopRate,
+                                             np.allclose(loopIntensities, batchIntensities[:numLoopSpots],
+                                                         rtol=1e-3)))
+
+
+#=========================================================================
+# Pipeline Suite
+#=========================================================================
+
+# Synthetic fields of the suite: (image size in pixels, number of
+# cells); both the size and the density of the cells grow
+SYNTHETIC_FIELDS = ((256, 16), (512, 100), (1024, 576), (2048, 3136))
+
+# Version of the saved results format
+RESULTS_VERSION = 1
+
+# Record of one crescent shaped cell of a synthetic field: the centre
+# and radius of its centre line, its width, the angle its centre line
+# starts at and the angle it spans (radians), all in pixels with x
+# along the columns and y along the rows
+CRESCENT_DTYPE = np.dtype([('cx', np.float64),
+                           ('cy', np.float64),
+                           ('radius', np.float64),
+                           ('width', np.float64),
+                           ('startAngle', np.float64),
+                           ('span', np.float64)])
+
+
+def getCrescentEnds(crescents):
+    """
+    Find the centres of the round caps at both ends of each crescent.
+
+    Inputs:
+    - crescents: the crescents (numpy array of CRESCENT_DTYPE)
+
+    Returns:
+    - startX, startY: the centre of the cap at the start angle of each
+                      crescent (float arrays, shaped like crescents)
+    - stopX, stopY: the centre of the cap at the stop angle of each
+                    crescent (float arrays, shaped like crescents)
+    """
+    startAngle = crescents['startAngle']
+    stopAngle = startAngle + crescents['span']
+    radius = crescents['radius']
+    return (crescents['cx'] + radius*np.cos(startAngle), crescents['cy'] + radius*np.sin(startAngle),
+            crescents['cx'] + radius*np.cos(stopAngle), crescents['cy'] + radius*np.sin(stopAngle))
+
+
+def insideCrescents(crescents, x, y, grow=0.0):
+    """
+    Check which points fall inside their crescent, optionally grown
+    by a margin all round.
+
+    Inputs:
+    - crescents: the crescent of each point (numpy array of
+                 CRESCENT_DTYPE)
+    - x, y: the coordinates of the points (float arrays)
+    - grow: the margin added to the half width (float)
+
+    Returns:
+    - inside: whether each point is inside (boolean array)
+    """
+    halfWidth = crescents['width']/2 + grow
+    dx, dy = x - crescents['cx'], y - crescents['cy']
+    angle = np.mod(np.arctan2(dy, dx) - crescents['startAngle'], 2*np.pi)
+    inArc = (np.abs(np.hypot(dx, dy) - crescents['radius']) <= halfWidth) & (angle <= crescents['span'])
+    startX, startY, stopX, stopY = getCrescentEnds(crescents)
+    inCaps = ((np.hypot(x - startX, y - startY) <= halfWidth)
+              | (np.hypot(x - stopX, y - stopY) <= halfWidth))
+    return inArc | inCaps
+
+
+def makeCrescentField(size, numCells, cellWidth=6.0, noise=6.0, seed=0):
+    """
+    Make a synthetic phase image of crescent shaped cells, one per
+    tile of a square grid. Each crescent is the band of width
+    cellWidth around an arc of a circle, closed by round caps, so its
+    boundary is made of circular arcs of known curvature. As in the
+    phase images, the cells are dark and surrounded by a bright halo.
+
+    Inputs:
+    - size: the side length of the image in pixels (int)
+    - numCells: the number of cells; tiles past the last cell stay
+                empty (int)
+    - cellWidth: the width of the cells in pixels (float)
+    - noise: the standard deviation of the pixel noise (float)
+    - seed: the seed of the random number generator (int)
+
+    Returns:
+    - image: the phase image (sitk Image of 8-bit pixels)
+    - crescents: the cells, in tile order (numpy array of
+                 CRESCENT_DTYPE)
+    - tileSize: the side length of the grid tiles in pixels (int)
+    """
+    rng = np.random.default_rng(seed)
+    tilesPerSide = int(np.ceil(np.sqrt(numCells)))
+    tileSize = size // tilesPerSide
+
+    # Random crescents that fit in their tiles with room for the halo
+    crescents = np.zeros(numCells, dtype=CRESCENT_DTYPE)
+    maxRadius = tileSize/2 - cellWidth - 4
+    crescents['radius'] = rng.uniform(cellWidth + 2, max(maxRadius, cellWidth + 2), numCells)
+    crescents['width'] = cellWidth
+    crescents['startAngle'] = rng.uniform(0, 2*np.pi, numCells)
+    crescents['span'] = rng.uniform(np.pi/3, np.pi, numCells)
+    tile = np.arange(numCells)
+    slack = maxRadius - crescents['radius']
+    crescents['cx'] = (tile % tilesPerSide + 0.5)*tileSize + rng.uniform(-1, 1, numCells)*slack
+    crescents['cy'] = (tile // tilesPerSide + 0.5)*tileSize + rng.uniform(-1, 1, numCells)*slack
+
+    # Draw every pixel against the crescent of its tile
+    rows, cols = np.indices((size, size))
+    pixelTiles = (np.minimum(rows // tileSize, tilesPerSide-1)*tilesPerSide
+                  + np.minimum(cols // tileSize, tilesPerSide-1))
+    hasCell = pixelTiles < numCells
+    pixelCrescents = crescents[np.where(hasCell, pixelTiles, 0)]
+    inCell = hasCell & insideCrescents(pixelCrescents, cols, rows)
+    inHalo = hasCell & insideCrescents(pixelCrescents, cols, rows, grow=3.0) & ~inCell
+
+    imageArray = np.full((size, size), 120.0)
+    imageArray[inHalo] = 200.0
+    imageArray[inCell] = 40.0
+    imageArray += rng.normal(0, noise, imageArray.shape)
+    imageArray = np.clip(np.rint(imageArray), 0, 255).astype(np.uint8)
+    return sitk.GetImageFromArray(imageArray), crescents, tileSize
+
+
+def getExpectedCurvatures(crescents, x, y):
+    """
+    Give the analytic curvature at points on the contour of their
+    crescents. The contour runs parallel to the boundary, so along the
+    sides it is a circle about the crescent centre and around the caps
+    a circle about the cap centre; its curvature is one over the
+    distance to that centre.
+
+    Inputs:
+    - crescents: the crescent of each point (numpy array of
+                 CRESCENT_DTYPE)
+    - x, y: the coordinates of the points (float arrays)
+
+    Returns:
+    - curvatures: the curvature expected at each point (float array)
+    """
+    dx, dy = x - crescents['cx'], y - crescents['cy']
+    angle = np.mod(np.arctan2(dy, dx) - crescents['startAngle'], 2*np.pi)
+    onSides = angle <= crescents['span']
+    startX, startY, stopX, stopY = getCrescentEnds(crescents)
+    capDistance = np.minimum(np.hypot(x - startX, y - startY), np.hypot(x - stopX, y - stopY))
+    return 1.0/np.where(onSides, np.hypot(dx, dy), capDistance)
+
+
+def measureCurvatureAccuracy(cells, points, crescents, tileSize):
+    """
+    Compare the measured curvatures of a synthetic field against the
+    analytic curvatures of its crescents. Each cell is matched to the
+    crescent of the grid tile holding the middle of its contour.
+
+    Inputs:
+    - cells: the saved cell table (numpy array of CELL_DTYPE)
+    - points: the saved point table (numpy array of POINT_DTYPE)
+    - crescents: the cells of the field (numpy array of CRESCENT_DTYPE)
+    - tileSize: the side length of the grid tiles in pixels (int)
+
+    Returns:
+    - accuracy: the number of cells matched to a crescent, and the
+                median absolute and mean relative error of the
+                curvatures of their points (dict)
+    """
+    tilesPerSide = int(np.ceil(np.sqrt(len(crescents))))
+    cellIdx = np.repeat(np.arange(len(cells)), cells['numPoints'])
+    x = points['x'].astype(np.float64)
+    y = points['y'].astype(np.float64)
+    numPoints = np.maximum(cells['numPoints'], 1)
+    middleX = np.bincount(cellIdx, x, minlength=len(cells)) / numPoints
+    middleY = np.bincount(cellIdx, y, minlength=len(cells)) / numPoints
+    cellTiles = (np.floor(middleY/tileSize).astype(np.int64)*tilesPerSide
+                 + np.floor(middleX/tileSize).astype(np.int64))
+    matched = (cellTiles >= 0) & (cellTiles < len(crescents))
+
+    pointMatched = matched[cellIdx]
+    pointCrescents = crescents[cellTiles[cellIdx][pointMatched]]
+    expected = getExpectedCurvatures(pointCrescents, x[pointMatched], y[pointMatched])
+    measured = points['curvature'][pointMatched].astype(np.float64)
+    valid = ~np.isnan(measured)
+    errors = np.abs(measured[valid] - expected[valid])
+    return {'numMatchedCells': int(len(np.unique(cellTiles[matched]))),
+            'medianAbsError': float(np.median(errors)) if len(errors) else None,
+            'meanRelError': float(np.mean(errors/expected[valid])) if len(errors) else None}
+
+
+def benchmarkCellShapes(fields=SYNTHETIC_FIELDS):
+    """
+    Time measuring the shapes of the cells of synthetic fields and
+    check them against their crescents: the centerline of a crescent
+    is its arc, closed by the caps, so it has the curvature one over
+    the radius, a length of the radius times the span plus the width,
+    and turns by the span plus the angle of the caps.
+
+    Inputs:
+    - fields: the synthetic fields, as (image size, number of cells)
+              (sequence of tuples)
+
+    Effects:
+    - Prints the number of cells of each field, the throughput of
+    measureCellShapes in cells per second and the median relative
+    error of each shape against its crescent
+    """
+    print('Cell shapes')
+    print('%-10s %6s %12s %10s %10s %10s %10s' % ('field', 'cells', 'cells/s', 'curvature',
+                                                  'length', 'bend', 'width'))
+    for size, numCells in fields:
+        image, crescents, tileSize = makeCrescentField(size, numCells)
+        labelMap = ccc.convertBinToLabelMap(ccc.segmentCells(image))
+        cells = ccc.getCellStatistics(labelMap)
+        elapsed = timeCall(ccc.measureCellShapes, labelMap, cells)[1]
+
+        # Match each cell to the crescent of the tile holding the
+        # middle of its bounding box
+        tilesPerSide = int(np.ceil(np.sqrt(numCells)))
+        cellTiles = (((cells['yStart'] + cells['yEnd'])//2 // tileSize)*tilesPerSide
+                     + (cells['xStart'] + cells['xEnd'])//2 // tileSize)
+        matched = cellTiles < numCells
+        cells, cellCrescents = cells[matched], crescents[cellTiles[matched]]
+        expected = {'centerlineCurvature': 1/cellCrescents['radius'],
+                    'centerlineLength': cellCrescents['radius']*cellCrescents['span'] + cellCrescents['width'],
+                    'bendAngle': cellCrescents['span'] + cellCrescents['width']/cellCrescents['radius'],
+                    'width': cellCrescents['width']}
+        errors = [np.median(np.abs(cells[name]/value - 1)) for name, value in expected.items()]
+        print('%-10s %6d %12.3g %10.2e %10.2e %10.2e %10.2e' % ('%dx%d' % (size, size), len(cells),
+                                                              len(cells)/elapsed, *errors))
+
+
+def benchmarkSpectralCurvature(fields=SYNTHETIC_FIELDS[:3], cutoffWavelengths=(4.0, 8.0, 16.0)):
+    """
+    Time each curvature engine on the contours of synthetic fields of
+    crescents and check their curvatures against the analytic ones;
+    the spectral engine is run with each cutoff wavelength.
+
+    Inputs:
+    - fields: the synthetic fields, as (image size, number of cells)
+              (sequence of tuples)
+    - cutoffWavelengths: the cutoffs of the spectral engine, in pixels
+                         (sequence of floats)
+
+    Effects:
+    - Prints, for each field and engine, the number of contour points,
+    the throughput in points per second and the median absolute and
+    mean relative error of the curvatures
+    """
+    engines = [('finiteDifference', {}), ('polynomialFit', {})]
+    engines += [('spectral', {'cutoffWavelength': cutoff}) for cutoff in cutoffWavelengths]
+
+    print('Spectral curvature')
+    print('%-10s %-22s %8s %12s %12s %12s' % ('field', 'engine', 'points', 'points/s',
+                                              'median err', 'mean rel err'))
+    for size, numCells in fields:
+        image, crescents, tileSize = makeCrescentField(size, numCells)
+        labelMap = ccc.convertBinToLabelMap(ccc.segmentCells(image))
+        cells = ccc.getCellStatistics(labelMap)
+        contours = ccc.extractCellContours(labelMap, cells=cells)[1]
+        for engine, settings in engines:
+            (curvatures, curves, offsets), elapsed = timeCall(
+                ccc.calculateContourCurvatures, contours, curvatureEngine=engine, **settings)
+            cells['numPoints'] = np.diff(offsets)
+            points = np.zeros(len(curvatures), dtype=ccc.POINT_DTYPE)
+            points['x'], points['y'] = np.concatenate(contours).T
+            points['curvature'] = curvatures
+            accuracy = measureCurvatureAccuracy(cells, points, crescents, tileSize)
+            name = engine + (' (%g px)' % settings['cutoffWavelength'] if settings else '')
+            print('%-10s %-22s %8d %12.3g %12.2e %12.2e' % ('%dx%d' % (size, size), name,
+                                                           len(curvatures), len(curvatures)/elapsed,
+                                                           accuracy['medianAbsError'],
+                                                           accuracy['meanRelError']))
+
+
+def benchmarkThreadScaling(size=2048, numCells=3136, maxThreads=None):
+    """
+    Time the multithreaded stages of the pipeline on a dense synthetic
+    field with 1 to maxThreads threads: the SimpleITK segmentation and
+    labelling, the per-cell contouring of the contourpy and
+    findContours engines and the polynomial fit curvature. Each stage
+    must give the same result with any number of threads.
+
+    Inputs:
+    - size: the side length of the field in pixels (int)
+    - numCells: the number of cells in the field (int)
+    - maxThreads: the largest number of threads; defaults to the
+                  number of CPUs (int)
+
+    Effects:
+    - Prints, for each number of threads, the time of each stage, its
+    speedup over one thread and whether every result matches the one
+    of one thread
+    """
+    if maxThreads is None:
+        maxThreads = multiprocessing.cpu_count()
+    image = makeCrescentField(size, numCells)[0]
+    engines = ['contourpy', 'findContours']
+    try:
+        importlib.import_module('dataverse_files.find_contours')
+    except (ImportError, IOError) as err:
+        print('Skipping the findContours engine:', err)
+        engines.remove('findContours')
+
+    def labelCells():
+        labelMap = ccc.convertBinToLabelMap(ccc.segmentCells(image))
+        return sitk.GetArrayFromImage(labelMap), labelMap
+
+    times = {}
+    results = {}
+    for numThreads in range(1, maxThreads+1):
+        ccc.setNumberOfThreads(numThreads)
+        (labelArray, labelMap), times['labelling'] = timeCall(labelCells)
+        cells = ccc.getCellStatistics(labelMap)
+        threadResults = {'labelling': labelArray}
+        for engine in engines:
+            contours, times[engine] = timeCall(lambda: ccc.extractCellContours(
+                labelMap, cells=cells, contourEngine=engine, numThreads=numThreads)[1])
+            threadResults[engine] = np.concatenate(contours)
+        curvatures, times['curvature'] = timeCall(lambda: ccc.calculateContourCurvatures(
+            contours, curvatureEngine='polynomialFit', numThreads=numThreads)[0])
+        threadResults['curvature'] = curvatures
+        if numThreads == 1:
+            oneThreadTimes = dict(times)
+            results = threadResults
+            print('Thread scaling (%dx%d field, %d cells)' % (size, size, len(cells)))
+            print('%-8s' % 'threads' + ''.join(' %18s' % ('%s (s)' % stage) for stage in times) + ' %6s' % 'match')
+        match = all(np.array_equal(results[stage], threadResults[stage], equal_nan=True)
+                    for stage in results)
+        print('%-8d' % numThreads
+              + ''.join(' %10.3f (%4.1fx)' % (times[stage], oneThreadTimes[stage]/times[stage])
+                        for stage in times)
+              + ' %6s' % match)
+    # Back to the default of one thread per CPU
+    ccc.setNumberOfThreads(multiprocessing.cpu_count())
+
+
+def profileImage(inputFn, workDir, curvatureEngine, makeFigures, repeats):
+    """
+    Run the whole pipeline on an image under the profiler a few times
+    and keep the fastest run.
+
+    Inputs:
+    - inputFn: the path to the image (string)
+    - workDir: the directory for the results and the profile log
+               (string)
+    - curvatureEngine: one of ccc.CURVATURE_ENGINES (string)
+    - makeFigures: whether to time the rendering of the figures
+                   (boolean)
+    - repeats: the number of runs (int)
+
+    Returns:
+    - record: the profile record of the fastest run (dict)
+    - figPath: the results directory of the image (string)
+    """
+    logFn = workDir+'/profile.jsonl'
+    outDir = workDir+'/'+curvatureEngine+'/'
+    for repeat in range(repeats):
+        ccc.processImage(inputFn, outDir=outDir, makeFigures=makeFigures,
+                         curvatureEngine=curvatureEngine,
+                         profiler=ccc.PipelineProfiler(logFn))
+    with open(logFn) as logFile:
+        records = [json.loads(line) for line in logFile][-repeats:]
+    return min(records, key=lambda record: record['totalWallSeconds']), ccc.getFigurePath(inputFn, outDir)
+
+
+def runPipelineSuite(inputFns, fields=SYNTHETIC_FIELDS, curvatureEngines=ccc.CURVATURE_ENGINES,
+                     makeFigures=False, repeats=3):
+    """
+    Time every stage of the pipeline on the sample images and on
+    synthetic fields of crescent shaped cells, and measure the
+    curvature accuracy on the synthetic fields, once per curvature
+    engine.
+
+    Inputs:
+    - inputFns: the paths of the sample images (list of strings)
+    - fields: the (size, number of cells) of each synthetic field
+              (sequence of pairs of ints)
+    - curvatureEngines: the curvature engines to run (sequence of
+                        strings)
+    - makeFigures: whether to time the rendering of the figures
+                   (boolean)
+    - repeats: the number of runs per image; the fastest counts (int)
+
+    Returns:
+    - results: the environment and one record per image and engine
+               (dict)
+
+    Effects:
+    - Prints one row per image and engine with the throughput, the
+    peak memory and, for synthetic fields, the curvature error
+    """
+    workDir = tempfile.mkdtemp()
+    try:
+        # The synthetic fields are saved as images so they go through
+        # the whole pipeline, loading included
+        images = [(inputFn, None, None) for inputFn in inputFns]
+        for size, numCells in fields:
+            image, crescents, tileSize = makeCrescentField(size, numCells)
+            inputFn = '%s/synthetic-%d-%d.png' % (workDir, size, numCells)
+            sitk.WriteImage(image, inputFn)
+            images.append((inputFn, crescents, tileSize))
+
+        print('Pipeline suite')
+        print('%-24s %-17s %6s %8s %9s %10s %10s %9s %10s' % ('image', 'curvature', 'cells', 'points',
+                                                          'images/s', 'cells/s', 'peak (MB)',
+                                                          'abs err', 'rel err'))
+        records = []
+        for inputFn, crescents, tileSize in images:
+            for curvatureEngine in curvatureEngines:
+                record, figPath = profileImage(inputFn, workDir, curvatureEngine, makeFigures, repeats)
+                name = inputFn.split('/')[-1]
+                record['image'] = name
+                record['curvatureEngine'] = curvatureEngine
+                record['imagesPerSecond'] = 1.0/record['totalWallSeconds']
+                record['cellsPerSecond'] = record['numCells']/record['totalWallSeconds']
+                record['stagePeakMemoryMB'] = max(stage['peakMemoryMB'] for stage in record['stages'].values())
+                del record['pid']
+                if crescents is not None:
+                    record['expectedCells'] = len(crescents)
+                    record.update(measureCurvatureAccuracy(np.load(figPath+ccc.CELLS_FN),
+                                                           np.load(figPath+ccc.POINTS_FN),
+                                                           crescents, tileSize))
+                records.append(record)
+
+                formatError = lambda error: '%9.4f' % error if error is not None else '%9s' % '-'
+                print('%-24s %-17s %6d %8d %9.2f %10.1f %10.1f %s %s' % (
+                    name, curvatureEngine, record['numCells'], record['numPoints'],
+                    record['imagesPerSecond'], record['cellsPerSecond'], record['stagePeakMemoryMB'],
+                    formatError(record.get('medianAbsError')), formatError(record.get('meanRelError'))))
+    finally:
+        shutil.rmtree(workDir)
+
+    return {'version': RESULTS_VERSION, 'environment': getEnvironment(),
+            'repeats': repeats, 'makeFigures': makeFigures, 'records': records}
+
+
+def getEnvironment():
+    """
+    Describe the machine and the code the benchmark ran on.
+
+    Returns:
+    - environment: the platform, library versions and git commit
+                   (dict)
+    """
+    environment = {'platform': platform.platform(),
+                   'processor': platform.processor(),
+                   'numCpus': os.cpu_count(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'SimpleITK': sitk.Version.VersionString(),
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    try:
+        environment['gitCommit'] = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                                  capture_output=True, text=True,
+                                                  check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        environment['gitCommit'] = None
+    return environment
+
+
+def compareResults(results, baseline, timeTolerance=0.25, minSlowdown=0.05, errorTolerance=1e-3):
+    """
+    Compare the results of the pipeline suite against the saved
+    results of an earlier version.
+
+    Inputs:
+    - results: the results of this run (dict)
+    - baseline: the saved results (dict)
+    - timeTolerance: the fraction by which an image may get slower
+                     before it counts as a regression (float)
+    - minSlowdown: the number of seconds by which an image must get
+                   slower to count as a regression, so the timing
+                   noise of small images is ignored (float)
+    - errorTolerance: how much the median absolute curvature error
+                      may grow before it counts as a regression
+                      (float)
+
+    Returns:
+    - regressions: a description of every regression (list of
+                   strings)
+
+    Effects:
+    - Prints the change in time and curvature error of every image
+    and engine found in both
+    """
+    baselineRecords = {(record['image'], record['curvatureEngine']): record
+                       for record in baseline['records']}
+    print('Comparison with %s' % baseline['environment'].get('gitCommit'))
+    print('%-24s %-17s %10s %10s %8s %10s %10s' % ('image', 'curvature', 'base (s)', 'now (s)',
+                                                   'change', 'base err', 'now err'))
+    regressions = []
+    for record in results['records']:
+        key = (record['image'], record['curvatureEngine'])
+        if key not in baselineRecords:
+            continue
+        old = baselineRecords[key]
+        change = record['totalWallSeconds']/old['totalWallSeconds'] - 1
+        oldError, newError = old.get('medianAbsError'), record.get('medianAbsError')
+        print('%-24s %-17s %10.3f %10.3f %+7.0f%% %10s %10s' % (
+            key[0], key[1], old['totalWallSeconds'], record['totalWallSeconds'], 100*change,
+            '-' if oldError is None else '%.4f' % oldError,
+            '-' if newError is None else '%.4f' % newError))
+
+        if change > timeTolerance and record['totalWallSeconds'] - old['totalWallSeconds'] > minSlowdown:
+            regressions.append('%s (%s): %.0f%% slower' % (key[0], key[1], 100*change))
+        if record['numCells'] != old['numCells']:
+            regressions.append('%s (%s): %d cells instead of %d' % (key[0], key[1], record['numCells'],
+                                                                   old['numCells']))
+        if oldError is not None and newError is not None and newError > oldError + errorTolerance:
+            regressions.append('%s (%s): curvature error %.4f instead of %.4f' % (key[0], key[1],
+                                                                                 newError, oldError))
+    for regression in regressions:
+        print('REGRESSION:', regression)
+    return regressions
+
+
+#=========================================================================
+# Main
+#=========================================================================
+
+def main():
+    # Set up the arg parser
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the cell curvature pipeline.")
+    parser.add_argument('--inGlob', type=str, default='./data/sample-0*.png', help='Glob matching the images to benchmark.')
+    parser.add_argument('--suiteOnly', action='store_true', help='Only run the pipeline suite, not the comparisons against the reference implementations.')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of runs per image in the pipeline suite; the fastest counts (default: %(default)s).')
+    parser.add_argument('--figures', action='store_true', help='Include the rendering of the figures in the pipeline suite.')
+    parser.add_argument('--save', type=str, default=None, help='JSON file in which to save the results of the pipeline suite.')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON file of saved results to check the pipeline suite against; exits with an error if it finds a regression.')
+    args = parser.parse_args()
+
+    inputFns = sorted(glob.glob(args.inGlob))
+    if not args.suiteOnly:
+        benchmarkLabelCapacity()
+        benchmarkContourExtraction(inputFns)
+        benchmarkContourEngines(inputFns)
+        benchmarkCurvature(inputFns)
+        benchmarkCurvatureFit(inputFns)
+        benchmarkCurvatureFit(inputFns, weighted=2)
+        benchmarkStageCache(inputFns)
+        benchmarkCurvatureSummary(inputFns)
+        benchmarkCellFilter(inputFns)
+        benchmarkParameterSweep(inputFns)
+        benchmarkService(inputFns)
+        benchmarkColdStart(inputFns)
+        benchmarkSpotFitting()
+        benchmarkCellShapes()
+        benchmarkSpectralCurvature()
+        benchmarkThreadScaling()
+        if inputFns:
+            benchmarkIngestionMemory(inputFns[0])
+            benchmarkMosaicTiling(inputFns[0])
+            benchmarkOverlayRendering(inputFns[0])
+
+    results = runPipelineSuite(inputFns, makeFigures=args.figures, repeats=args.repeats)
+    if args.save is not None:
+        with open(args.save, 'w') as resultsFile:
+            json.dump(results, resultsFile, indent=1)
+    if args.baseline is not None:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        if compareResults(results, baseline):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
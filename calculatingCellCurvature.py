@@ -9,22 +9,387 @@ with the contours and curvatures of the cells as well as a histogram
 of the curvature values.
 
 """
-import SimpleITK as sitk
-import pylab
 import numpy as np
-import matplotlib.pyplot as plt
 import os
+import sys
+import glob
+import json
+import time
+import signal
+import threading
+import importlib
+import itertools
 import argparse
+import contextlib
+import collections
+
+
+class LazyModule(object):
+    """
+    Stand-in for a module that is imported the first time one of its
+    attributes is used, so that importing this script does not pay for
+    libraries the caller never uses. On first use, the module takes
+    the place of the stand-in in the globals of this script.
+    """
+
+    def __init__(self, moduleName, globalName):
+        """
+        Inputs:
+        - moduleName: the name of the module to import (string)
+        - globalName: the name the module is known by here (string)
+        """
+        self.moduleName = moduleName
+        self.globalName = globalName
+
+    def __getattr__(self, name):
+        # import_module holds the import lock, so threads that get here
+        # at once import the module once
+        module = importlib.import_module(self.moduleName)
+        globals()[self.globalName] = module
+        return getattr(module, name)
+
+
+# SimpleITK takes about as long to import as numpy; it is imported by
+# the first stage that uses it
+sitk = LazyModule('SimpleITK', 'sitk')
+
+# Segmentation settings: the number of multithreshold Otsu thresholds
+# and the size and shape of the opening that removes small objects;
+# the shape is the name of a SimpleITK kernel type, looked up when the
+# opening runs
+OTSU_NUM_THRESHOLDS = 2
+OPENING_KERNEL_RADIUS = 2
+OPENING_KERNEL_TYPE = 'sitkBall'
+
+# Number of histogram bins the Otsu thresholds are chosen from; this is
+# the default of sitk.OtsuMultipleThresholdsImageFilter
+OTSU_NUM_BINS = 128
+
+# Level at which a cell mask (1 inside, 0 outside) is contoured; this
+# is the first of the levels plt.contour picks for such a mask
+CONTOUR_LEVEL = 0.0
+
+# Ways of tracing the cell contours: marching squares over the whole
+# label map at once, contourpy over the crop of each cell, or the
+# compiled tracer in dataverse_files/find_contours over the crop of
+# each cell
+CONTOUR_ENGINES = ('marchingSquares', 'contourpy', 'findContours')
+
+# Ways of calculating the curvature along a contour: finite differences
+# of the contour points, derivatives of local polynomials fit against
+# arc length (see dataverse_files/curvature_algorithm.py), or spectral
+# derivatives of the closed contour resampled evenly in arc length
+CURVATURE_ENGINES = ('finiteDifference', 'polynomialFit', 'spectral')
+
+# Half-width (in points) and order of the local polynomials of the
+# polynomialFit engine, and the curvature every value is capped at
+POLYNOMIAL_FIT_LENGTH = 5
+POLYNOMIAL_FIT_ORDER = 3
+CURVATURE_CAP = 1.0
+
+# The spectral engine drops every Fourier component of a contour whose
+# wavelength is shorter than this many pixels (the units of the contour
+# points), which removes the staircase of the pixel grid, and resamples
+# each contour to the power of two at or above its number of points,
+# but to no fewer than the smallest number of samples
+SPECTRAL_CUTOFF_WAVELENGTH = 8.0
+SPECTRAL_MIN_SAMPLES = 16
+
+# Number of Gauss-Newton steps that refine the circle fit to the
+# pixels of each cell, from which its centerline is measured
+CENTERLINE_FIT_ITERATIONS = 5
+
+# Number of directions, evenly spread around the circle, in which the
+# convex hull of each cell is measured for its solidity
+HULL_NUM_DIRECTIONS = 32
+
+# Reasons a component of the label map is rejected before it is
+# contoured (see CellFilter)
+FILTER_REASONS = ('area', 'aspect', 'solidity', 'border')
+
+# Colormap of the curvature overlay and how opaque the curvatures are
+# over the phase image; curvatures from 0 to 1 (where they are capped)
+# span the whole colormap
+OVERLAY_COLORMAP = 'rainbow'
+OVERLAY_ALPHA = 1.0
+
+# Names of the per-image results files. The cell table is written
+# last, so an image whose cell table exists has been processed
+CELLS_FN = 'cells.npy'
+POINTS_FN = 'points.npy'
+
+# Name of the summary of the curvatures of each image and of the whole
+# experiment, the number of equal bins from 0 to 1 that the summaries
+# count curvatures in (their medians and percentiles are known to
+# within a bin) and the number of bars of the curvature histogram,
+# which must divide it
+SUMMARY_FN = 'summary.json'
+EXPERIMENT_SUMMARY_FN = 'experiment-summary.json'
+SUMMARY_NUM_BINS = 4000
+HISTOGRAM_NUM_BINS = 20
+
+# One record per cell: its label, area in pixels, bounding box
+# (end-exclusive), where its points start in the point table, how many
+# boundaries it has, a summary of its contour (whose length is the
+# perimeter of the cell) and curvature, and its shape (see
+# measureCellShapes)
+CELL_DTYPE = np.dtype([('label', np.uint32),
+                       ('area', np.uint32),
+                       ('xStart', np.int32),
+                       ('yStart', np.int32),
+                       ('xEnd', np.int32),
+                       ('yEnd', np.int32),
+                       ('pointOffset', np.int64),
+                       ('numPoints', np.uint32),
+                       ('numOuterRings', np.uint16),
+                       ('numInnerRings', np.uint16),
+                       ('contourLength', np.float32),
+                       ('curvatureMin', np.float32),
+                       ('curvatureMean', np.float32),
+                       ('curvatureMax', np.float32),
+                       ('curvatureStd', np.float32),
+                       ('majorAxisLength', np.float32),
+                       ('minorAxisLength', np.float32),
+                       ('solidity', np.float32),
+                       ('centerlineLength', np.float32),
+                       ('width', np.float32),
+                       ('bendAngle', np.float32),
+                       ('centerlineCurvature', np.float32)])
+
+# One record per contour point: its sub-pixel position and curvature
+POINT_DTYPE = np.dtype([('x', np.float32),
+                        ('y', np.float32),
+                        ('curvature', np.float32)])
+
+# Name of the results file of a time-lapse stack, and the smallest
+# overlap (intersection over union) at which a cell in one frame is
+# taken to be the same cell as one in the previous frame
+TRACKS_FN = 'tracks.npy'
+TRACK_MIN_OVERLAP = 0.3
+
+# One record per cell per frame of a time-lapse stack: the frame, the
+# track the cell belongs to and the cell record without its point
+# offset, since the contour points of a stack are not saved
+TRACK_DTYPE = np.dtype([('frame', np.uint32), ('track', np.uint32)]
+                       + [(name, CELL_DTYPE[name]) for name in CELL_DTYPE.names
+                          if name != 'pointOffset'])
+
+# Stages whose results can be cached between runs, the version of
+# their cached form (change it to invalidate old entries) and the
+# default size limit of the cache
+CACHE_STAGES = ('segmentation', 'labelMap', 'contours')
+CACHE_VERSION = 2
+CACHE_MAX_MB = 1024
+
+# Stages of processImage that are timed when profiling; with the
+# cache, segmentation and labeling are timed together as labelMap
+PROFILE_STAGES = ('load', 'channelExtraction', 'segmentation', 'labeling', 'labelMap',
+                  'cellStatistics', 'contouring', 'curvature', 'rendering', 'saving')
+
+# Default size of the square tiles a mosaic is processed in, and how
+# far each tile's window reaches past the tile on every side; a cell
+# that fits in the window of the tile holding its first pixel is
+# measured by that tile
+MOSAIC_TILE_SIZE = 2048
+MOSAIC_TILE_OVERLAP = 64
+
+# Extensions picked up when a directory is given in batch mode
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+# Number of chunks per thread the per-cell work is split into, so that
+# threads that finish early pick up more work
+CHUNKS_PER_THREAD = 4
+
+# Stages of a parameter sweep, in pipeline order, with the parameters
+# each one adds; a stage's result depends on its own parameters and
+# those of every stage before it. The opening stage also labels,
+# measures and filters the cells. The default value of each parameter
+# is the one processImage uses
+SWEEP_STAGES = (('otsu', ('numThresholds',)),
+                ('opening', ('kernelRadius',)),
+                ('contours', ('contourEngine',)),
+                ('curvature', ('curvatureEngine', 'fitLen', 'fitOrder', 'cutoffWavelength',
+                               'curvatureCap')))
+SWEEP_DEFAULTS = {'numThresholds': OTSU_NUM_THRESHOLDS,
+                  'kernelRadius': OPENING_KERNEL_RADIUS,
+                  'contourEngine': 'marchingSquares',
+                  'curvatureEngine': 'finiteDifference',
+                  'fitLen': POLYNOMIAL_FIT_LENGTH,
+                  'fitOrder': POLYNOMIAL_FIT_ORDER,
+                  'cutoffWavelength': SPECTRAL_CUTOFF_WAVELENGTH,
+                  'curvatureCap': CURVATURE_CAP}
+# Parameters that only one curvature engine uses, and that engine
+SWEEP_ENGINE_PARAMETERS = {'fitLen': 'polynomialFit',
+                           'fitOrder': 'polynomialFit',
+                           'cutoffWavelength': 'spectral'}
+SWEEP_FN = 'sweep.npy'
+
+# One row of the sweep table per configuration: its parameters, what
+# was measured over all images and the statistics of the curvatures
+# of every contour point and of every cell (its mean curvature)
+SWEEP_DTYPE = np.dtype([('numThresholds', np.uint32),
+                        ('kernelRadius', np.uint32),
+                        ('contourEngine', 'U16'),
+                        ('curvatureEngine', 'U16'),
+                        ('fitLen', np.uint32),
+                        ('fitOrder', np.uint32),
+                        ('cutoffWavelength', np.float32),
+                        ('curvatureCap', np.float32),
+                        ('numImages', np.uint32),
+                        ('numCells', np.uint64),
+                        ('numRejected', np.uint64),
+                        ('numPoints', np.uint64),
+                        ('meanArea', np.float32),
+                        ('curvatureMean', np.float32),
+                        ('curvatureStd', np.float32),
+                        ('curvatureMedian', np.float32),
+                        ('curvatureP5', np.float32),
+                        ('curvatureP95', np.float32),
+                        ('cellCurvatureMean', np.float32),
+                        ('cellCurvatureMedian', np.float32)])
+
+# Analysis service: the address it listens on by default, how many
+# requests may wait in its queue before new ones are turned away, how
+# many recent requests its latency percentiles are taken over and how
+# long a request waits for its result (seconds)
+SERVICE_HOST = '127.0.0.1'
+SERVICE_QUEUE_SIZE = 16
+SERVICE_LATENCY_WINDOW = 1000
+SERVICE_TIMEOUT = 300
 
 #=========================================================================
 # Function Definitions
 #=========================================================================
 
+#-------------------------------------------------------------------------
+# Part 0: Load the image
+#-------------------------------------------------------------------------
+
+def loadImage(inputFn):
+    """
+    Read a phase image from disk and reduce it to a single channel.
+
+    Inputs:
+    - inputFn: the path to the image file (.png, .jpg, etc) (string)
+
+    Returns:
+    - image: the single channel image (sitk Image)
+    """
+    return extractFirstChannel(readImageFile(inputFn))
+
+
+def readImageFile(inputFn):
+    """
+    Read an image from disk as it is stored.
+
+    Inputs:
+    - inputFn: the path to the image file (.png, .jpg, etc) (string)
+
+    Returns:
+    - image: the image, with all of its channels (sitk Image)
+    """
+    # Load the file
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(inputFn)
+    return reader.Execute()
+
+
+def getImageSize(inputFn):
+    """
+    Read the size of an image from its header, without reading its
+    pixels.
+
+    Inputs:
+    - inputFn: the path to the image file (.png, .jpg, etc) (string)
+
+    Returns:
+    - size: the (width, height) of the image (tuple of ints)
+    """
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(inputFn)
+    reader.ReadImageInformation()
+    return tuple(reader.GetSize()[:2])
+
+
+def readImageRegion(inputFn, box):
+    """
+    Read one region of an image from disk and reduce it to a single
+    channel. Formats that support streaming (.mha, .nrrd, .tif, etc)
+    only read the region; others read the whole image and crop it.
+
+    Inputs:
+    - inputFn: the path to the image file (.png, .jpg, etc) (string)
+    - box: the region to read, as (xStart, yStart, xEnd, yEnd),
+           end-exclusive (tuple of ints)
+
+    Returns:
+    - image: the single channel image of the region (sitk Image)
+    """
+    xStart, yStart, xEnd, yEnd = box
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(inputFn)
+    reader.SetExtractIndex([int(xStart), int(yStart)])
+    reader.SetExtractSize([int(xEnd-xStart), int(yEnd-yStart)])
+    return extractFirstChannel(reader.Execute())
+
+
+def extractFirstChannel(image):
+    """
+    Reduce an RGB(A) image to its first channel; single channel images
+    are returned as they are.
+
+    Inputs:
+    - image: the image (sitk Image)
+
+    Returns:
+    - image: the single channel image (sitk Image)
+    """
+    # If the pixels have 3 or 4 components, they have been loaded as
+    # RGB(A) images. All 3 RGB channels contain the same information,
+    # and the 4th channel is full of 255s. We extract one channel and
+    # use that channel as the image for processing purposes.
+    if image.GetNumberOfComponentsPerPixel() in (3, 4):
+        # Pull the first channel straight out of the vector image,
+        # without going through a copy of all channels as an array
+        imageOneChannel = sitk.VectorIndexSelectionCast(image, 0)
+        # Check the information of the single channel image is correct
+        assert imageOneChannel.GetSize() == image.GetSize()
+        assert imageOneChannel.GetDimension() == image.GetDimension()
+        assert imageOneChannel.GetNumberOfComponentsPerPixel() == 1
+        assert imageOneChannel.GetPixelIDTypeAsString() == "8-bit unsigned integer"
+        # Use the first channel as the image
+        image = imageOneChannel
+
+    return image
+
+
+def getFrameImage(frameArray):
+    """
+    Turn one frame of a time-lapse stack into a single channel image,
+    taking the first channel of RGB(A) frames as loadImage does.
+
+    Inputs:
+    - frameArray: the pixels of the frame (2D array, or 3D with the
+                  channels last)
+
+    Returns:
+    - image: the single channel image (sitk Image)
+    """
+    if frameArray.ndim == 3:
+        frameArray = frameArray[:, :, 0]
+    # SimpleITK needs native byte order; this also copies the frame
+    # out of a memory map
+    frameArray = np.ascontiguousarray(frameArray, dtype=frameArray.dtype.newbyteorder('='))
+    return sitk.GetImageFromArray(frameArray)
+
+
 #-------------------------------------------------------------------------
 # Part 1: Segment the image and identify individual cells
 #-------------------------------------------------------------------------
 
-def segmentCells(origImage, saveIntermediate=False, figFilePath="./"):
+def segmentCells(origImage, saveIntermediate=False, figFilePath="./",
+                 numThresholds=OTSU_NUM_THRESHOLDS, kernelRadius=OPENING_KERNEL_RADIUS,
+                 kernelType=OPENING_KERNEL_TYPE, thresholds=None):
     """
     Segment the cells in the original image using multithreshold
     Otsu thresholding followed by opening (to remove small, non-cell
@@ -36,45 +401,174 @@ def segmentCells(origImage, saveIntermediate=False, figFilePath="./"):
                         intermediate images (boolean)
     - figFilePath: the path to the location where the figure
                    will be saved (string)
+    - numThresholds: the number of Otsu thresholds (int)
+    - kernelRadius: the radius of the opening kernel (int)
+    - kernelType: the shape of the opening kernel (sitk kernel type,
+                  or the name of one)
+    - thresholds: Otsu thresholds computed elsewhere, such as from
+                  the histogram of a whole mosaic (see
+                  getOtsuThresholds), to use instead of those of this
+                  image (list of floats)
 
     Returns:
     - segImage: the segmented image (sitk Image)
     """
+    segImage = thresholdCells(origImage, numThresholds=numThresholds, thresholds=thresholds,
+                              saveIntermediate=saveIntermediate, figFilePath=figFilePath)
+    segImage = openSegmentation(segImage, kernelRadius=kernelRadius, kernelType=kernelType)
+
+    # Save the clean segmentation
+    if saveIntermediate:
+        import matplotlib.pyplot as plt
+        outFn = figFilePath+"01-segmentation.png"
+        plt.imsave(outFn, sitk.GetArrayViewFromImage(segImage), cmap='gray')
+
+    return segImage 
+
+
+def thresholdCells(origImage, numThresholds=OTSU_NUM_THRESHOLDS, thresholds=None,
+                   saveIntermediate=False, figFilePath="./"):
+    """
+    Find the darkest class of the multithreshold Otsu thresholding of
+    the original image, which holds the cells: the first step of
+    segmentCells.
+
+    Inputs:
+    - origImage: the original image (sitk Image)
+    - numThresholds: the number of Otsu thresholds (int)
+    - thresholds: Otsu thresholds computed elsewhere, to use instead
+                  of those of this image (list of floats)
+    - saveIntermediate: flag to indicate whether to save
+                        intermediate images (boolean)
+    - figFilePath: the path to the location where the figure
+                   will be saved (string)
+
+    Returns:
+    - segImage: the raw segmentation (sitk Image of 8-bit 0/1 pixels)
+    """
+    if thresholds is not None:
+        # The darkest class holds every pixel at or below the first
+        # threshold; the pixels are integers, so the threshold can be
+        # rounded down to the pixel type
+        return origImage <= int(np.floor(thresholds[0]))
+
     # Apply a multiple threshold Otsu filter to the image
     thresholdFilter = sitk.OtsuMultipleThresholdsImageFilter()
-    thresholdFilter.SetNumberOfThresholds(2)
+    thresholdFilter.SetNumberOfThresholds(numThresholds)
     otsuImage = thresholdFilter.Execute(origImage)
-    otsuArray = sitk.GetArrayFromImage(otsuImage)
-    
+
     # Save the raw segmentation
     if saveIntermediate:
+        import matplotlib.pyplot as plt
         outFn = figFilePath+"00-multithreshold-otsu-filtered.png"
-        plt.imsave(outFn, otsuArray, cmap='gray')
-    
+        plt.imsave(outFn, sitk.GetArrayViewFromImage(otsuImage), cmap='gray')
+
     # Extract the values we care about from the filtered image
     # We know the cells in the phase images should be the darkest
-    # Get the darkest thresholded values
-    segArray = 1*(otsuArray==0) # (otsuArray==0) produces booleans, multiplying by 1 makes the values int64
-    # convert the array back to an image
-    segImage = sitk.GetImageFromArray(segArray)
-    
-    # Pass the segmentation through an opening filter to remove small
-    # objects that are not cells
+    # Get the darkest thresholded values; the comparison stays in
+    # SimpleITK and gives an 8-bit 0/1 image, with no array copies
+    return otsuImage == 0
+
+
+def openSegmentation(segImage, kernelRadius=OPENING_KERNEL_RADIUS, kernelType=OPENING_KERNEL_TYPE):
+    """
+    Pass the raw segmentation through an opening filter to remove
+    small objects that are not cells: the second step of segmentCells.
+
+    Inputs:
+    - segImage: the raw segmentation (sitk Image)
+    - kernelRadius: the radius of the opening kernel (int)
+    - kernelType: the shape of the opening kernel (sitk kernel type,
+                  or the name of one)
+
+    Returns:
+    - segImage: the opened segmentation (sitk Image)
+    """
+    if isinstance(kernelType, str):
+        kernelType = getattr(sitk, kernelType)
     openingFilter = sitk.BinaryMorphologicalOpeningImageFilter()
-    openingFilter.SetKernelRadius(2)
-    openingFilter.SetKernelType(sitk.sitkBall)
-    segImage = openingFilter.Execute(segImage)
-    
-    # Save the clean segmentation
-    if saveIntermediate:
-        outFn = figFilePath+"01-segmentation.png"
-        segArray = sitk.GetArrayFromImage(segImage)
-        plt.imsave(outFn, segArray, cmap='gray')
+    openingFilter.SetKernelRadius(kernelRadius)
+    openingFilter.SetKernelType(kernelType)
+    return openingFilter.Execute(segImage)
 
-    return segImage 
+
+def getOtsuThresholds(histogram, numThresholds=OTSU_NUM_THRESHOLDS, numBins=OTSU_NUM_BINS):
+    """
+    Compute multithreshold Otsu thresholds from a histogram of the
+    pixel values, the way sitk.OtsuMultipleThresholdsImageFilter does
+    from the image itself: the range of the pixel values is split
+    into equal bins, every combination of thresholds at the bin edges
+    is tried and the one with the largest between-class variance is
+    kept. Only the histogram is needed, so the thresholds of an image
+    too large to hold in memory can be found from the histograms of
+    its parts.
+
+    Inputs:
+    - histogram: the number of pixels of each value, indexed by the
+                 value (int array)
+    - numThresholds: the number of Otsu thresholds (int)
+    - numBins: the number of bins the value range is split into (int)
+
+    Returns:
+    - thresholds: the upper edge of the bin at each threshold, in
+                  increasing order (list of floats)
+    """
+    histogram = np.asarray(histogram)
+    values = np.flatnonzero(histogram)
+    lower = float(values[0])
+    # The range is widened by a hundredth of a bin, so that the largest
+    # value falls inside the last bin
+    upper = float(values[-1])
+    upper += (upper-lower)/numBins/100.0
+    binWidth = (upper-lower)/numBins
+    binMins = lower + np.arange(numBins)*binWidth
+    binMaxs = lower + np.arange(1, numBins+1)*binWidth
+    binMaxs[-1] = upper
+    bins = np.searchsorted(binMins, values, side='right')-1
+    frequency = np.bincount(bins, weights=histogram[values], minlength=numBins)
+
+    # Every pixel counts as the middle of its bin
+    binMiddles = (binMins+binMaxs)/2
+    cumFrequency = np.concatenate([[0], np.cumsum(frequency)])
+    cumMoment = np.concatenate([[0], np.cumsum(frequency*binMiddles)])
+
+    # Every combination of threshold bins, in the order ITK tries them
+    # (the last class keeps at least one bin); the first of equally
+    # good combinations wins, as in ITK
+    combinations = np.array(list(itertools.combinations(range(numBins-1), numThresholds)))
+    classEdges = np.column_stack([np.zeros(len(combinations), dtype=np.int64),
+                                  combinations+1,
+                                  np.full(len(combinations), numBins)])
+    classFrequency = np.diff(cumFrequency[classEdges], axis=1)
+    classMoment = np.diff(cumMoment[classEdges], axis=1)
+    # The between-class variance, up to terms that are the same for
+    # every combination
+    with np.errstate(invalid='ignore', divide='ignore'):
+        varBetween = np.where(classFrequency > 0, classMoment**2/classFrequency, 0).sum(axis=1)
+    best = combinations[np.argmax(varBetween)]
+
+    return [float(binMaxs[i]) for i in best]
+
+
+def getLabelPixelType(numLabels):
+    """
+    Choose the narrowest unsigned integer pixel type that can hold
+    the given number of labels plus the background.
+
+    Inputs:
+    - numLabels: the number of labels, not counting the background (int)
+
+    Returns:
+    - pixelType: the SimpleITK pixel type (sitk pixel ID)
+    """
+    if numLabels <= np.iinfo(np.uint8).max:
+        return sitk.sitkUInt8
+    if numLabels <= np.iinfo(np.uint16).max:
+        return sitk.sitkUInt16
+    return sitk.sitkUInt32
 
 
-def convertBinToLabelMap(segImage, saveIntermediate=False, figFilePath="./"):
+def convertBinToLabelMap(segImage, saveIntermediate=False, figFilePath="./", verbose=True):
     """
     Convert the binary segmentation image to a label map.
     Each component of the label map will be labelled using
@@ -88,6 +582,8 @@ def convertBinToLabelMap(segImage, saveIntermediate=False, figFilePath="./"):
                         intermediate images (boolean)
     - figFilePath: the path to the location where the figure
                    will be saved (string)
+    - verbose: flag to indicate whether to print the number of
+               labels (boolean)
     
     Returns:
     - labelImage: the label map image (sitk Image)
@@ -95,30 +591,40 @@ def convertBinToLabelMap(segImage, saveIntermediate=False, figFilePath="./"):
     # Set up label map filter
     convertToLabelMap = sitk.BinaryImageToLabelMapFilter()
     labelMap = convertToLabelMap.Execute(segImage)
+    # The filter runs on SimpleITK's default number of threads (see
+    # setNumberOfThreads)
     labelImageFilter = sitk.LabelMapToLabelImageFilter()
-    labelImageFilter.SetNumberOfThreads(4)
     labelImage = labelImageFilter.Execute(labelMap)
 
-    # Show the label map
-    pylab.set_cmap('terrain')
-    pylab.imshow(sitk.GetArrayFromImage(labelImage))
-
-    # Print information about the label image
-    labelArray = sitk.GetArrayFromImage(labelImage)
-    print("Number of labels in the label map (including background):",
-          np.amax(labelArray)-np.amin(labelArray)+1)
+    # The labels run from 1 to the number of components, so the count
+    # tells us the narrowest pixel type that can hold every label
+    numLabels = convertToLabelMap.GetNumberOfObjects()
+    labelPixelType = getLabelPixelType(numLabels)
 
     # Need to change the pixel types
-    castFilter = sitk.CastImageFilter()
-    castFilter.SetOutputPixelType(sitk.sitkUInt8)
-    labelImage = castFilter.Execute(labelImage)
+    if labelImage.GetPixelID() != labelPixelType:
+        castFilter = sitk.CastImageFilter()
+        castFilter.SetOutputPixelType(labelPixelType)
+        labelImage = castFilter.Execute(labelImage)
 
-    # The pixel type should be "8-bit unsigned integer"
-    assert labelImage.GetPixelIDTypeAsString() == "8-bit unsigned integer"
+    # The pixel type should be able to hold every label
+    assert labelImage.GetPixelID() == labelPixelType
+
+    # Print information about the label image
+    if verbose:
+        print("Number of labels in the label map (including background):",
+              numLabels+1)
 
     if saveIntermediate:
+        import matplotlib.pyplot as plt
+        # Show the label map under the contours drawn by getCellContour;
+        # the figure keeps the array, so it gets a copy rather than a
+        # view of the label image's buffer
+        labelArray = sitk.GetArrayFromImage(labelImage)
+        plt.set_cmap('terrain')
+        plt.imshow(labelArray)
+
         outFn = figFilePath+"02-labelmap.png"
-        segArray = sitk.GetArrayFromImage(segImage)
         plt.imsave(outFn, labelArray, cmap='nipy_spectral')
 
     return labelImage
@@ -128,243 +634,4425 @@ def convertBinToLabelMap(segImage, saveIntermediate=False, figFilePath="./"):
 # Part 2: Estimate Cell Curvature
 #-------------------------------------------------------------------------
 
-def getCellContour(cellImage, saveIntermediate=False, figFilePath="./"):
+def setNumberOfThreads(numThreads):
     """
-    Given a binary image of a cell, get the contour for that cell.
-    
+    Set the number of threads every SimpleITK filter made from now on
+    runs on, in this process.
+
     Inputs:
-    - cellImage: binary image mask of one cell (sitk Image)
-    - saveIntermediate: flag to indicate whether to save
-                        intermediate images (boolean)
-    - figFilePath: the path to the location where the figure
-                   will be saved (string)
-    
-    Returns:
-    - contourPixels: a list of coordinates that represent the contour
-                     of the cell
+    - numThreads: the number of threads; None keeps SimpleITK's
+                  default of one per CPU (int)
     """
-    contourPixels = []
+    if numThreads is not None:
+        sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(numThreads)
 
-    # make a contour object of the segmented image
-    contourObj = plt.contour(sitk.GetArrayFromImage(cellImage))
-    paths = contourObj.collections[0].get_paths()[0]
-    contourPixels = paths.vertices
-    
-    # save the contours to a file; saves all contours to one file because
-    # of how this function is called
-    if saveIntermediate:
-        outFn = figFilePath+"03-contours.png"
-        pylab.savefig(outFn, bbox_inches='tight')
 
-    return contourPixels
+def mapInChunks(func, offsets, numThreads=None):
+    """
+    Run a function over consecutive chunks of a sequence of items in
+    a thread pool. The chunks hold about the same amount of work, and
+    the results come back in the order of the chunks whichever thread
+    finishes first, so the output does not depend on the number of
+    threads. NumPy, contourpy and the compiled contour tracer release
+    the GIL while they work, so the threads run at the same time.
 
+    Inputs:
+    - func: the function to run on a chunk; it is called with the
+            index of the first and one past the last item of the chunk
+    - offsets: the cumulative amount of work before each item,
+               followed by the total (array of numbers)
+    - numThreads: the number of threads; None or 1 runs the whole
+                  sequence in the calling thread (int)
 
-def calculateContourCurvature(contourPixels):
+    Returns:
+    - results: the result of each chunk, in order (list)
     """
-    Calculate the curvature of the contour of a cell.
+    numItems = len(offsets)-1
+    if numThreads is None or numThreads <= 1 or numItems < 2:
+        return [func(0, numItems)]
+    numChunks = min(numThreads*CHUNKS_PER_THREAD, numItems)
+    bounds = np.searchsorted(offsets, np.linspace(0, offsets[-1], numChunks+1)[1:-1])
+    bounds = np.unique(np.concatenate([[0], np.clip(bounds, 1, numItems-1), [numItems]]))
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=numThreads) as executor:
+        return list(executor.map(func, bounds[:-1], bounds[1:]))
+
+
+def getCellStatistics(labelImage):
+    """
+    Measure the area and bounding box of every cell in the label map.
+    The label shape statistics filter visits the label map once, so
+    all of the cells are measured in a single pass over the image.
 
     Inputs:
-    - contourPixels: the binary image of the skeleton of the cell
+    - labelImage: the label map image (sitk Image)
 
     Returns:
-    - contourCurvatures: the curvature of the skeleton of the cell
-    - contourPixels: the locations of the curvature, as integers
+    - cells: one record per cell in label order, with the label, area
+             and bounding box filled in (numpy array of CELL_DTYPE)
     """
-    # Calculate components for curvature
-    # Get first derivatives in x and y
-    contourPixels = np.asarray(contourPixels)
-    dx = np.gradient(contourPixels[:, 0])
-    dy = np.gradient(contourPixels[:, 1])
+    shapeFilter = sitk.LabelShapeStatisticsImageFilter()
+    shapeFilter.Execute(labelImage)
 
-    # Get second derivatives in x and y
-    dx2 = np.gradient(dx)
-    dy2 = np.gradient(dy) 
+    labels = sorted(shapeFilter.GetLabels())
+    cells = np.zeros(len(labels), dtype=CELL_DTYPE)
+    for i, label in enumerate(labels):
+        # The box is given as (x, y, sizeX, sizeY)
+        x, y, sizeX, sizeY = shapeFilter.GetBoundingBox(label)
+        cells[i]['label'] = label
+        cells[i]['area'] = shapeFilter.GetNumberOfPixels(label)
+        cells[i]['xStart'] = x
+        cells[i]['yStart'] = y
+        cells[i]['xEnd'] = x+sizeX
+        cells[i]['yEnd'] = y+sizeY
 
-    # Calculate the curvature of the curve
-    contourCurvature = np.abs(dx2*dy - dx*dy2)/(dx*dx + dy*dy)**1.5
-    
-    # Threshold curvature values over 1 to be 1
-    for i in range(len(contourCurvature)):
-        if contourCurvature[i] > 1.0:
-            contourCurvature[i] = 1.0            
-    
-    # Since the contour points may not be integers, make sure they are
-    if type(contourPixels[0, 0]) is not int:
-        contourPixels = [[int(round(pt[1])), int(round(pt[0]))] for pt in contourPixels]
+    return cells
 
-    return contourCurvature, contourPixels
 
+def getCellBoundingBoxes(labelImage, padding=1, cells=None):
+    """
+    Find the padded bounding box of every cell in the label map.
 
-#-------------------------------------------------------------------------
-# Part 3: Generate resulting images
-#-------------------------------------------------------------------------
+    Inputs:
+    - labelImage: the label map image (sitk Image)
+    - padding: number of background pixels to add on each side of
+               the bounding box (int)
+    - cells: the cell statistics of the label map, if they have
+             already been measured (numpy array of CELL_DTYPE)
 
-def saveCurvatureOverlay(origImage, curves, curvatures, figFilePath='./'):
+    Returns:
+    - boundingBoxes: a list of (label, (xStart, yStart, xEnd, yEnd))
+                     tuples in label order; the boxes are padded,
+                     clipped to the image and end-exclusive
     """
-    Show the curvatures of the cells on the original image.
-    
-    Inputs:
-    - origImage: the original greyscale image (sitk Image)
-    - curves: the locations of the cell curves (list of lists of ints)
-    - curvatures: the curvatures of the curves (list of floats)
-    - figFilePath: the path to the location where the figure
-                   will be saved (string)
-                   
-    Effects:
-    - Makes a composite image consisting of the original image
-    overlaid with colored versions of the curvatures. Also includes
-    a colorbar.
-    """
-    # Make a new figure and show the original image
-    pylab.figure(figsize=(35,25))
-    pylab.set_cmap('gray')
-    pylab.imshow(sitk.GetArrayFromImage(origImage))
-
-    # Set up the overlay image
-    shape = origImage.GetSize()
-    overlay = np.zeros((shape[1], shape[0]))
-    # Make the value 0.0 appear transparent
-    overlay[overlay == 0.0] = np.nan
-
-    # Iterate through the curve points and curvatures
-    for point, value in zip(curves, curvatures):
-        # Since we're capping the curvature value at 1 (potential miscalculations),
-        # make sure the curvature values being plotted are at most 1.
-        if value < 1:
-            overlay[point[0], point[1]] = value
-        else:
-            overlay[point[0], point[1]] = 1
-    
-    # Combine the overlay image and the original image
-    pylab.imshow(overlay, 'rainbow', alpha=1)
-    # Add a colorbar
-    pylab.colorbar()
+    if cells is None:
+        cells = getCellStatistics(labelImage)
+    width, height = labelImage.GetSize()
 
-    # Save the image with the curvatures
-    outFn = figFilePath+'curvatures.png'
-    pylab.savefig(outFn, bbox_inches='tight')
+    boundingBoxes = []
+    for cell in cells:
+        # Pad the box so the contour can close around the cell, but
+        # stay inside the image
+        xStart = max(int(cell['xStart'])-padding, 0)
+        yStart = max(int(cell['yStart'])-padding, 0)
+        xEnd = min(int(cell['xEnd'])+padding, width)
+        yEnd = min(int(cell['yEnd'])+padding, height)
+        boundingBoxes.append((int(cell['label']), (xStart, yStart, xEnd, yEnd)))
 
+    return boundingBoxes
 
-def saveCurvatureHistogram(curvatures, figFilePath='./'):
+
+def measureCellShapes(labelImage, cells):
     """
-    Given the list of curvature values, create a histogram of those
-    values and save the histogram as a figure.
-    
+    Measure the shape of every cell from its pixels, which are
+    gathered for all cells at once in one pass over the label map:
+    its outline (see measureCellOutlines) and its centerline (see
+    measureCellCenterlines). Pixel positions are taken from the
+    corner of each cell's bounding box, so the shapes do not depend
+    on where the label map starts.
+
     Inputs:
-    - curvatures: a list of the curvature values (list of floats)
-    - figFilePath: the path to the location where the figure
-                   will be saved (string)
-                   
-    Effects:
-    - Prints a text table of statistics about the curvature
-    histogram
-    - Makes a histogram of the curvatures and saves it in the
-    designated location
+    - labelImage: the label map image (sitk Image)
+    - cells: the cell statistics of the label map (numpy array of
+             CELL_DTYPE, modified in place)
+
+    Returns:
+    - cells: the cell records with the shapes filled in
     """
-    # set the number of bins
-    numBins = 20
-    outFn = figFilePath+'curvature-histogram.png'
-    
-    # print information about the histogram
-    print('Curvature Statistics')
-    print('---------------------------------------')
-    print('Min:               ', np.amin(curvatures))
-    print('Mean:              ', np.mean(curvatures))
-    print('Median:            ', np.median(curvatures))
-    print('Max:               ', np.amax(curvatures))
-    print('Standard Deviation:', np.std(curvatures))
-    
-    # show the histogram
-    pylab.figure(figsize=(7,7))
-    pylab.hist(curvatures, numBins, facecolor='blue', alpha=0.7)
-    pylab.title('Histogram of Curvatures')
-    pylab.xlabel(u'Curvature (${\mu}m^{-1}$)')
-    pylab.ylabel('Frequency')
-    
-    # save the histogram
-    pylab.savefig(outFn, bbox_inches='tight')
+    pixels = getCellPixels(labelImage, cells)
+    measureCellOutlines(cells, pixels)
+    measureCellCenterlines(cells, pixels)
+    return cells
 
-#=========================================================================
-# Main
-#=========================================================================
 
-def main():
-    # Set up the arg parser
-    parser = argparse.ArgumentParser(description="Identify individual caulobacter bacteria cells and calculate their curvatures.")
-    # Arguments
-    # - input image
-    parser.add_argument('--inFn', type=str, help='Full path to the input image (.png, .jpg, etc; NOT .nd2)', required=True)
-    # - save intermediate images (boolean)
-    saveFlag = 'saveIntermediateFigures'  # need a variable to indicate whether this arg is used
-    parser.add_argument('--saveIntermediateFigures', dest=saveFlag, action='store_true', help='Include this flag to indicate that the intermediately generated figures should be saved.')
-    # Parse the arguments
-    args = parser.parse_args()
-    inputFn = args.inFn
-    saveIntermediateFigures = args.saveIntermediateFigures
+def getCellPixels(labelImage, cells):
+    """
+    Gather the pixels of every cell in one pass over the label map.
 
-    # Initialization
-    inputFnBase = inputFn.split('/')[-1].split('.')[0]
-    figPath = "./figures/"+inputFnBase+"/"
-    if not os.path.exists(figPath):
-        os.makedirs(figPath)
+    Inputs:
+    - labelImage: the label map image (sitk Image)
+    - cells: the cell statistics of the label map; the pixels of
+             labels that are not in the table are left out (numpy
+             array of CELL_DTYPE)
 
-    # Load the file
-    reader = sitk.ImageFileReader()
-    reader.SetFileName(inputFn)
-    image = reader.Execute()
+    Returns:
+    - pixels: the index in cells of the cell each pixel belongs to
+              (int array) and the x and y position of each pixel from
+              the corner of its cell's bounding box (float arrays)
+              (tuple)
+    """
+    if len(cells) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    labelArray = sitk.GetArrayViewFromImage(labelImage)
+    rows, cols = np.nonzero(labelArray)
+    cellIndex = np.full(int(max(labelArray.max(), cells['label'].max()))+1, -1, dtype=np.int64)
+    cellIndex[cells['label']] = np.arange(len(cells))
+    pixelCells = cellIndex[labelArray[rows, cols]]
+    inTable = pixelCells >= 0
+    pixelCells, rows, cols = pixelCells[inTable], rows[inTable], cols[inTable]
+    x = (cols - cells['xStart'][pixelCells]).astype(np.float64)
+    y = (rows - cells['yStart'][pixelCells]).astype(np.float64)
+    return pixelCells, x, y
+
+
+def selectCellPixels(pixels, isSelected):
+    """
+    Inputs:
+    - pixels: the pixels of a table of cells (tuple, see
+              getCellPixels)
+    - isSelected: whether each cell of the table is selected (boolean
+                  array)
+
+    Returns:
+    - pixels: the pixels of the selected cells, indexing the table of
+              the selected cells (tuple, see getCellPixels)
+    """
+    pixelCells, x, y = pixels
+    newIndex = np.cumsum(isSelected) - 1
+    keep = isSelected[pixelCells]
+    return newIndex[pixelCells[keep]], x[keep], y[keep]
+
+
+def getCellMoments(numCells, pixelCells, x, y):
+    """
+    Inputs:
+    - numCells: the number of cells (int)
+    - pixelCells, x, y: the pixels of the cells (see getCellPixels)
+
+    Returns:
+    - count: the number of pixels of each cell (float array)
+    - dx, dy: the position of each pixel from the centre of its cell
+              (float arrays)
+    - covXX, covXY, covYY: the covariance of the pixels of each cell
+                           (float arrays)
+    """
+    def sumPerCell(values):
+        return np.bincount(pixelCells, weights=values, minlength=numCells)
+    count = sumPerCell(None)
+    dx = x - (sumPerCell(x)/count)[pixelCells]
+    dy = y - (sumPerCell(y)/count)[pixelCells]
+    covXX = sumPerCell(dx*dx)/count
+    covXY = sumPerCell(dx*dy)/count
+    covYY = sumPerCell(dy*dy)/count
+    return count, dx, dy, covXX, covXY, covYY
+
+
+def measureCellOutlines(cells, pixels):
+    """
+    Measure the outline of every cell from the moments of its pixels
+    and the ends of its rows, without any fitting:
+    - the major and minor axis lengths of the ellipse with the same
+      second moments as the cell
+    - the solidity of the cell: its area over the area of its convex
+      hull. The hull is measured as the polygon bounded by the
+      tangents to the cell in HULL_NUM_DIRECTIONS directions, which
+      only needs the first and last pixel of each row of the cell
+
+    Inputs:
+    - cells: the cell statistics (numpy array of CELL_DTYPE, modified
+             in place)
+    - pixels: the pixels of the cells (tuple, see getCellPixels)
+
+    Returns:
+    - cells: the cell records with the outlines filled in
+    """
+    if len(cells) == 0:
+        return cells
+    pixelCells, x, y = pixels
+    count, dx, dy, covXX, covXY, covYY = getCellMoments(len(cells), pixelCells, x, y)
+
+    # The axes of the covariance; a filled ellipse with semi-axis a has
+    # a variance of a^2/4 along it
+    spread = np.sqrt(((covXX - covYY)/2)**2 + covXY**2)
+    cells['majorAxisLength'] = 4*np.sqrt((covXX + covYY)/2 + spread)
+    cells['minorAxisLength'] = 4*np.sqrt(np.maximum((covXX + covYY)/2 - spread, 0))
+
+    # Every row of a connected cell holds pixels, and the convex hull
+    # of the cell is the hull of the corners of the first and last
+    # pixel of each row
+    heights = (cells['yEnd'] - cells['yStart']).astype(np.int64)
+    rowStarts = np.concatenate([[0], np.cumsum(heights)[:-1]])
+    cellRows = rowStarts[pixelCells] + y.astype(np.int64)
+    rowFirst = np.full(heights.sum(), np.inf)
+    rowLast = np.full(heights.sum(), -np.inf)
+    np.minimum.at(rowFirst, cellRows, x)
+    np.maximum.at(rowLast, cellRows, x)
+    rowY = np.arange(heights.sum()) - np.repeat(rowStarts, heights)
+    cornerX = np.concatenate([rowFirst, rowFirst, rowLast+1, rowLast+1])
+    cornerY = np.concatenate([rowY, rowY+1, rowY, rowY+1])
+    cornerOrder = np.argsort(np.tile(np.arange(len(rowY)), 4), kind='stable')
+    cornerX, cornerY = cornerX[cornerOrder], cornerY[cornerOrder]
+
+    # The distance of the tangent in each direction from the corner of
+    # the bounding box, and the area of the polygon the tangents bound:
+    # half the sum over its sides of the distance times the length
+    directions = 2*np.pi*np.arange(HULL_NUM_DIRECTIONS)/HULL_NUM_DIRECTIONS
+    step = 2*np.pi/HULL_NUM_DIRECTIONS
+    tangents = np.maximum.reduceat(np.outer(cornerX, np.cos(directions))
+                                   + np.outer(cornerY, np.sin(directions)), 4*rowStarts, axis=0)
+    sideLengths = (np.roll(tangents, 1, axis=1) + np.roll(tangents, -1, axis=1)
+                   - 2*np.cos(step)*tangents)/np.sin(step)
+    cells['solidity'] = count/(0.5*np.sum(tangents*sideLengths, axis=1))
+
+    return cells
+
+
+def measureCellCenterlines(cells, pixels):
+    """
+    Fit the centerline of every cell: the arc of a circle (or the
+    line) that best fits its pixels, running the length of the cell.
+    From it come the centerline length, the mean width of the cell
+    (its area over the centerline length), the bend angle (how far
+    the centerline turns from one end to the other) and the curvature
+    of the centerline.
+
+    Inputs:
+    - cells: the cell statistics (numpy array of CELL_DTYPE, modified
+             in place)
+    - pixels: the pixels of the cells (tuple, see getCellPixels)
+
+    Returns:
+    - cells: the cell records with the centerlines filled in
+    """
+    if len(cells) == 0:
+        return cells
+    numCells = len(cells)
+    pixelCells, x, y = pixels
+    def sumPerCell(values):
+        return np.bincount(pixelCells, weights=values, minlength=numCells)
+    count, dx, dy, covXX, covXY, covYY = getCellMoments(numCells, pixelCells, x, y)
+
+    # Pixel positions along (u) and across (v) the major axis
+    angle = 0.5*np.arctan2(2*covXY, covXX - covYY)[pixelCells]
+    u = dx*np.cos(angle) + dy*np.sin(angle)
+    v = dy*np.cos(angle) - dx*np.sin(angle)
+
+    # Least squares fit of the centerline to the pixels of every cell
+    # at once, as the circle A (u^2 + v^2) + B u + v + D = 0. Its
+    # centre lies across the major axis, so v keeps a weight of 1, and
+    # a straight cell is the line A = 0 rather than a circle of
+    # infinite radius
+    regressors = [u**2 + v**2, u, None]
+    normal = np.empty((numCells, 3, 3))
+    moments = np.empty((numCells, 3, 1))
+    for i in range(3):
+        for j in range(i, 3):
+            if regressors[i] is None:
+                normal[:, i, j] = count
+            elif regressors[j] is None:
+                normal[:, i, j] = sumPerCell(regressors[i])
+            else:
+                normal[:, i, j] = sumPerCell(regressors[i]*regressors[j])
+            normal[:, j, i] = normal[:, i, j]
+        moments[:, i, 0] = -sumPerCell(v if regressors[i] is None else v*regressors[i])
+    # The pseudoinverse also solves the singular fits of cells that are
+    # a single pixel or a line of pixels, and solves each cell the same
+    # way whichever cells it is solved with
+    coefficients = np.matmul(np.linalg.pinv(normal), moments)[:, :, 0]
+    A, B, D = coefficients.T
+    curvature = 2*np.abs(A)/np.sqrt(np.maximum(B**2 + 1 - 4*A*D, np.finfo(float).tiny))
+    isBent = curvature > 1e-9
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centreU = np.where(isBent, -B/(2*A), 0)
+        centreV = np.where(isBent, -1/(2*A), 0)
+
+    # The algebraic fit pulls a thick, short arc straight, so refine
+    # the circles of bent cells by Gauss-Newton steps on the distances
+    # of their pixels from it
+    for _ in range(CENTERLINE_FIT_ITERATIONS):
+        offsetU = u - centreU[pixelCells]
+        offsetV = v - centreV[pixelCells]
+        distances = np.maximum(np.hypot(offsetU, offsetV), 1e-12)
+        radii = sumPerCell(distances)/count
+        # With the radius set to the mean distance, the step moves only
+        # the centre
+        dirU = offsetU/distances - (sumPerCell(offsetU/distances)/count)[pixelCells]
+        dirV = offsetV/distances - (sumPerCell(offsetV/distances)/count)[pixelCells]
+        residuals = distances - radii[pixelCells]
+        sumUU, sumUV, sumVV = sumPerCell(dirU*dirU), sumPerCell(dirU*dirV), sumPerCell(dirV*dirV)
+        sumRU, sumRV = sumPerCell(residuals*dirU), sumPerCell(residuals*dirV)
+        determinant = sumUU*sumVV - sumUV**2
+        canStep = isBent & (np.abs(determinant) > 1e-12*np.maximum(sumUU*sumVV, np.finfo(float).tiny))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centreU += np.where(canStep, (sumVV*sumRU - sumUV*sumRV)/determinant, 0)
+            centreV += np.where(canStep, (sumUU*sumRV - sumUV*sumRU)/determinant, 0)
+    radii = sumPerCell(np.hypot(u - centreU[pixelCells], v - centreV[pixelCells]))/count
+    curvature = np.where(isBent, 1/np.where(isBent, radii, 1), 0)
+
+    # The centerline runs from the outer edge of the first pixel to the
+    # outer edge of the last: along a bent cell, the angles of its
+    # pixels seen from the centre of the circle, counted from the
+    # centre of the cell, and along a straight one, their positions
+    # along the line
+    centreU, centreV = centreU[pixelCells], centreV[pixelCells]
+    pixelAngles = np.arctan2(centreU*(v - centreV) - centreV*(u - centreU),
+                             -centreU*(u - centreU) - centreV*(v - centreV))
+    pixelSteps = np.where(isBent[pixelCells], pixelAngles, u)
+    firstStep = np.full(numCells, np.inf)
+    lastStep = np.full(numCells, -np.inf)
+    np.minimum.at(firstStep, pixelCells, pixelSteps)
+    np.maximum.at(lastStep, pixelCells, pixelSteps)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bendAngle = np.where(isBent, lastStep - firstStep + curvature, 0)
+        length = np.where(isBent, bendAngle/curvature, (lastStep - firstStep + 1)*np.sqrt(1 + B**2))
+    cells['centerlineLength'] = length
+    cells['width'] = count/length
+    cells['bendAngle'] = bendAngle
+    cells['centerlineCurvature'] = curvature
+
+    return cells
+
+
+class CellFilter(object):
+    """
+    Limits on the components of the label map that are measured as
+    cells. Components outside them are debris, clumps of cells or
+    cells cut off by the edge of the image. The limits only need the
+    cell statistics and outlines (see measureCellOutlines), so the
+    rejected components are never fitted with a centerline or
+    contoured. Every limit is off when it is None.
+    """
+
+    def __init__(self, minArea=None, maxArea=None, minAspect=None, maxAspect=None,
+                 minSolidity=None, rejectBorder=False):
+        """
+        Inputs:
+        - minArea, maxArea: the range of cell areas, in pixels (ints)
+        - minAspect, maxAspect: the range of the ratio of the major to
+                                the minor axis length (floats)
+        - minSolidity: the smallest ratio of the area of a cell to the
+                       area of its convex hull; clumps of cells fall
+                       below it (float)
+        - rejectBorder: flag to indicate that cells touching the edge
+                        of the image should be rejected (boolean)
+        """
+        self.minArea = minArea
+        self.maxArea = maxArea
+        self.minAspect = minAspect
+        self.maxAspect = maxAspect
+        self.minSolidity = minSolidity
+        self.rejectBorder = rejectBorder
+
+    def getKey(self):
+        """
+        Returns:
+        - key: the limits, as the parts of a cache key (tuple)
+        """
+        return ('cellFilter', self.minArea, self.maxArea, self.minAspect, self.maxAspect,
+                self.minSolidity, self.rejectBorder)
+
+    def getRejections(self, cells, imageSize, origin=(0, 0)):
+        """
+        Check every cell against the limits.
+
+        Inputs:
+        - cells: the cell statistics and shapes (numpy array of
+                 CELL_DTYPE)
+        - imageSize: the (width, height) of the whole image (tuple)
+        - origin: the position in the whole image of the label map the
+                  bounding boxes are measured in (tuple)
+
+        Returns:
+        - rejections: for each of FILTER_REASONS, whether each cell
+                      fails that limit (dict of boolean arrays)
+        """
+        area = cells['area']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aspect = cells['majorAxisLength']/cells['minorAxisLength']
+        rejections = {reason: np.zeros(len(cells), dtype=bool) for reason in FILTER_REASONS}
+        if self.minArea is not None:
+            rejections['area'] |= area < self.minArea
+        if self.maxArea is not None:
+            rejections['area'] |= area > self.maxArea
+        # A cell one pixel wide has an infinite aspect
+        if self.minAspect is not None:
+            rejections['aspect'] |= ~(aspect >= self.minAspect)
+        if self.maxAspect is not None:
+            rejections['aspect'] |= aspect > self.maxAspect
+        if self.minSolidity is not None:
+            rejections['solidity'] |= cells['solidity'] < self.minSolidity
+        if self.rejectBorder:
+            width, height = imageSize
+            rejections['border'] |= ((cells['xStart'] + origin[0] <= 0)
+                                     | (cells['yStart'] + origin[1] <= 0)
+                                     | (cells['xEnd'] + origin[0] >= width)
+                                     | (cells['yEnd'] + origin[1] >= height))
+        return rejections
+
+    def apply(self, labelImage, cells, verbose=True):
+        """
+        Measure the cells of a whole image in place of
+        measureCellShapes, and keep the ones that pass the limits: the
+        outlines of every cell are measured, but the centerlines only
+        of the kept cells. The label map is left as it is and the kept
+        cells keep their labels; the contour engines only trace the
+        cells in the table (see extractCellContours).
+
+        Inputs:
+        - labelImage: the label map image (sitk Image)
+        - cells: the cell statistics of the label map (numpy array of
+                 CELL_DTYPE)
+        - verbose: flag to indicate whether to print the number of
+                   rejected cells (boolean)
+
+        Returns:
+        - cells: the records of the kept cells, with their shapes
+                 (numpy array of CELL_DTYPE)
+        - counts: the number of rejected cells for each reason and in
+                  total (dict of ints, see countRejections)
+        """
+        pixels = getCellPixels(labelImage, cells)
+        measureCellOutlines(cells, pixels)
+        rejections = self.getRejections(cells, labelImage.GetSize())
+        counts = countRejections(rejections)
+        isKept = ~isRejectedFor(rejections)
+        cells = cells[isKept]
+        measureCellCenterlines(cells, selectCellPixels(pixels, isKept))
+        if verbose:
+            print(formatRejections(counts, len(cells)+counts['total']))
+        return cells, counts
+
+
+def numberKeptCells(cells):
+    """
+    Number the cells kept by a cell filter from 1 in label order, as
+    if the rejected cells had never been labelled. Only the records
+    change, so this is done once the cells have been contoured.
+
+    Inputs:
+    - cells: the records of the kept cells (numpy array of CELL_DTYPE,
+             modified in place)
+
+    Returns:
+    - cells: the renumbered records
+    """
+    cells['label'] = np.arange(1, len(cells)+1)
+    return cells
+
+
+def isRejectedFor(rejections):
+    """
+    Inputs:
+    - rejections: for each of FILTER_REASONS, whether each cell fails
+                  that limit (dict of boolean arrays)
+
+    Returns:
+    - isRejected: whether each cell fails any limit (boolean array)
+    """
+    return np.logical_or.reduce([rejections[reason] for reason in FILTER_REASONS])
+
+
+def formatRejections(counts, numComponents):
+    """
+    Inputs:
+    - counts: the number of rejected cells for each reason and in
+              total (dict of ints, see countRejections)
+    - numComponents: the number of components before filtering (int)
+
+    Returns:
+    - report: one line with the counts (string)
+    """
+    return ('Rejected %d of %d components (%s)'
+            % (counts['total'], numComponents,
+               ', '.join('%s %d' % (reason, counts[reason]) for reason in FILTER_REASONS)))
+
+
+def countRejections(rejections, isCounted=None):
+    """
+    Count the rejected cells for each reason. A cell that fails
+    several limits counts once for each, and once in the total.
+
+    Inputs:
+    - rejections: for each of FILTER_REASONS, whether each cell fails
+                  that limit (dict of boolean arrays)
+    - isCounted: which of the cells to count; all of them by default
+                 (boolean array)
+
+    Returns:
+    - counts: the number of rejected cells for each reason and in
+              total (dict of ints)
+    """
+    isRejected = isRejectedFor(rejections)
+    if isCounted is None:
+        isCounted = np.ones(len(isRejected), dtype=bool)
+    counts = {reason: int(np.sum(rejections[reason] & isCounted)) for reason in FILTER_REASONS}
+    counts['total'] = int(np.sum(isRejected & isCounted))
+    return counts
+
+
+def keepCells(labelImage, cells):
+    """
+    Remove the cells that are not in the table from the label map,
+    with one lookup over the label map, and number the kept cells
+    from 1 in label order, as if the others had never been labelled.
+    Only needed where the label map itself is used after filtering;
+    contouring only traces the cells in the table.
+
+    Inputs:
+    - labelImage: the label map image (sitk Image)
+    - cells: the records of the cells to keep (numpy array of
+             CELL_DTYPE)
+
+    Returns:
+    - labelImage: the label map of the kept cells (sitk Image)
+    - cells: the records of the kept cells (numpy array of CELL_DTYPE)
+    """
+    labelArray = sitk.GetArrayViewFromImage(labelImage)
+    cells = cells.copy()
+    newLabels = np.zeros(int(max(labelArray.max(), cells['label'].max(initial=0)))+1,
+                         dtype=labelArray.dtype)
+    newLabels[cells['label']] = np.arange(1, len(cells)+1)
+    cells['label'] = newLabels[cells['label']]
+
+    filteredImage = sitk.GetImageFromArray(np.take(newLabels, labelArray))
+    filteredImage.CopyInformation(labelImage)
+    return filteredImage, cells
+
+
+def getCellContour(cellImage, saveIntermediate=False, figFilePath="./", origin=(0, 0)):
+    """
+    Given a binary image of a cell, get the contour for that cell.
+    
+    Inputs:
+    - cellImage: binary image mask of one cell (sitk Image or
+                 numpy array)
+    - saveIntermediate: flag to indicate whether to save
+                        intermediate images (boolean)
+    - figFilePath: the path to the location where the figure
+                   will be saved (string)
+    - origin: the (x, y) position of the mask's first pixel in the
+              full image, used when the mask is a crop (tuple of ints)
+    
+    Returns:
+    - contourPixels: a list of coordinates that represent the contour
+                     of the cell
+    """
+    import contourpy
+
+    contourPixels = []
+
+    if isinstance(cellImage, sitk.Image):
+        cellArray = sitk.GetArrayFromImage(cellImage)
+    else:
+        cellArray = np.asarray(cellImage)
+
+    # Pixel coordinates of the mask in the full image
+    xCoords = np.arange(cellArray.shape[1]) + origin[0]
+    yCoords = np.arange(cellArray.shape[0]) + origin[1]
+
+    # trace the contour of the segmented image with the same contour
+    # generator plt.contour uses, without making a figure; the first
+    # line is the one plt.contour(...).allsegs[0][0] returns
+    contourGenerator = contourpy.contour_generator(xCoords, yCoords,
+                                                   cellArray.astype(np.float64),
+                                                   name='mpl2014')
+    # lines() gives the vertices and the path codes of every line
+    contourPixels = contourGenerator.lines(CONTOUR_LEVEL)[0][0]
+    
+    # save the contours to a file; saves all contours to one file because
+    # of how this function is called
+    if saveIntermediate:
+        import matplotlib.pyplot as plt
+        plt.contour(xCoords, yCoords, cellArray)
+        outFn = figFilePath+"03-contours.png"
+        plt.savefig(outFn, bbox_inches='tight')
+
+    return contourPixels
+
+
+def getCellContourCompiled(cellImage, saveIntermediate=False, figFilePath="./", origin=(0, 0)):
+    """
+    Given a binary image of a cell, get the contour for that cell with
+    the compiled tracer in dataverse_files/find_contours (build it
+    with dataverse_files/compile_contours first). The tracer keeps no
+    global state and releases the GIL, so cells can be traced from
+    several threads at once.
+
+    Inputs:
+    - cellImage: binary image mask of one cell (numpy array)
+    - saveIntermediate: flag to indicate whether to save
+                        intermediate images (boolean)
+    - figFilePath: the path to the location where the figure
+                   will be saved (string)
+    - origin: the (x, y) position of the mask's first pixel in the
+              full image, used when the mask is a crop (tuple of ints)
+
+    Returns:
+    - contourPixels: the x, y coordinates of the longest contour of
+                     the cell, closed by repeating its first point
+                     (Nx2 array)
+    """
+    from dataverse_files import find_contours
+
+    # The tracer counts pixels at or above the threshold as inside, so
+    # a level of 0 becomes the smallest positive number; the vertices
+    # still land on the outside pixels
+    threshold = max(CONTOUR_LEVEL, np.nextafter(0, 1))
+    points, offsets = find_contours.trace_contour_flat(cellImage, threshold)
+    if len(offsets) < 2:
+        return np.zeros((0, 2))
+
+    # Keep the longest contour, the outer boundary of the cell
+    lengths = np.diff(offsets)
+    longest = np.argmax(lengths)
+    contourPixels = points[offsets[longest]:offsets[longest+1]]
+
+    # The tracer ends a closed walk by repeating its last vertex
+    if len(contourPixels) > 1 and np.array_equal(contourPixels[-1], contourPixels[-2]):
+        contourPixels = contourPixels[:-1]
+
+    # The tracer puts pixel corners at whole numbers; move to pixel
+    # centres and to full image coordinates, and close the ring
+    contourPixels = contourPixels - 0.5 + np.asarray(origin, dtype=np.float64)
+    if not np.array_equal(contourPixels[0], contourPixels[-1]):
+        contourPixels = np.vstack([contourPixels, contourPixels[:1]])
+
+    if saveIntermediate:
+        import matplotlib.pyplot as plt
+        plt.plot(contourPixels[:, 0], contourPixels[:, 1], linewidth=0.5)
+        outFn = figFilePath+"03-contours.png"
+        plt.savefig(outFn, bbox_inches='tight')
+
+    return contourPixels
+
+
+def getSegmentTable(joinInside):
+    """
+    Build the marching squares lookup table. The corners of a square
+    of four pixels are numbered clockwise from the top left (0: top
+    left, 1: top right, 2: bottom right, 3: bottom left) and edge k
+    joins corner k to corner k+1 (0: top, 1: right, 2: bottom,
+    3: left). A segment enters the square through the edge where the
+    clockwise walk goes from outside to inside the cell and leaves
+    through the edge where it goes from inside to outside, so the cell
+    is always on the left of the segment as seen in the image.
+
+    Inputs:
+    - joinInside: flag to indicate whether the two inside corners of a
+                  saddle square (diagonal corners inside) are joined
+                  (boolean)
+
+    Returns:
+    - segmentTable: for each of the 16 cases, the (entry edge, exit
+                    edge) of up to two segments, -1 where unused
+                    (16x2x2 int array)
+    """
+    segmentTable = -np.ones((16, 2, 2), dtype=np.int64)
+    for case in range(1, 15):
+        inside = [(case >> k) & 1 for k in range(4)]
+        entries = [k for k in range(4) if not inside[k] and inside[(k+1) % 4]]
+        exits = [k for k in range(4) if inside[k] and not inside[(k+1) % 4]]
+        if len(entries) == 1:
+            segmentTable[case, 0] = (entries[0], exits[0])
+        elif joinInside:
+            # Cut off the two outside corners: each entry edge is paired
+            # with the exit edge on the other side of the outside corner
+            # before it
+            for i, entry in enumerate(entries):
+                segmentTable[case, i] = (entry, (entry-1) % 4)
+        else:
+            # Cut off the two inside corners
+            for i, entry in enumerate(entries):
+                segmentTable[case, i] = (entry, (entry+1) % 4)
+    return segmentTable
+
+
+def traceLabelContours(labelArray, level=CONTOUR_LEVEL):
+    """
+    Trace the boundaries of every labelled cell with marching squares
+    in one pass over the label image. The image is padded with
+    background, so every boundary is a closed ring. Each ring is
+    oriented with its cell on the left as seen in the image: outer
+    rings run counterclockwise and inner rings (around holes) run
+    clockwise.
+
+    Inputs:
+    - labelArray: the label map, 0 for background (2D int array)
+    - level: where the boundary crosses the line between an outside
+             pixel (0) and an inside pixel (1); 0 puts the vertex on
+             the outside pixel, like plt.contour of a cell mask at its
+             lowest level (float between 0 and 1)
+
+    Returns:
+    - points: the x, y vertices of all rings, each ring closed by
+              repeating its first vertex (Nx2 float array)
+    - offsets: where each ring starts in points, followed by the total
+               number of points (int64 array)
+    - ringLabels: the label of each ring (int64 array)
+    - ringIsOuter: whether each ring is an outer boundary rather than
+                   the boundary of a hole (boolean array)
+    """
+    # Pad in the label map's own (narrow) pixel type; only the corners
+    # of the squares on a boundary are widened later
+    labelArray = np.asarray(labelArray)
+    paddedArray = np.zeros((labelArray.shape[0]+2, labelArray.shape[1]+2), dtype=labelArray.dtype)
+    paddedArray[1:-1, 1:-1] = labelArray
+    numRows, numCols = paddedArray.shape
+
+    # Only squares of four pixels whose corners differ hold a boundary;
+    # square (i, j) has pixel (i, j) as its top left corner
+    differsRight = paddedArray[:, 1:] != paddedArray[:, :-1]
+    differsDown = paddedArray[1:, :] != paddedArray[:-1, :]
+    onBoundary = differsRight[:-1] | differsRight[1:] | differsDown[:, :-1]
+    squareRows, squareCols = np.divmod(np.flatnonzero(onBoundary), numCols-1)
+
+    # The labels at the corners of those squares, clockwise from the
+    # top left
+    topLeft = squareRows*numCols + squareCols
+    cornerOffsets = np.array([0, 1, numCols+1, numCols])
+    squareCorners = paddedArray.reshape(-1)[topLeft[:, None] + cornerOffsets].astype(np.int64)
+
+    # One (square, label) pair for every label at the corners of a
+    # square, taken at the first corner that holds the label
+    pairSquare = []
+    pairLabel = []
+    for k in range(4):
+        isFirst = squareCorners[:, k] != 0
+        for m in range(k):
+            isFirst &= squareCorners[:, k] != squareCorners[:, m]
+        pairSquare.append(np.nonzero(isFirst)[0])
+        pairLabel.append(squareCorners[isFirst, k])
+    pairSquare = np.concatenate(pairSquare)
+    pairLabel = np.concatenate(pairLabel)
+
+    # Which corners of the square belong to the label
+    insideCorners = squareCorners[pairSquare] == pairLabel[:, None]
+    cases = (insideCorners * (1 << np.arange(4))).sum(axis=1)
+
+    # Look up the segments of every pair; saddle squares have two
+    segmentTable = getSegmentTable(joinInside=level < 0.5)
+    segments = segmentTable[cases]
+    used = segments[:, :, 0] >= 0
+    segPair = np.nonzero(used)[0]
+    segEntry = segments[:, :, 0][used]
+    segExit = segments[:, :, 1][used]
+    segRow = squareRows[pairSquare[segPair]]
+    segCol = squareCols[pairSquare[segPair]]
+    segLabel = pairLabel[segPair]
+
+    # Number the edges between pixels: horizontal neighbours first,
+    # then vertical neighbours
+    numHorizontal = numRows*(numCols-1)
+    numEdges = numHorizontal + (numRows-1)*numCols
+    def edgeIds(edge):
+        rows = segRow + (edge == 2)
+        cols = segCol + (edge == 1)
+        isVertical = (edge == 1) | (edge == 3)
+        return np.where(isVertical, numHorizontal + rows*numCols + cols, rows*(numCols-1) + cols)
+    startKeys = segLabel*numEdges + edgeIds(segEntry)
+    endKeys = segLabel*numEdges + edgeIds(segExit)
+
+    # Link every segment to the one that starts where it ends
+    startOrder = np.argsort(startKeys, kind='stable')
+    nextSegment = startOrder[np.searchsorted(startKeys[startOrder], endKeys)]
+    assert np.array_equal(startKeys[nextSegment], endKeys)
+
+    # Find the rings with pointer jumping: each segment learns the
+    # smallest segment index on its ring (the ring's head) and how far
+    # it is from the head
+    numSegments = len(nextSegment)
+    ringHead = np.arange(numSegments)
+    jump = nextSegment.copy()
+    for i in range(int(np.ceil(np.log2(max(numSegments, 2))))+1):
+        ringHead = np.minimum(ringHead, ringHead[jump])
+        jump = jump[jump]
+    previous = np.empty(numSegments, dtype=np.int64)
+    previous[nextSegment] = np.arange(numSegments)
+    isHead = ringHead == np.arange(numSegments)
+    previous[isHead] = np.nonzero(isHead)[0]
+    distance = (~isHead).astype(np.int64)
+    for i in range(int(np.ceil(np.log2(max(numSegments, 2))))+1):
+        distance = distance + distance[previous]
+        previous = previous[previous]
+
+    # Vertex of each segment, where it enters its square
+    cornerRows = np.array([0, 0, 1, 1])
+    cornerCols = np.array([0, 1, 1, 0])
+    def edgePoints(edge, fraction):
+        # Corner k and corner k+1 of the square end the edge; move from
+        # the outside one towards the inside one
+        insideEnd = (edge+1) % 4
+        outsideEnd = edge
+        # Padded pixel positions, shifted back to the original image
+        outsideX = segCol + cornerCols[outsideEnd] - 1
+        outsideY = segRow + cornerRows[outsideEnd] - 1
+        insideX = segCol + cornerCols[insideEnd] - 1
+        insideY = segRow + cornerRows[insideEnd] - 1
+        return (outsideX + fraction*(insideX-outsideX),
+                outsideY + fraction*(insideY-outsideY))
+    vertexX, vertexY = edgePoints(segEntry, level)
+
+    # Orientation of each ring from its signed area, measured through
+    # the edge midpoints so that no ring collapses to zero area
+    middleX, middleY = edgePoints(segEntry, 0.5)
+    cross = middleX*middleY[nextSegment] - middleX[nextSegment]*middleY
+    heads = np.nonzero(isHead)[0]
+    ringIndex = np.searchsorted(heads, ringHead)
+    ringArea = np.bincount(ringIndex, weights=cross, minlength=len(heads))
+    # (in image coordinates, with y pointing down, the outer rings
+    # have a negative signed area)
+    ringIsOuter = ringArea < 0
+    ringLabels = segLabel[heads]
+
+    # Order the rings by label with the outer ring first, and the
+    # segments by ring and by distance from the ring's head
+    ringOrder = np.lexsort((heads, ~ringIsOuter, ringLabels))
+    ringRank = np.empty(len(heads), dtype=np.int64)
+    ringRank[ringOrder] = np.arange(len(heads))
+    segmentOrder = np.lexsort((distance, ringRank[ringIndex]))
+    ringLengths = np.bincount(ringIndex, minlength=len(heads))[ringOrder]
+
+    # Close every ring by repeating its first vertex at its end
+    offsets = np.concatenate([[0], np.cumsum(ringLengths+1)]).astype(np.int64)
+    points = np.empty((offsets[-1], 2), dtype=np.float64)
+    isClosing = np.zeros(offsets[-1], dtype=bool)
+    isClosing[offsets[1:]-1] = True
+    points[~isClosing, 0] = vertexX[segmentOrder]
+    points[~isClosing, 1] = vertexY[segmentOrder]
+    points[isClosing] = points[offsets[:-1]]
+
+    return points, offsets, ringLabels[ringOrder], ringIsOuter[ringOrder]
+
+
+def cutContourAtBorder(contour, width, height):
+    """
+    Open a contour where it runs outside the image. The marching
+    squares and findContours engines trace the label map padded with
+    background, so the rings of cells that touch the edge of the
+    image close along made-up segments outside it; contourpy leaves
+    such contours open along the edge instead.
+
+    Inputs:
+    - contour: the x, y coordinates of the contour, closed by
+               repeating its first point (Nx2 array)
+    - width, height: the size of the image (ints)
+
+    Returns:
+    - contour: the longest run of the contour's points inside the
+               image, or the contour itself when it stays inside or
+               fewer than two of its points are inside (Nx2 array)
+    """
+    contour = np.asarray(contour)
+    inside = ((contour[:, 0] >= 0) & (contour[:, 1] >= 0)
+              & (contour[:, 0] <= width-1) & (contour[:, 1] <= height-1))
+    if inside.all():
+        return contour
+
+    # Go around the loop from the point after the last outside point,
+    # so that no run of inside points wraps around its end
+    loopInside = inside[:-1] if np.array_equal(contour[0], contour[-1]) else inside
+    shift = np.flatnonzero(~loopInside)[-1] + 1
+    loop = np.roll(contour[:len(loopInside)], -shift, axis=0)
+    loopInside = np.roll(loopInside, -shift)
+
+    # Keep the longest run of inside points (the first, at ties)
+    changes = np.diff(np.concatenate([[0], loopInside.astype(np.int8), [0]]))
+    runStarts = np.flatnonzero(changes == 1)
+    runEnds = np.flatnonzero(changes == -1)
+    if len(runStarts) == 0 or np.max(runEnds - runStarts) < 2:
+        return contour
+    longest = np.argmax(runEnds - runStarts)
+    return loop[runStarts[longest]:runEnds[longest]]
+
+
+def extractCellContours(labelImage, saveIntermediate=False, figFilePath="./", padding=1, cells=None,
+                        contourEngine='marchingSquares', numThreads=None):
+    """
+    Get the contour of every cell in the label map. The default
+    engine traces the boundaries of all cells in one pass over the
+    label map (see traceLabelContours) and keeps the outer boundary of
+    each cell. The contourpy engine contours each cell inside its own
+    padded bounding box with getCellContour, and the findContours
+    engine does the same with getCellContourCompiled; with numThreads,
+    the cells are spread over a thread pool. With every engine, the
+    contour of a cell that touches the edge of the image is left open
+    there (see cutContourAtBorder).
+
+    Inputs:
+    - labelImage: the label map image (sitk Image)
+    - saveIntermediate: flag to indicate whether to save
+                        intermediate images (boolean)
+    - figFilePath: the path to the location where the figure
+                   will be saved (string)
+    - padding: number of background pixels around each cell for the
+               contourpy and findContours engines (int)
+    - cells: the cell statistics of the label map, if they have
+             already been measured; the marching squares engine fills
+             in their ring counts (numpy array of CELL_DTYPE)
+    - contourEngine: one of CONTOUR_ENGINES (string)
+    - numThreads: the number of threads the contourpy and findContours
+                  engines contour the cells on; the intermediate
+                  figure is drawn from one thread (int)
+
+    Returns:
+    - labels: the label of each contoured cell (list of ints)
+    - contours: the contour of each cell in full image coordinates
+                (list of arrays)
+    """
+    if contourEngine not in CONTOUR_ENGINES:
+        raise ValueError("Unknown contour engine: "+str(contourEngine))
+
+    # A view shares the label image's buffer instead of copying it
+    labelArray = sitk.GetArrayViewFromImage(labelImage)
+    height, width = labelArray.shape
+
+    if contourEngine in ('contourpy', 'findContours'):
+        getContour = getCellContour if contourEngine == 'contourpy' else getCellContourCompiled
+        boundingBoxes = getCellBoundingBoxes(labelImage, padding=padding, cells=cells)
+
+        def contourCells(first, last):
+            contours = []
+            for label, (xStart, yStart, xEnd, yEnd) in boundingBoxes[first:last]:
+                # Mask the cell inside its bounding box only
+                cellCrop = (labelArray[yStart:yEnd, xStart:xEnd] == label)
+                contours.append(getContour(cellCrop.astype(np.uint8),
+                                           saveIntermediate=saveIntermediate,
+                                           figFilePath=figFilePath,
+                                           origin=(xStart, yStart)))
+            return contours
+
+        # The work of a cell grows with the area of its bounding box
+        boxAreas = [(xEnd-xStart)*(yEnd-yStart) for label, (xStart, yStart, xEnd, yEnd) in boundingBoxes]
+        contours = list(itertools.chain.from_iterable(
+            mapInChunks(contourCells, np.concatenate([[0], np.cumsum(boxAreas)]),
+                        numThreads=None if saveIntermediate else numThreads)))
+        if contourEngine == 'findContours':
+            contours = [cutContourAtBorder(contour, width, height) for contour in contours]
+        return [label for label, box in boundingBoxes], contours
+
+    # Trace every boundary in the label map at once
+    points, offsets, ringLabels, ringIsOuter = traceLabelContours(labelArray)
+
+    # The rings are sorted by label with the outer ring of each cell
+    # first
+    ringCellLabels, firstRings = np.unique(ringLabels, return_index=True)
+    if cells is None:
+        labels = [int(label) for label in ringCellLabels]
+    else:
+        labels = [int(label) for label in cells['label']]
+        outerCounts = np.bincount(ringLabels[ringIsOuter], minlength=int(ringCellLabels.max(initial=0))+1)
+        innerCounts = np.bincount(ringLabels[~ringIsOuter], minlength=int(ringCellLabels.max(initial=0))+1)
+        cells['numOuterRings'] = outerCounts[cells['label']]
+        cells['numInnerRings'] = innerCounts[cells['label']]
+    firstRing = dict(zip(ringCellLabels.tolist(), firstRings.tolist()))
+    contours = [cutContourAtBorder(points[offsets[firstRing[label]]:offsets[firstRing[label]+1]],
+                                   width, height)
+                for label in labels]
+
+    # save the contours of all cells to one file
+    if saveIntermediate:
+        import matplotlib.pyplot as plt
+        for ring in range(len(ringLabels)):
+            ringPoints = points[offsets[ring]:offsets[ring+1]]
+            plt.plot(ringPoints[:, 0], ringPoints[:, 1], linewidth=0.5)
+        outFn = figFilePath+"03-contours.png"
+        plt.savefig(outFn, bbox_inches='tight')
+
+    return labels, contours
+
+
+def segmentedGradient(values, starts, ends):
+    """
+    Take np.gradient of each contour in a flat array of concatenated
+    contours at once. Interior points use central differences and the
+    first and last point of each contour use one-sided differences,
+    exactly as np.gradient does for a single contour.
+
+    Inputs:
+    - values: the concatenated values of all contours (numpy array)
+    - starts: the index of the first point of each contour (numpy array)
+    - ends: the index one past the last point of each contour
+            (numpy array)
+
+    Returns:
+    - gradient: the gradient of each contour, concatenated (numpy array)
+    """
+    gradient = np.empty_like(values)
+    # Central differences everywhere; the values that straddle two
+    # contours are overwritten below
+    gradient[1:-1] = (values[2:] - values[:-2]) / 2.0
+    # One-sided differences at the ends of each contour
+    gradient[starts] = values[starts+1] - values[starts]
+    gradient[ends-1] = values[ends-1] - values[ends-2]
+    return gradient
+
+
+def fitContourCurvatures(points, offsets, fitLen=POLYNOMIAL_FIT_LENGTH, order=POLYNOMIAL_FIT_ORDER,
+                         weighted=False):
+    """
+    Calculate the signed curvature at every point of many contours by
+    fitting x and y as polynomials of the arc length over a sliding
+    window around each point, as calculate_curvature in
+    dataverse_files/curvature_algorithm.py does one point at a time.
+    The windows of all points are fit at once: the least squares
+    projection operator of each window is solved for from a stack of
+    Vandermonde matrices, and only the rows giving the first and second
+    derivatives at the centre point are used. Closed contours (first
+    point repeated at the end) wrap around; the windows of open
+    contours are shifted inwards at their ends.
+
+    Inputs:
+    - points: all of the contours concatenated (Nx2 array of x, y
+              coordinates)
+    - offsets: where each contour starts in the points array, followed
+               by the total number of points (array of ints)
+    - fitLen: the half-width of the window, in points (int)
+    - order: the order of the polynomials, at least 2 (int)
+    - weighted: if non-zero, weight the fit with a gaussian centred on
+                the point whose width (sigma) is the arc length
+                spanned by the window divided by this value (float)
+
+    Returns:
+    - curvatures: the signed curvature at every point, positive where
+                  the contour turns counterclockwise in x, y (float64
+                  array)
+    """
+    if order < 2:
+        raise ValueError("The polynomial order must be at least 2 to take a second derivative")
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    curvatures = np.full(len(points), np.nan)
+    if len(points) == 0:
+        return curvatures
+
+    # A closed contour repeats its first point at the end; leave the
+    # repeat out of the fit and copy the curvature of the first point
+    # to it afterwards
+    closed = np.zeros(len(lengths), dtype=bool)
+    hasPoints = lengths > 2
+    closed[hasPoints] = np.all(points[starts[hasPoints]] == points[starts[hasPoints]+lengths[hasPoints]-1], axis=1)
+    numUnique = lengths - closed
+
+    # Arc length of every point from the start of its contour, and the
+    # perimeter of each closed contour
+    stepLengths = np.zeros(len(points))
+    stepLengths[1:] = np.hypot(*np.diff(points, axis=0).T)
+    stepLengths[starts] = 0
+    # Each contour is accumulated on its own, so that its arc lengths
+    # (and curvatures) do not depend on the contours before it
+    arcLengths = np.empty(len(points))
+    for start, end in zip(starts, offsets[1:]):
+        arcLengths[start:end] = np.cumsum(stepLengths[start:end])
+    perimeters = np.where(closed, arcLengths[np.maximum(offsets[1:]-1, 0)], 0)
+
+    # Index of every fitted point within its contour
+    contourIdx = np.repeat(np.arange(len(lengths)), numUnique)
+    fitStarts = starts[contourIdx]
+    fitLengths = numUnique[contourIdx]
+    local = np.arange(len(contourIdx)) - np.repeat(np.cumsum(numUnique) - numUnique, numUnique)
+    centre = fitStarts + local
+
+    # Window of every point (one row per point). Closed contours wrap,
+    # adding a perimeter for every time round; open contours shift the
+    # window to stay inside the contour
+    steps = np.arange(-fitLen, fitLen+1)
+    isClosed = closed[contourIdx][:, None]
+    unwrapped = local[:, None] + steps
+    shiftedStart = np.clip(local - fitLen, 0, np.maximum(fitLengths - len(steps), 0))
+    openIdx = np.minimum(shiftedStart[:, None] + steps + fitLen, fitLengths[:, None] - 1)
+    windowIdx = np.where(isClosed, unwrapped % fitLengths[:, None], openIdx)
+    laps = np.where(isClosed, unwrapped // fitLengths[:, None], 0)
+    windowPoints = points[fitStarts[:, None] + windowIdx]
+    t = (arcLengths[fitStarts[:, None] + windowIdx] + laps*perimeters[contourIdx][:, None]
+         - arcLengths[centre][:, None])
+
+    # Weighted least squares: scale the rows of each window, as
+    # np.polyfit does with its w argument
+    if weighted:
+        sigma = (t.max(axis=1) - t.min(axis=1)) / weighted
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weights = np.exp(-t**2 / (2*sigma[:, None]**2))
+        weights[~np.isfinite(weights)] = 1.0
+    else:
+        weights = np.ones_like(t)
+
+    # Projection operators from the window values to the polynomial
+    # coefficients about the centre point; row 1 gives the first
+    # derivative and row 2 half of the second derivative
+    vandermonde = weights[:, :, None] * t[:, :, None]**np.arange(order+1)
+    try:
+        projection = np.linalg.solve(np.einsum('pwi,pwj->pij', vandermonde, vandermonde),
+                                     vandermonde.transpose(0, 2, 1))[:, 1:3, :]
+    except np.linalg.LinAlgError:
+        # Some window has fewer distinct points than coefficients
+        projection = np.linalg.pinv(vandermonde)[:, 1:3, :]
+    coefficients = np.einsum('pcw,pwd->pcd', projection, weights[:, :, None]*windowPoints)
+    dx, dy = coefficients[:, 0, 0], coefficients[:, 0, 1]
+    dx2, dy2 = 2*coefficients[:, 1, 0], 2*coefficients[:, 1, 1]
+
+    # Curvature at the centre point
+    with np.errstate(invalid='ignore', divide='ignore'):
+        curvatures[centre] = (dx*dy2 - dx2*dy)/(dx*dx + dy*dy)**1.5
+    closedStarts = starts[closed]
+    curvatures[closedStarts + lengths[closed] - 1] = curvatures[closedStarts]
+
+    return curvatures
+
+
+def spectralContourCurvatures(points, offsets, cutoffWavelength=SPECTRAL_CUTOFF_WAVELENGTH):
+    """
+    Calculate the signed curvature at every point of many closed
+    contours from spectral derivatives. Each contour is resampled at
+    evenly spaced arc lengths around the loop, so that its x and y are
+    periodic functions of arc length whose derivatives are read off
+    their Fourier series, without the end effects and uneven spacing
+    of finite differences. Components with a wavelength shorter than
+    the cutoff are dropped, and the curvature of the smoothed loop is
+    interpolated back to the contour points. Contours are resampled to
+    a power of two at or above their number of points; those with the
+    same number of samples are transformed together, as one batch.
+    A closed contour repeats its first point at the end, which is left
+    out of the loop and given the curvature of the first point. Open
+    contours, such as those of cells cut by the image border, are left
+    undefined: closing them with a straight chord would spread ringing
+    from its corners along the real boundary.
+
+    Inputs:
+    - points: all of the contours concatenated (Nx2 array of x, y
+              coordinates)
+    - offsets: where each contour starts in the points array, followed
+               by the total number of points (array of ints)
+    - cutoffWavelength: the shortest wavelength kept, in the units of
+                        the points (float)
+
+    Returns:
+    - curvatures: the signed curvature at every point, positive where
+                  the contour turns counterclockwise in x, y, and
+                  undefined (nan) on open contours and contours of zero
+                  length (float64 array)
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    curvatures = np.full(len(points), np.nan)
+    if len(starts) == 0:
+        return curvatures
+
+    # Number of distinct points around each closed loop, and of its
+    # samples; open contours are not transformed
+    closed = (lengths > 1) & np.all(points[starts] == points[np.maximum(offsets[1:]-1, 0)], axis=1)
+    loopLengths = lengths - closed
+    numSamples = 2**np.ceil(np.log2(np.maximum(loopLengths, SPECTRAL_MIN_SAMPLES))).astype(np.int64)
+
+    for batchSamples in np.unique(numSamples[closed]):
+        batch = np.flatnonzero(closed & (numSamples == batchSamples))
+        batchStarts, batchLengths = starts[batch], loopLengths[batch]
+        rows = np.arange(len(batch))[:, None]
+
+        # The points of each loop, closed by its first point, which
+        # also fills the rest of the row
+        columns = np.arange(batchSamples+1)
+        loops = points[batchStarts[:, None] + np.where(columns < batchLengths[:, None], columns, 0)]
+        segmentLengths = np.hypot(*np.diff(loops, axis=1).transpose(2, 0, 1))
+        arcLengths = np.zeros((len(batch), batchSamples+1))
+        np.cumsum(segmentLengths, axis=1, out=arcLengths[:, 1:])
+        loopLength = arcLengths[:, -1]
+        defined = loopLength > 0
+        loopLength = np.where(defined, loopLength, 1.0)
+
+        # Even arc lengths around each loop, and the segment each one
+        # falls on: the number of points at or before it, found by
+        # sorting each row of points and samples together (points
+        # first at ties)
+        sampleLengths = loopLength[:, None]*np.arange(batchSamples)/batchSamples
+        order = np.argsort(np.concatenate([arcLengths, sampleLengths], axis=1), axis=1,
+                           kind='stable')
+        ranks = np.empty_like(order)
+        ranks[rows, order] = np.arange(order.shape[1])
+        segments = np.clip(ranks[:, batchSamples+1:] - np.arange(batchSamples), 1,
+                           batchSamples) - 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fractions = ((sampleLengths - arcLengths[rows, segments])
+                         / segmentLengths[rows, segments])
+        fractions = np.where(np.isfinite(fractions), fractions, 0.0)
+        samples = (loops[rows, segments]
+                   + fractions[:, :, None]*(loops[rows, segments+1] - loops[rows, segments]))
+
+        # Spectral derivatives against arc length, keeping the
+        # components with at least the cutoff wavelength (and never
+        # the Nyquist component, whose derivative is not defined)
+        waveNumbers = np.arange(batchSamples//2+1)
+        keep = ((waveNumbers <= loopLength[:, None]/cutoffWavelength)
+                & (waveNumbers < batchSamples//2))
+        frequencies = np.where(keep, 2*np.pi*waveNumbers/loopLength[:, None], 0.0)[:, :, None]
+        spectrum = np.fft.rfft(samples, axis=1)
+        d1 = np.fft.irfft(1j*frequencies*spectrum, n=batchSamples, axis=1)
+        d2 = np.fft.irfft(-frequencies**2*spectrum, n=batchSamples, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sampleCurvatures = ((d1[:, :, 0]*d2[:, :, 1] - d2[:, :, 0]*d1[:, :, 1])
+                                / (d1[:, :, 0]**2 + d1[:, :, 1]**2)**1.5)
+        sampleCurvatures[~defined] = np.nan
+
+        # Interpolate the curvature at the arc length of each point,
+        # around the loop; the repeated first point of a closed
+        # contour lies at the full loop length, back at the start
+        position = arcLengths/loopLength[:, None]*batchSamples
+        below = np.minimum(np.floor(position).astype(np.int64), batchSamples)
+        fraction = position - below
+        pointCurvatures = ((1 - fraction)*sampleCurvatures[rows, below % batchSamples]
+                           + fraction*sampleCurvatures[rows, (below + 1) % batchSamples])
+        isPoint = columns < (batchLengths + closed[batch])[:, None]
+        curvatures[(batchStarts[:, None] + columns)[isPoint]] = pointCurvatures[isPoint]
+
+    return curvatures
+
+
+def calculateContourCurvatures(contours, offsets=None, curvatureEngine='finiteDifference',
+                               numThreads=None, fitLen=POLYNOMIAL_FIT_LENGTH,
+                               fitOrder=POLYNOMIAL_FIT_ORDER, curvatureCap=CURVATURE_CAP,
+                               cutoffWavelength=SPECTRAL_CUTOFF_WAVELENGTH):
+    """
+    Calculate the curvature of the contours of many cells at once.
+    The curvature of a contour depends only on its own points, so with
+    numThreads the contours are split into chunks that are calculated
+    on a thread pool, with the same result.
+
+    Inputs:
+    - contours: either a list of contours (list of Nx2 arrays of x, y
+                coordinates) or all of the contours concatenated into
+                one Nx2 array, in which case offsets must be given
+    - offsets: where each contour starts in the concatenated array,
+               followed by the total number of points (array of ints)
+    - curvatureEngine: how to calculate the curvature, one of
+                       CURVATURE_ENGINES (string)
+    - numThreads: the number of threads (int)
+    - fitLen, fitOrder: the half-width and order of the local
+                        polynomials of the polynomialFit engine (ints)
+    - curvatureCap: the largest curvature kept; higher values are
+                    set to it (float)
+    - cutoffWavelength: the shortest wavelength kept by the spectral
+                        engine, in pixels (float)
+
+    Returns:
+    - contourCurvatures: the curvature at every contour point, capped
+                         at curvatureCap (float32 array)
+    - contourPixels: the (row, column) pixel of every contour point
+                     (Nx2 int32 array)
+    - offsets: where each contour starts in the returned arrays,
+               followed by the total number of points (int64 array)
+    """
+    # Flatten the contours into one array of points
+    if offsets is None:
+        lengths = [len(contour) for contour in contours]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        points = (np.concatenate([np.asarray(contour, dtype=np.float64).reshape(-1, 2)
+                                  for contour in contours])
+                  if contours else np.zeros((0, 2)))
+    else:
+        offsets = np.asarray(offsets, dtype=np.int64)
+        points = np.asarray(contours, dtype=np.float64).reshape(-1, 2)
+
+    if curvatureEngine not in CURVATURE_ENGINES:
+        raise ValueError("Unknown curvature engine: "+str(curvatureEngine))
+
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    if np.any(ends - starts < 2):
+        raise ValueError("Every contour needs at least 2 points to take its gradient")
+
+    contourCurvatures = np.empty(len(points), dtype=np.float32)
+
+    def calculateChunk(first, last):
+        # The contours first to last, from their own first point
+        chunkStart = offsets[first]
+        chunkPoints = points[chunkStart:offsets[last]]
+        chunkOffsets = offsets[first:last+1] - chunkStart
+        if curvatureEngine == 'polynomialFit':
+            # Fit local polynomials against arc length
+            curvatures = np.abs(fitContourCurvatures(chunkPoints, chunkOffsets, fitLen=fitLen,
+                                                     order=fitOrder))
+        elif curvatureEngine == 'spectral':
+            # Differentiate the resampled loops in the Fourier domain
+            curvatures = np.abs(spectralContourCurvatures(chunkPoints, chunkOffsets,
+                                                          cutoffWavelength=cutoffWavelength))
+        else:
+            # Calculate components for curvature
+            # Get first derivatives in x and y
+            chunkStarts, chunkEnds = chunkOffsets[:-1], chunkOffsets[1:]
+            dx = segmentedGradient(chunkPoints[:, 0], chunkStarts, chunkEnds)
+            dy = segmentedGradient(chunkPoints[:, 1], chunkStarts, chunkEnds)
+
+            # Get second derivatives in x and y
+            dx2 = segmentedGradient(dx, chunkStarts, chunkEnds)
+            dy2 = segmentedGradient(dy, chunkStarts, chunkEnds)
+
+            # Calculate the curvature of the curves
+            curvatures = np.abs(dx2*dy - dx*dy2)/(dx*dx + dy*dy)**1.5
+
+        # Threshold curvature values over the cap to be the cap
+        contourCurvatures[chunkStart:offsets[last]] = np.minimum(curvatures, curvatureCap)
+
+    mapInChunks(calculateChunk, offsets, numThreads=numThreads)
+
+    # The contour points are not integers; round them to the nearest
+    # pixel and swap (x, y) into (row, column)
+    contourPixels = np.ascontiguousarray(np.rint(points[:, ::-1]), dtype=np.int32)
+
+    return contourCurvatures, contourPixels, offsets
+
+
+def calculateContourCurvature(contourPixels, curvatureEngine='finiteDifference'):
+    """
+    Calculate the curvature of the contour of a cell.
+
+    Inputs:
+    - contourPixels: the x, y coordinates of the contour of the cell
+                     (Nx2 array)
+    - curvatureEngine: how to calculate the curvature, one of
+                       CURVATURE_ENGINES (string)
+
+    Returns:
+    - contourCurvatures: the curvature of the contour of the cell
+                         (float32 array)
+    - contourPixels: the (row, column) locations of the curvature, as
+                     integers (Nx2 int32 array)
+    """
+    contourPixels = np.asarray(contourPixels)
+    contourCurvature, contourPixels, _ = calculateContourCurvatures(
+        contourPixels, offsets=[0, len(contourPixels)], curvatureEngine=curvatureEngine)
+    return contourCurvature, contourPixels
+
+
+def summarizeCellContours(cells, contours, curvatures, offsets):
+    """
+    Fill in the contour and curvature summary of every cell record.
+
+    Inputs:
+    - cells: one record per cell, in the same order as the contours
+             (numpy array of CELL_DTYPE, modified in place)
+    - contours: the x, y coordinates of each cell contour (list of
+                Nx2 arrays)
+    - curvatures: the curvature of every contour point (float array)
+    - offsets: where each contour starts in the curvature array,
+               followed by the total number of points (int array)
+
+    Returns:
+    - cells: the cell records with the summaries filled in
+    """
+    if len(cells) == 0:
+        return cells
+    starts = offsets[:-1]
+    numPoints = np.diff(offsets)
+    cells['pointOffset'] = starts
+    cells['numPoints'] = numPoints
+
+    # Length of each contour: the sum of its segment lengths, leaving
+    # out the segments that join one contour to the next
+    points = np.concatenate([np.asarray(contour, dtype=np.float64).reshape(-1, 2)
+                             for contour in contours])
+    segmentLengths = np.zeros(len(points))
+    segmentLengths[1:] = np.hypot(*np.diff(points, axis=0).T)
+    segmentLengths[starts] = 0
+    cells['contourLength'] = np.add.reduceat(segmentLengths, starts)
+
+    # Curvature summaries, skipping the undefined (nan) curvatures of
+    # repeated points
+    curvatures = np.asarray(curvatures, dtype=np.float64)
+    valid = ~np.isnan(curvatures)
+    count = np.add.reduceat(valid.astype(np.int64), starts)
+    total = np.add.reduceat(np.where(valid, curvatures, 0), starts)
+    totalSquares = np.add.reduceat(np.where(valid, curvatures**2, 0), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        cells['curvatureMean'] = mean
+        cells['curvatureStd'] = np.sqrt(np.maximum(totalSquares / count - mean**2, 0))
+    cells['curvatureMin'] = np.fmin.reduceat(curvatures, starts)
+    cells['curvatureMax'] = np.fmax.reduceat(curvatures, starts)
+
+    return cells
+
+
+#-------------------------------------------------------------------------
+# Part 3: Generate resulting images
+#-------------------------------------------------------------------------
+
+def getColormapTable(name=OVERLAY_COLORMAP, numColors=256):
+    """
+    Sample a matplotlib colormap into a lookup table of colors.
+
+    Inputs:
+    - name: the name of the colormap (string)
+    - numColors: the number of colors in the table (int)
+
+    Returns:
+    - colorTable: the RGB colors, from the low end of the colormap to
+                  the high end (numColors x 3 uint8 array)
+    """
+    import matplotlib
+    colors = matplotlib.colormaps[name](np.linspace(0, 1, numColors))[:, :3]
+    return np.round(colors*255).astype(np.uint8)
+
+
+def getGrayscaleArray(imageArray):
+    """
+    Stretch a single channel image to 8-bit grey levels, from black
+    at its darkest pixel to white at its brightest, as plt.imshow
+    shows it.
+
+    Inputs:
+    - imageArray: the pixels of the image (2D array)
+
+    Returns:
+    - grayArray: the grey levels (2D uint8 array)
+    """
+    imageArray = np.asarray(imageArray)
+    lower, upper = imageArray.min(), imageArray.max()
+    scale = 255.0/(float(upper)-float(lower)) if upper > lower else 0.0
+    if imageArray.dtype.kind in 'ui' and int(upper)-int(lower) <= np.iinfo(np.uint16).max:
+        # Integer pixels go through a lookup table, so that no floating
+        # point copy of the image is made
+        table = np.round(np.arange(int(upper)-int(lower)+1)*scale).astype(np.uint8)
+        return table[imageArray - lower]
+    return np.round((imageArray - lower)*scale).astype(np.uint8)
+
+
+def renderCurvatureOverlay(grayArray, rows, columns, curvatures, colorTable, alpha=OVERLAY_ALPHA):
+    """
+    Paint the curvature of every contour point onto a grey image.
+
+    Inputs:
+    - grayArray: the grey levels of the image (2D uint8 array)
+    - rows, columns: the pixel of every contour point (int arrays)
+    - curvatures: the curvature of every contour point, from 0 to 1
+                  (float array)
+    - colorTable: the colors curvatures from 0 to 1 are mapped to
+                  (Nx3 uint8 array, see getColormapTable)
+    - alpha: how opaque the colors are over the image (float)
+
+    Returns:
+    - rgb: the image with the curvatures painted on (HxWx3 uint8
+           array)
+    """
+    rgb = np.repeat(grayArray[:, :, None], 3, axis=2)
+    colorIndex = np.minimum((np.clip(curvatures, 0, 1)*len(colorTable)).astype(np.intp),
+                            len(colorTable)-1)
+    colors = colorTable[colorIndex]
+    if alpha < 1:
+        colors = np.round(alpha*colors + (1-alpha)*rgb[rows, columns]).astype(np.uint8)
+    rgb[rows, columns] = colors
+    return rgb
+
+
+def saveCurvatureOverlay(origImage, curves, curvatures, figFilePath='./', previewSize=None):
+    """
+    Show the curvatures of the cells on the original image. The
+    curvature of every contour point is looked up in a colormap and
+    painted straight into an RGB copy of the image, which is saved at
+    the resolution of the image.
+    
+    Inputs:
+    - origImage: the original greyscale image (sitk Image)
+    - curves: the (row, column) locations of the cell curves
+              (Nx2 array of ints)
+    - curvatures: the curvatures of the curves (array of floats)
+    - figFilePath: the path to the location where the figure
+                   will be saved (string)
+    - previewSize: if given, also save a preview shrunk so that its
+                   longer side is at most this many pixels (int)
+                   
+    Effects:
+    - Saves curvatures.png, the original image with every contour
+    point colored by its curvature, from violet at 0 to red at 1,
+    and curvatures-preview.png if a preview size is given
+    """
+    grayArray = getGrayscaleArray(sitk.GetArrayViewFromImage(origImage))
+    height, width = grayArray.shape
+
+    # Leave out the points of cells on the image border that fall just
+    # outside it, and the points without a curvature
+    curves = np.asarray(curves, dtype=np.int64).reshape(-1, 2)
+    curvatures = np.asarray(curvatures)
+    keep = ((curves[:, 0] >= 0) & (curves[:, 0] < height)
+            & (curves[:, 1] >= 0) & (curves[:, 1] < width)
+            & ~np.isnan(curvatures))
+    rows, columns, curvatures = curves[keep, 0], curves[keep, 1], curvatures[keep]
+
+    colorTable = getColormapTable()
+    rgb = renderCurvatureOverlay(grayArray, rows, columns, curvatures, colorTable)
+    sitk.WriteImage(sitk.GetImageFromArray(rgb, isVector=True), figFilePath+'curvatures.png')
+
+    if previewSize is not None:
+        # Average the grey levels over blocks of pixels, but paint
+        # every contour point at full strength into its block, so that
+        # thin contours stay visible
+        step = max(-(-max(height, width)//previewSize), 1)
+        previewHeight, previewWidth = height//step, width//step
+        previewGray = (grayArray[:previewHeight*step, :previewWidth*step]
+                       .reshape(previewHeight, step, previewWidth, step)
+                       .mean(axis=(1, 3)).round().astype(np.uint8))
+        inPreview = (rows//step < previewHeight) & (columns//step < previewWidth)
+        preview = renderCurvatureOverlay(previewGray, rows[inPreview]//step, columns[inPreview]//step,
+                                         curvatures[inPreview], colorTable)
+        sitk.WriteImage(sitk.GetImageFromArray(preview, isVector=True),
+                        figFilePath+'curvatures-preview.png')
+
+
+def saveCurvatureHistogram(curvatures, figFilePath='./'):
+    """
+    Given the curvature values, or a summary of them, create a
+    histogram of those values and save the histogram as a figure.
+    The median is exact when given the values; a summary only keeps
+    the binned counts, so its median is interpolated within a bin
+    and printed as approximate.
+    
+    Inputs:
+    - curvatures: the curvature values (array of floats), or their
+                  summary (CurvatureSummary)
+    - figFilePath: the path to the location where the figure
+                   will be saved (string)
+                   
+    Effects:
+    - Prints a text table of statistics about the curvature
+    histogram
+    - Makes a histogram of the curvatures and saves it in the
+    designated location
+    """
+    import pylab
+
+    if isinstance(curvatures, CurvatureSummary):
+        summary = curvatures
+        medianLabel = 'Median (approx.):  '
+    else:
+        summary = CurvatureSummary().add(curvatures)
+        medianLabel = 'Median:            '
+    outFn = figFilePath+'curvature-histogram.png'
+    
+    # print information about the histogram; the undefined (nan)
+    # curvatures are left out
+    statistics = summary.getStatistics()
+    if summary is not curvatures and summary.count > 0:
+        statistics['median'] = float(np.nanmedian(curvatures))
+    print('Curvature Statistics')
+    print('---------------------------------------')
+    print('Min:               ', statistics['min'])
+    print('Mean:              ', statistics['mean'])
+    print(medianLabel, statistics['median'])
+    print('Max:               ', statistics['max'])
+    print('Standard Deviation:', statistics['std'])
+    
+    # show the histogram
+    counts, edges = summary.getHistogram()
+    pylab.figure(figsize=(7,7))
+    pylab.bar(edges[:-1], counts, width=np.diff(edges), align='edge', facecolor='blue', alpha=0.7)
+    pylab.title('Histogram of Curvatures')
+    pylab.xlabel(u'Curvature (${\mu}m^{-1}$)')
+    pylab.ylabel('Frequency')
+    
+    # save the histogram
+    pylab.savefig(outFn, bbox_inches='tight')
+
+#-------------------------------------------------------------------------
+# Part 4: Save and load the results
+#-------------------------------------------------------------------------
+
+def saveArrayAtomically(outFn, array):
+    """
+    Save an array as a .npy file under a temporary name and then
+    rename it, so the file is either complete or missing.
+
+    Inputs:
+    - outFn: the path of the .npy file (string)
+    - array: the array to save (numpy array)
+    """
+    tmpFn = outFn+'.tmp'
+    with open(tmpFn, 'wb') as tmpFile:
+        np.save(tmpFile, array)
+    os.replace(tmpFn, outFn)
+
+
+def getPointTable(contours, curvatures):
+    """
+    Inputs:
+    - contours: the x, y coordinates of each cell contour (list of
+                Nx2 arrays)
+    - curvatures: the curvature of every contour point (float array)
+
+    Returns:
+    - points: one record per contour point, the contours one after
+              another (numpy array of POINT_DTYPE)
+    """
+    points = np.zeros(len(curvatures), dtype=POINT_DTYPE)
+    if len(contours) > 0:
+        coordinates = np.concatenate([np.asarray(contour).reshape(-1, 2) for contour in contours])
+        points['x'] = coordinates[:, 0]
+        points['y'] = coordinates[:, 1]
+    points['curvature'] = curvatures
+    return points
+
+
+def saveResults(cells, contours, curvatures, figFilePath='./', summaries=None, **fields):
+    """
+    Save the cell table, the point table and the curvature summaries
+    of one image. The tables are plain .npy files of structured
+    arrays, so they can be memory mapped and loaded without reading
+    the image again.
+
+    Inputs:
+    - cells: one record per cell (numpy array of CELL_DTYPE)
+    - contours: the x, y coordinates of each cell contour (list of
+                Nx2 arrays)
+    - curvatures: the curvature of every contour point (float array)
+    - figFilePath: the path to the location where the files
+                   will be saved (string)
+    - summaries: the curvature summaries of the image, if they have
+                 already been made (dict of CurvatureSummary, see
+                 summarizeCurvatures)
+    - fields: other values to save in summary.json, such as the
+              number of cells the cell filter rejected (JSON
+              serializable)
+
+    Effects:
+    - Writes points.npy with one record per contour point and
+    summary.json with the curvature summaries, then cells.npy with one
+    record per cell
+    """
+    points = getPointTable(contours, curvatures)
+    if summaries is None:
+        summaries = summarizeCurvatures(cells, curvatures)
+
+    # The cell table goes last: it marks the image as done
+    saveArrayAtomically(figFilePath+POINTS_FN, points)
+    saveSummaries(summaries, figFilePath+SUMMARY_FN, **fields)
+    saveArrayAtomically(figFilePath+CELLS_FN, cells)
+
+
+def loadCellTable(outDir='./figures/'):
+    """
+    Load the cell tables of every processed image into one table,
+    without touching the images or the point tables.
+
+    Inputs:
+    - outDir: the directory holding the results of all images (string)
+
+    Returns:
+    - imageNames: the name of each image with results (list of strings)
+    - cells: the records of all cells, with an extra 'image' field
+             indexing imageNames (numpy structured array)
+    """
+    cellsFns = sorted(glob.glob(os.path.join(outDir, '*', CELLS_FN)))
+    imageNames = [os.path.basename(os.path.dirname(fn)) for fn in cellsFns]
+    tables = [np.load(fn) for fn in cellsFns]
+
+    tableDtype = np.dtype([('image', np.int32)] + CELL_DTYPE.descr)
+    cells = np.zeros(sum(len(table) for table in tables), dtype=tableDtype)
+    start = 0
+    for imageIndex, table in enumerate(tables):
+        rows = cells[start:start+len(table)]
+        rows['image'] = imageIndex
+        # Tables saved before a field was added leave it at 0
+        for name in CELL_DTYPE.names:
+            if name in table.dtype.names:
+                rows[name] = table[name]
+        start += len(table)
+
+    return imageNames, cells
+
+
+def loadPointTable(imageName, outDir='./figures/', mmapMode='r'):
+    """
+    Load the point table of one image. The points of a cell are
+    points[cell['pointOffset']:cell['pointOffset']+cell['numPoints']].
+
+    Inputs:
+    - imageName: the name of the image (string)
+    - outDir: the directory holding the results of all images (string)
+    - mmapMode: how to memory map the file, or None to read it into
+                memory (string)
+
+    Returns:
+    - points: one record per contour point (numpy array of POINT_DTYPE)
+    """
+    return np.load(os.path.join(outDir, imageName, POINTS_FN), mmap_mode=mmapMode)
+
+
+#=========================================================================
+# Curvature Summaries
+#=========================================================================
+
+class CurvatureSummary(object):
+    """
+    Streaming summary of curvature values that never holds the values
+    themselves. It keeps their count, running mean and sum of squared
+    deviations from the mean (Welford's moments), their smallest and
+    largest value and how many fall in each of a fixed set of equal
+    bins from 0 to the curvature cap. The bins give the histogram and
+    serve as the quantile sketch, so medians and percentiles are known
+    to within a bin. Undefined (nan) values are only counted. Summaries
+    built in different processes, of different images or cells, merge
+    exactly when their bins are the same.
+    """
+
+    def __init__(self, numBins=SUMMARY_NUM_BINS, binLimit=CURVATURE_CAP):
+        """
+        Inputs:
+        - numBins: the number of bins (int)
+        - binLimit: the upper edge of the last bin, which should be
+                    the cap the curvatures were calculated with (float)
+        """
+        self.binLimit = float(binLimit)
+        self.count = 0
+        self.mean = 0.0
+        self.sumSquares = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.numUndefined = 0
+        self.binCounts = np.zeros(numBins, dtype=np.int64)
+
+    def add(self, values):
+        """
+        Add a batch of values to the summary.
+
+        Inputs:
+        - values: the values to add (float array)
+
+        Returns:
+        - self: the summary, for chaining
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        defined = values[~np.isnan(values)]
+        self.numUndefined += len(values) - len(defined)
+        if len(defined) == 0:
+            return self
+
+        # Summarize the batch on its own, then merge it in
+        numBins = len(self.binCounts)
+        batch = CurvatureSummary(numBins, self.binLimit)
+        batch.count = len(defined)
+        batch.mean = float(defined.mean())
+        batch.sumSquares = float(((defined - batch.mean)**2).sum())
+        batch.min = float(defined.min())
+        batch.max = float(defined.max())
+        # Values outside the bins are counted in the end bins
+        bins = np.minimum((np.clip(defined, 0, self.binLimit)/self.binLimit*numBins).astype(np.int64),
+                          numBins-1)
+        batch.binCounts = np.bincount(bins, minlength=numBins)
+        return self.merge(batch)
+
+    def merge(self, other):
+        """
+        Fold another summary into this one, as if its values had been
+        added to this one.
+
+        Inputs:
+        - other: the summary to fold in (CurvatureSummary)
+
+        Returns:
+        - self: the summary, for chaining
+        """
+        if len(other.binCounts) != len(self.binCounts):
+            raise ValueError("Cannot merge summaries with %d and %d bins"
+                             % (len(self.binCounts), len(other.binCounts)))
+        if other.binLimit != self.binLimit:
+            raise ValueError("Cannot merge summaries binned up to %g and %g"
+                             % (self.binLimit, other.binLimit))
+        count = self.count + other.count
+        if other.count > 0:
+            # Chan et al.'s update of the moments of two sets of values
+            delta = other.mean - self.mean
+            self.sumSquares += other.sumSquares + delta**2*self.count*other.count/count
+            self.mean += delta*other.count/count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.numUndefined += other.numUndefined
+        self.binCounts += other.binCounts
+        return self
+
+    def getStd(self):
+        """
+        Returns:
+        - std: the (population) standard deviation of the values, as
+               np.std gives it (float)
+        """
+        return float(np.sqrt(self.sumSquares/self.count)) if self.count > 0 else np.nan
+
+    def getQuantile(self, q):
+        """
+        Estimate a quantile of the values from the bins, taking the
+        values in a bin to be spread evenly across it.
+
+        Inputs:
+        - q: the quantile, from 0 to 1 (float)
+
+        Returns:
+        - value: the estimated quantile (float)
+        """
+        if self.count == 0:
+            return np.nan
+        numBins = len(self.binCounts)
+        cumCounts = np.cumsum(self.binCounts)
+        target = q*self.count
+        i = min(int(np.searchsorted(cumCounts, target)), numBins-1)
+        before = cumCounts[i] - self.binCounts[i]
+        fraction = (target - before)/self.binCounts[i] if self.binCounts[i] > 0 else 0.0
+        return float(np.clip((i + fraction)/numBins*self.binLimit, self.min, self.max))
+
+    def getHistogram(self, numBins=HISTOGRAM_NUM_BINS):
+        """
+        Group the bins of the summary into a coarser histogram.
+
+        Inputs:
+        - numBins: the number of bins of the histogram; it must divide
+                   the number of bins of the summary (int)
+
+        Returns:
+        - counts: the number of values in each bin (int array)
+        - edges: the edges of the bins, from 0 to the bin limit (float
+                 array)
+        """
+        if len(self.binCounts) % numBins != 0:
+            raise ValueError("%d bins cannot be grouped into %d" % (len(self.binCounts), numBins))
+        counts = self.binCounts.reshape(numBins, -1).sum(axis=1)
+        return counts, np.linspace(0, self.binLimit, numBins+1)
+
+    def getStatistics(self):
+        """
+        Returns:
+        - statistics: the count, number of undefined values, min, mean,
+                      median, max, standard deviation and 5th, 25th,
+                      75th and 95th percentiles (dict)
+        """
+        defined = self.count > 0
+        statistics = {'count': self.count,
+                      'numUndefined': self.numUndefined,
+                      'min': self.min if defined else None,
+                      'mean': self.mean if defined else None,
+                      'median': self.getQuantile(0.5) if defined else None,
+                      'max': self.max if defined else None,
+                      'std': self.getStd() if defined else None}
+        for percentile in (5, 25, 75, 95):
+            statistics['p%d' % percentile] = self.getQuantile(percentile/100.0) if defined else None
+        return statistics
+
+    def toDict(self):
+        """
+        Returns:
+        - state: the whole state of the summary, for saving as JSON
+                 (dict)
+        """
+        defined = self.count > 0
+        return {'count': self.count,
+                'mean': self.mean,
+                'sumSquares': self.sumSquares,
+                'min': self.min if defined else None,
+                'max': self.max if defined else None,
+                'numUndefined': self.numUndefined,
+                'binLimit': self.binLimit,
+                'binCounts': self.binCounts.tolist()}
+
+    @classmethod
+    def fromDict(cls, state):
+        """
+        Inputs:
+        - state: the state of a summary, from toDict (dict)
+
+        Returns:
+        - summary: the summary (CurvatureSummary)
+        """
+        # Summaries saved before the limit was stored were binned up
+        # to 1
+        summary = cls(len(state['binCounts']), state.get('binLimit', 1.0))
+        summary.count = state['count']
+        summary.mean = state['mean']
+        summary.sumSquares = state['sumSquares']
+        summary.min = state['min'] if state['min'] is not None else np.inf
+        summary.max = state['max'] if state['max'] is not None else -np.inf
+        summary.numUndefined = state['numUndefined']
+        summary.binCounts = np.asarray(state['binCounts'], dtype=np.int64)
+        return summary
+
+
+def summarizeCurvatures(cells, curvatures, curvatureCap=CURVATURE_CAP):
+    """
+    Summarize the curvatures of one image, both over all of its
+    contour points and over its cells (one mean curvature per cell).
+
+    Inputs:
+    - cells: one record per cell (numpy array of CELL_DTYPE)
+    - curvatures: the curvature of every contour point (float array)
+    - curvatureCap: the cap the curvatures were calculated with; the
+                    summaries are binned up to it (float)
+
+    Returns:
+    - summaries: the 'points' and 'cells' summaries (dict of
+                 CurvatureSummary)
+    """
+    return {'points': CurvatureSummary(binLimit=curvatureCap).add(curvatures),
+            'cells': CurvatureSummary(binLimit=curvatureCap).add(cells['curvatureMean'])}
+
+
+def saveSummaries(summaries, outFn, **fields):
+    """
+    Save curvature summaries as JSON, under a temporary name first so
+    the file is either complete or missing.
+
+    Inputs:
+    - summaries: the summaries, by name (dict of CurvatureSummary)
+    - outFn: the path of the JSON file (string)
+    - fields: other values to save with the summaries, such as their
+              statistics (JSON serializable)
+    """
+    state = dict(fields)
+    state.update((name, summary.toDict()) for name, summary in summaries.items())
+    tmpFn = outFn+'.tmp%d' % os.getpid()
+    with open(tmpFn, 'w') as tmpFile:
+        json.dump(state, tmpFile)
+    os.replace(tmpFn, outFn)
+
+
+def loadImageSummaries(figPath, chunkSize=2**20):
+    """
+    Load the curvature summaries of one image. Results saved before
+    the summaries existed are summarized from the cell and point
+    tables, reading the points a chunk at a time.
+
+    Inputs:
+    - figPath: the results directory of the image (string)
+    - chunkSize: the number of points read at a time (int)
+
+    Returns:
+    - summaries: the 'points' and 'cells' summaries (dict of
+                 CurvatureSummary)
+    """
+    try:
+        with open(figPath+SUMMARY_FN) as summaryFile:
+            state = json.load(summaryFile)
+        return {name: CurvatureSummary.fromDict(state[name]) for name in ('points', 'cells')}
+    except (OSError, ValueError, KeyError):
+        pass
+    points = np.load(figPath+POINTS_FN, mmap_mode='r')
+    pointSummary = CurvatureSummary()
+    for start in range(0, len(points), chunkSize):
+        pointSummary.add(points['curvature'][start:start+chunkSize])
+    cells = np.load(figPath+CELLS_FN)
+    return {'points': pointSummary, 'cells': CurvatureSummary().add(cells['curvatureMean'])}
+
+
+def summarizeExperiment(outDir='./figures/'):
+    """
+    Merge the curvature summaries of every processed image into the
+    summaries of the whole experiment. Only the summaries are read,
+    never the points, so the memory needed does not grow with the
+    number of images or cells.
+
+    Inputs:
+    - outDir: the directory holding the results of all images (string)
+
+    Returns:
+    - summaries: the 'points' and 'cells' summaries of the experiment
+                 (dict of CurvatureSummary)
+    - numImages: the number of images summarized (int)
+    """
+    summaries = {'points': CurvatureSummary(), 'cells': CurvatureSummary()}
+    cellsFns = sorted(glob.glob(os.path.join(outDir, '*', CELLS_FN)))
+    for cellsFn in cellsFns:
+        imageSummaries = loadImageSummaries(os.path.dirname(cellsFn)+'/')
+        for name in summaries:
+            summaries[name].merge(imageSummaries[name])
+
+    return summaries, len(cellsFns)
+
+
+#=========================================================================
+# Stage Cache
+#=========================================================================
+
+class StageCache(object):
+    """
+    On-disk cache of the results of the pipeline stages that do not
+    depend on the curvature settings. Each entry is a compressed .npz
+    file named after its stage and a hash of the input image and the
+    stage settings, so an entry is only found again for the same image
+    processed the same way. When the cache grows past its size limit,
+    the least recently used entries are removed. Hits and misses are
+    counted per stage.
+    """
+
+    def __init__(self, cacheDir, maxBytes=CACHE_MAX_MB*2**20):
+        """
+        Inputs:
+        - cacheDir: the directory holding the cache entries (string)
+        - maxBytes: the size limit of the cache in bytes (int)
+        """
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.stats = collections.Counter()
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir, exist_ok=True)
+
+    def getEntryPath(self, stage, key):
+        return os.path.join(self.cacheDir, stage+'-'+key+'.npz')
+
+    def load(self, stage, key):
+        """
+        Look up the entry of a stage.
+
+        Inputs:
+        - stage: one of CACHE_STAGES (string)
+        - key: the key of the entry, from getCacheKey (string)
+
+        Returns:
+        - arrays: the arrays of the entry, or None if there is no
+                  entry (dict of numpy arrays)
+        """
+        import zipfile
+        entryFn = self.getEntryPath(stage, key)
+        try:
+            with np.load(entryFn) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            # Mark the entry as recently used
+            os.utime(entryFn)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            # Missing, or removed or half written by another process
+            self.stats[stage, 'misses'] += 1
+            return None
+        self.stats[stage, 'hits'] += 1
+        return arrays
+
+    def store(self, stage, key, **arrays):
+        """
+        Save the entry of a stage, then shrink the cache back under its
+        size limit.
+
+        Inputs:
+        - stage: one of CACHE_STAGES (string)
+        - key: the key of the entry, from getCacheKey (string)
+        - arrays: the arrays to save, by name (numpy arrays)
+        """
+        entryFn = self.getEntryPath(stage, key)
+        tmpFn = entryFn+'.tmp%d' % os.getpid()
+        with open(tmpFn, 'wb') as tmpFile:
+            np.savez_compressed(tmpFile, **arrays)
+        os.replace(tmpFn, entryFn)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is
+        within its size limit.
+        """
+        entries = []
+        for entry in os.scandir(self.cacheDir):
+            if entry.name.endswith('.npz'):
+                try:
+                    info = entry.stat()
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, entry.path))
+        totalBytes = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            totalBytes -= size
+
+    def getReport(self, stats=None):
+        """
+        Make a text table of the hits and misses of each stage.
+
+        Inputs:
+        - stats: the counts to report, if not this cache's own
+                 (Counter of (stage, 'hits'/'misses') pairs)
+
+        Returns:
+        - report: the table (string)
+        """
+        stats = self.stats if stats is None else stats
+        lines = ['Cache Statistics (%s)' % self.cacheDir,
+                 '---------------------------------------',
+                 '%-14s %8s %8s' % ('stage', 'hits', 'misses')]
+        for stage in CACHE_STAGES:
+            lines.append('%-14s %8d %8d' % (stage, stats[stage, 'hits'], stats[stage, 'misses']))
+        return '\n'.join(lines)
+
+
+def getCacheKey(*parts):
+    """
+    Hash the given parts into a cache key.
+
+    Inputs:
+    - parts: the values the cached result depends on (strings and
+             numbers)
+
+    Returns:
+    - key: the hex digest of the parts (string)
+    """
+    import hashlib
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def hashFile(inputFn):
+    """
+    Hash the contents of a file.
+
+    Inputs:
+    - inputFn: the path to the file (string)
+
+    Returns:
+    - digest: the sha256 hex digest of the file (string)
+    """
+    import hashlib
+    digest = hashlib.sha256()
+    with open(inputFn, 'rb') as inputFile:
+        for block in iter(lambda: inputFile.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def getStageKeys(inputFn, contourEngine='marchingSquares', padding=1, cellFilter=None):
+    """
+    Make the cache key of every cached stage of an image. Each key
+    covers the image contents and the settings of its own stage and of
+    the stages before it.
+
+    Inputs:
+    - inputFn: the path to the input image (string)
+    - contourEngine: how the cell contours are traced (string)
+    - padding: the padding of the cell bounding boxes (int)
+    - cellFilter: the filter applied to the cells before they are
+                  contoured, if any (CellFilter)
+
+    Returns:
+    - keys: the key of each stage (dict of strings)
+    """
+    keys = {}
+    keys['segmentation'] = getCacheKey(CACHE_VERSION, hashFile(inputFn), 'segmentation',
+                                       OTSU_NUM_THRESHOLDS, OPENING_KERNEL_RADIUS,
+                                       int(getattr(sitk, OPENING_KERNEL_TYPE)))
+    keys['labelMap'] = getCacheKey(keys['segmentation'], 'labelMap')
+    keys['contours'] = getCacheKey(keys['labelMap'], 'contours', contourEngine,
+                                   CONTOUR_LEVEL, padding,
+                                   *(cellFilter.getKey() if cellFilter is not None else ()))
+    return keys
+
+
+def getLabelMapCached(image, cache, keys):
+    """
+    Segment and label the cells of an image, reusing the cached label
+    map, or failing that the cached segmentation, of an earlier run.
+
+    Inputs:
+    - image: the single channel image (sitk Image)
+    - cache: the stage cache (StageCache)
+    - keys: the keys of the stages of the image, from getStageKeys
+            (dict of strings)
+
+    Returns:
+    - labelMap: the label map image (sitk Image)
+    """
+    entry = cache.load('labelMap', keys['labelMap'])
+    if entry is not None:
+        return sitk.GetImageFromArray(entry['labels'])
+
+    entry = cache.load('segmentation', keys['segmentation'])
+    if entry is not None:
+        # The mask is stored one bit per pixel
+        shape = tuple(entry['shape'])
+        segArray = np.unpackbits(entry['mask'], count=int(np.prod(shape))).reshape(shape)
+        segImage = sitk.GetImageFromArray(segArray)
+    else:
+        segImage = segmentCells(image)
+        segArray = sitk.GetArrayViewFromImage(segImage)
+        cache.store('segmentation', keys['segmentation'],
+                    mask=np.packbits(segArray != 0), shape=np.array(segArray.shape))
+
+    labelMap = convertBinToLabelMap(segImage)
+    cache.store('labelMap', keys['labelMap'], labels=sitk.GetArrayViewFromImage(labelMap))
+    return labelMap
+
+
+def extractCellContoursCached(labelMap, cells, cache, keys, contourEngine='marchingSquares',
+                              numThreads=None):
+    """
+    Trace the contour of every cell, reusing the cached contours of an
+    earlier run.
+
+    Inputs:
+    - labelMap: the label map image (sitk Image)
+    - cells: one record per cell, from getCellStatistics; the ring
+             counts are filled in (numpy array of CELL_DTYPE)
+    - cache: the stage cache (StageCache)
+    - keys: the keys of the stages of the image, from getStageKeys
+            (dict of strings)
+    - contourEngine: one of CONTOUR_ENGINES (string)
+    - numThreads: the number of threads to contour the cells on (int)
+
+    Returns:
+    - labels: the label of each contour (list of ints)
+    - contours: the contour of each cell (list of Nx2 arrays)
+    """
+    entry = cache.load('contours', keys['contours'])
+    if entry is not None:
+        offsets = entry['offsets']
+        points = entry['points'].astype(np.float64)
+        cells['numOuterRings'] = entry['numOuterRings']
+        cells['numInnerRings'] = entry['numInnerRings']
+        contours = [points[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        return list(entry['labels']), contours
+
+    labels, contours = extractCellContours(labelMap, cells=cells, contourEngine=contourEngine,
+                                           numThreads=numThreads)
+    lengths = [len(contour) for contour in contours]
+    points = (np.concatenate([np.asarray(contour, dtype=np.float64).reshape(-1, 2)
+                              for contour in contours])
+              if contours else np.zeros((0, 2)))
+    # The contours mostly fall on whole and half pixels, so they are
+    # kept in single precision when that loses nothing
+    if np.array_equal(points.astype(np.float32), points):
+        points = points.astype(np.float32)
+    cache.store('contours', keys['contours'], labels=np.asarray(labels, dtype=np.int64),
+                points=points, offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+                numOuterRings=cells['numOuterRings'], numInnerRings=cells['numInnerRings'])
+    return labels, contours
+
+
+#=========================================================================
+# Profiling
+#=========================================================================
+
+class PipelineProfiler(object):
+    """
+    Measure the wall time, CPU time and peak memory of each stage of
+    the pipeline, count the cells and points of each image and append
+    one JSON line per image to a log file. Optionally, one stage is
+    also run under cProfile and its statistics are dumped next to the
+    results of the image. Peak memory is traced with tracemalloc,
+    which sees the NumPy arrays but not the buffers SimpleITK keeps
+    inside its images; the peak resident size of the process is
+    reported alongside.
+    """
+
+    def __init__(self, logFn, cProfileStage=None):
+        """
+        Inputs:
+        - logFn: the JSON lines file the records are appended to
+                 (string)
+        - cProfileStage: the stage to run under cProfile, one of
+                         PROFILE_STAGES, or None (string)
+        """
+        self.logFn = logFn
+        self.cProfileStage = cProfileStage
+        self.record = None
+
+    def startImage(self, inputFn, figFilePath='./', **fields):
+        """
+        Start the record of an image.
+
+        Inputs:
+        - inputFn: the path to the input image (string)
+        - figFilePath: where the cProfile statistics are dumped
+                       (string)
+        - fields: extra fields of the record, e.g. the frame of a
+                  stack (JSON serializable values)
+        """
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.figFilePath = figFilePath
+        self.startTime = time.perf_counter()
+        self.record = collections.OrderedDict([('image', inputFn), ('pid', os.getpid())])
+        self.record.update(fields)
+        self.record['stages'] = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Measure the code run inside a with block as one stage.
+
+        Inputs:
+        - name: the name of the stage, one of PROFILE_STAGES (string)
+        """
+        import tracemalloc
+        profile = None
+        if name == self.cProfileStage:
+            import cProfile
+            profile = cProfile.Profile()
+        tracemalloc.reset_peak()
+        baseMemory = tracemalloc.get_traced_memory()[0]
+        wallStart, cpuStart = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(self.figFilePath+'profile-'+name+'.prof')
+            peakMemory = tracemalloc.get_traced_memory()[1] - baseMemory
+            self.record['stages'][name] = collections.OrderedDict([
+                ('wallSeconds', time.perf_counter() - wallStart),
+                ('cpuSeconds', time.process_time() - cpuStart),
+                ('peakMemoryMB', peakMemory / 2**20)])
+
+    def count(self, name, value):
+        """
+        Add a count, such as the number of cells, to the record.
+
+        Inputs:
+        - name: the name of the count (string)
+        - value: the count (int)
+        """
+        self.record[name] = int(value)
+
+    def finishImage(self):
+        """
+        Append the record of the image to the log as one JSON line.
+        Each record is written with a single call on a file opened for
+        appending, so the workers of a batch can share the log.
+        """
+        import resource
+        self.record['totalWallSeconds'] = time.perf_counter() - self.startTime
+        # ru_maxrss is in kB on Linux and in bytes on OS X
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.record['maxRssMB'] = maxRss / (2**20 if sys.platform == 'darwin' else 2**10)
+        line = json.dumps(self.record) + '\n'
+        with open(self.logFn, 'a') as logFile:
+            logFile.write(line)
+        self.record = None
+
+
+def profileStage(profiler, name):
+    """
+    Measure a stage with the profiler, or do nothing without one.
+
+    Inputs:
+    - profiler: the profiler, or None (PipelineProfiler)
+    - name: the name of the stage, one of PROFILE_STAGES (string)
+
+    Returns:
+    - context: a context manager around the stage
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
+
+
+#=========================================================================
+# Pipeline
+#=========================================================================
+
+def getFigurePath(inputFn, outDir='./figures/'):
+    """
+    Get the directory the results of an image are written to.
+
+    Inputs:
+    - inputFn: the path to the input image (string)
+    - outDir: the directory holding the results of all images (string)
+
+    Returns:
+    - figPath: the results directory of the image (string)
+    """
+    inputFnBase = inputFn.split('/')[-1].split('.')[0]
+    return os.path.join(outDir, inputFnBase)+'/'
+
+
+def processImage(inputFn, saveIntermediateFigures=False, outDir='./figures/', makeFigures=True,
+                 contourEngine='marchingSquares', curvatureEngine='finiteDifference', cache=None,
+                 profiler=None, previewSize=None, cellFilter=None, numThreads=None):
+    """
+    Run the whole pipeline on one image: load it, segment and label
+    the cells, calculate the curvature of each cell contour and save
+    the figures and curvature values. Without figures, matplotlib's
+    pyplot is never imported and no figures are made.
+
+    Inputs:
+    - inputFn: the path to the input image (string)
+    - saveIntermediateFigures: flag to indicate whether to save
+                               intermediate images (boolean)
+    - outDir: the directory holding the results of all images (string)
+    - makeFigures: flag to indicate whether to save the curvature
+                   overlay and histogram (boolean)
+    - contourEngine: how to trace the cell contours, one of
+                     CONTOUR_ENGINES (string)
+    - curvatureEngine: how to calculate the curvature, one of
+                       CURVATURE_ENGINES (string)
+    - cache: the cache of the segmentation, label map and contours
+             of earlier runs; not used when the intermediate
+             figures are saved, since they are drawn as the stages
+             run (StageCache)
+    - profiler: measures each stage and logs a record of the image
+                (PipelineProfiler)
+    - previewSize: if given, also save a preview of the curvature
+                   overlay whose longer side is at most this many
+                   pixels (int)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out before contouring, and the number rejected for
+                  each reason is saved in summary.json (CellFilter)
+    - numThreads: the number of threads of the SimpleITK filters
+                  and of the per-cell contouring and curvature; by
+                  default the filters use one per CPU and the per-cell
+                  work runs in one thread (int)
+
+    Returns:
+    - numCells: the number of cells found in the image (int)
+    """
+    # Initialization
+    setNumberOfThreads(numThreads)
+    figPath = getFigurePath(inputFn, outDir)
+    if not os.path.exists(figPath):
+        os.makedirs(figPath)
+    if profiler is not None:
+        profiler.startImage(inputFn, figPath)
+
+    # Part 0: Load the image and reduce it to one channel
+    with profileStage(profiler, 'load'):
+        image = readImageFile(inputFn)
+    with profileStage(profiler, 'channelExtraction'):
+        image = extractFirstChannel(image)
+
+    useCache = cache is not None and not saveIntermediateFigures
+    if useCache:
+        keys = getStageKeys(inputFn, contourEngine, cellFilter=cellFilter)
+
+    # Part 1: Segment and identify the cells
+    if useCache:
+        with profileStage(profiler, 'labelMap'):
+            labelMap = getLabelMapCached(image, cache, keys)
+    else:
+        # Segmentation
+        with profileStage(profiler, 'segmentation'):
+            segmentedImage = segmentCells(image, 
+                                          saveIntermediate=saveIntermediateFigures,
+                                          figFilePath=figPath)
+        # Identify the cells
+        with profileStage(profiler, 'labeling'):
+            labelMap = convertBinToLabelMap(segmentedImage, 
+                                          saveIntermediate=saveIntermediateFigures,
+                                          figFilePath=figPath)
+
+    # Part 2: Calculate the curvature of each cell
+    # Measure every cell in one pass over the label map, and its shape
+    # in one more
+    with profileStage(profiler, 'cellStatistics'):
+        cells = getCellStatistics(labelMap)
+        rejected = None
+        if cellFilter is None:
+            measureCellShapes(labelMap, cells)
+        else:
+            # Leave out the debris and clumps before their centerlines
+            # are fitted and they are contoured
+            cells, rejected = cellFilter.apply(labelMap, cells)
+    # Get the contour of each cell from its own bounding box
+    with profileStage(profiler, 'contouring'):
+        if useCache:
+            labels, contours = extractCellContoursCached(labelMap, cells, cache, keys,
+                                                         contourEngine=contourEngine,
+                                                         numThreads=numThreads)
+        else:
+            labels, contours = extractCellContours(labelMap,
+                                                   saveIntermediate=saveIntermediateFigures,
+                                                   figFilePath=figPath,
+                                                   cells=cells,
+                                                   contourEngine=contourEngine,
+                                                   numThreads=numThreads)
+
+    with profileStage(profiler, 'curvature'):
+        # Calculate the curvatures for all cell contours in the image at once
+        curvatures, curves, offsets = calculateContourCurvatures(contours,
+                                                                 curvatureEngine=curvatureEngine,
+                                                                 numThreads=numThreads)
+        # Summarize the contour and curvature of each cell, and the
+        # curvatures of the image
+        summarizeCellContours(cells, contours, curvatures, offsets)
+        summaries = summarizeCurvatures(cells, curvatures)
+        if cellFilter is not None:
+            numberKeptCells(cells)
+
+    # Part 3: Generate result figures
+    if makeFigures:
+        with profileStage(profiler, 'rendering'):
+            # Make the composite original image with curvatures
+            saveCurvatureOverlay(image, curves, curvatures, figFilePath=figPath,
+                                 previewSize=previewSize)
+            # Show a histogram of curvatures
+            saveCurvatureHistogram(curvatures, figFilePath=figPath)
+    # Release the figures so they do not pile up when one process
+    # handles many images
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+
+    # Part 4: Save the cell and point tables
+    with profileStage(profiler, 'saving'):
+        saveResults(cells, contours, curvatures, figFilePath=figPath, summaries=summaries,
+                    **({'rejected': rejected} if rejected is not None else {}))
+
+    if profiler is not None:
+        profiler.count('numCells', len(labels))
+        if rejected is not None:
+            profiler.count('numRejected', rejected['total'])
+        profiler.count('numPoints', len(curvatures))
+        profiler.finishImage()
+
+    return len(labels)
+
+
+def renderFigures(inputFn, outDir='./figures/', previewSize=None):
+    """
+    Make the curvature overlay and histogram of an image from its
+    saved results, without segmenting the image again.
+
+    Inputs:
+    - inputFn: the path to the input image (string)
+    - outDir: the directory holding the results of all images (string)
+    - previewSize: if given, also save a preview of the curvature
+                   overlay whose longer side is at most this many
+                   pixels (int)
+
+    Returns:
+    - numCells: the number of cells in the saved results (int)
+    """
+    import matplotlib.pyplot as plt
+
+    figPath = getFigurePath(inputFn, outDir)
+    imageName = os.path.basename(os.path.dirname(figPath))
+    cells = np.load(figPath+CELLS_FN)
+    points = loadPointTable(imageName, outDir, mmapMode=None)
+
+    # The overlay needs the image, but only as a background
+    image = loadImage(inputFn)
+    # Round the contour points to (row, column) pixels
+    curves = np.rint(np.column_stack([points['y'], points['x']])).astype(np.int32)
+
+    saveCurvatureOverlay(image, curves, points['curvature'], figFilePath=figPath,
+                         previewSize=previewSize)
+    saveCurvatureHistogram(points['curvature'], figFilePath=figPath)
+    plt.close('all')
+
+    return len(cells)
+
+
+#=========================================================================
+# Batch Processing
+#=========================================================================
+
+def getBatchFilenames(batchSpec):
+    """
+    Expand a batch specification into a list of image paths. The
+    specification can be a directory (all images in it), a manifest
+    file (one image path per line, relative paths are relative to the
+    manifest; blank lines and lines starting with # are skipped) or a
+    glob pattern.
+
+    Inputs:
+    - batchSpec: the directory, manifest file or glob (string)
+
+    Returns:
+    - inputFns: the paths of the images to process (list of strings)
+    """
+    if os.path.isdir(batchSpec):
+        inputFns = [os.path.join(batchSpec, fn) for fn in os.listdir(batchSpec)
+                    if fn.lower().endswith(IMAGE_EXTENSIONS)]
+    elif os.path.isfile(batchSpec):
+        manifestDir = os.path.dirname(batchSpec)
+        inputFns = []
+        with open(batchSpec) as manifest:
+            for line in manifest:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    inputFns.append(os.path.join(manifestDir, line))
+        return inputFns
+    else:
+        inputFns = glob.glob(batchSpec)
+
+    return sorted(inputFns)
+
+
+def processImageCached(inputFn, cache, *args, **kwargs):
+    """
+    Run processImage with a stage cache in a worker process and send
+    the cache statistics of the image back with the result.
+
+    Inputs:
+    - inputFn: the path to the input image (string)
+    - cache: the stage cache, or None (StageCache)
+    - args, kwargs: the other arguments of processImage
+
+    Returns:
+    - numCells: the number of cells found in the image (int)
+    - stats: the cache hits and misses of the image (Counter)
+    """
+    if cache is not None:
+        cache.stats.clear()
+    numCells = processImage(inputFn, *args, cache=cache, **kwargs)
+    return numCells, (cache.stats if cache is not None else collections.Counter())
+
+
+def runBatch(inputFns, numWorkers=None, saveIntermediateFigures=False, outDir='./figures/',
+             makeFigures=True, figuresOnly=False, contourEngine='marchingSquares',
+             curvatureEngine='finiteDifference', cache=None, profiler=None, previewSize=None,
+             cellFilter=None, numThreads=None):
+    """
+    Process many images across a pool of worker processes. Each worker
+    imports the libraries once and then handles one image after
+    another, writing the results of each image as soon as it is done.
+    Images whose cell table already exists are skipped, so an
+    interrupted batch can be resumed by running it again. With
+    figuresOnly, the figures of images that have results but no
+    figures are made from the saved results instead. At the end, the
+    curvature summaries of every image in the output directory are
+    merged into the summary of the whole experiment.
+
+    Inputs:
+    - inputFns: the paths of the images to process (list of strings)
+    - numWorkers: the number of worker processes; defaults to the
+                  number of CPUs (int)
+    - saveIntermediateFigures: flag to indicate whether to save
+                               intermediate images (boolean)
+    - outDir: the directory holding the results of all images (string)
+    - makeFigures: flag to indicate whether to save the curvature
+                   overlay and histogram while processing (boolean)
+    - figuresOnly: flag to indicate that only the figures should be
+                   made, from the saved results (boolean)
+    - contourEngine: how to trace the cell contours, one of
+                     CONTOUR_ENGINES (string)
+    - curvatureEngine: how to calculate the curvature, one of
+                       CURVATURE_ENGINES (string)
+    - cache: the stage cache, shared by the workers through its
+             directory; the hits and misses of every image are added
+             to its statistics (StageCache)
+    - profiler: measures each stage and logs a record of every image;
+                the workers append to the same log (PipelineProfiler)
+    - previewSize: if given, also save a preview of each curvature
+                   overlay whose longer side is at most this many
+                   pixels (int)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out before contouring (CellFilter)
+    - numThreads: the number of threads of each worker (int)
+
+    Returns:
+    - failures: the images that could not be processed and the
+                reason (list of (string, string) tuples)
+
+    Effects:
+    - Writes experiment-summary.json, and with figures the histogram
+    of the curvatures of the whole experiment, in the output directory
+
+    Raises:
+    - ValueError: when images in different directories (or with
+      different extensions) have the same name, since their results
+      would go to the same directory
+    """
+    # The results directory is named after the image alone, so images
+    # with the same name would write over each other's results, and
+    # the second would be skipped as already done
+    figPaths = collections.defaultdict(list)
+    for fn in inputFns:
+        figPaths[getFigurePath(fn, outDir)].append(fn)
+    clashes = [fns for fns in figPaths.values() if len(fns) > 1]
+    if clashes:
+        raise ValueError("Images with the same name would share a results directory: "
+                         + '; '.join(', '.join(fns) for fns in clashes))
+
+    # Skip the images that were finished by an earlier run
+    if figuresOnly:
+        todoFns = [fn for fn in inputFns
+                   if os.path.exists(getFigurePath(fn, outDir)+CELLS_FN)
+                   and not os.path.exists(getFigurePath(fn, outDir)+'curvatures.png')]
+    else:
+        todoFns = [fn for fn in inputFns
+                   if not os.path.exists(getFigurePath(fn, outDir)+CELLS_FN)]
+    print('Processing', len(todoFns), 'of', len(inputFns), 'images',
+          '(' + str(len(inputFns)-len(todoFns)), 'already done)')
+
+    import concurrent.futures
+    failures = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers) as executor:
+        if figuresOnly:
+            futures = {executor.submit(renderFigures, fn, outDir, previewSize): fn
+                       for fn in todoFns}
+        else:
+            futures = {executor.submit(processImageCached, fn, cache, saveIntermediateFigures,
+                                       outDir, makeFigures, contourEngine, curvatureEngine,
+                                       profiler=profiler, previewSize=previewSize,
+                                       cellFilter=cellFilter, numThreads=numThreads): fn
+                       for fn in todoFns}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            inputFn = futures[future]
+            try:
+                if figuresOnly:
+                    numCells = future.result()
+                else:
+                    numCells, stats = future.result()
+                    if cache is not None:
+                        cache.stats.update(stats)
+                print('[%d/%d] %s: %d cells' % (done, len(todoFns), inputFn, numCells))
+            except Exception as err:
+                print('[%d/%d] %s: failed (%s)' % (done, len(todoFns), inputFn, err))
+                failures.append((inputFn, repr(err)))
+
+    # Merge the summaries of every image with results, including those
+    # of earlier runs, into the summary of the experiment
+    summaries, numImages = summarizeExperiment(outDir)
+    if numImages > 0:
+        statistics = {name: summary.getStatistics() for name, summary in summaries.items()}
+        saveSummaries(summaries, os.path.join(outDir, EXPERIMENT_SUMMARY_FN),
+                      numImages=numImages, statistics=statistics)
+        print('Experiment: %d images, %d cells, %d contour points'
+              % (numImages, summaries['cells'].count + summaries['cells'].numUndefined,
+                 summaries['points'].count + summaries['points'].numUndefined))
+        if makeFigures or figuresOnly:
+            saveCurvatureHistogram(summaries['points'], figFilePath=os.path.join(outDir, ''))
+            sys.modules['matplotlib.pyplot'].close('all')
+
+    return failures
+
+
+#=========================================================================
+# Time-Lapse Stacks
+#=========================================================================
+
+def iterateStackFrames(inputFn):
+    """
+    Read the frames of a multi-frame TIFF one at a time. Uncompressed
+    stacks are memory mapped; other stacks are decoded one page at a
+    time, so only the current frame is held in memory either way.
+
+    Inputs:
+    - inputFn: the path to the TIFF stack (string)
+
+    Returns:
+    - frames: a generator of the single channel frames (sitk Images)
+    """
+    import tifffile
+
+    with tifffile.TiffFile(inputFn) as tif:
+        series = tif.series[0]
+        # Each frame is YX, or YXS with the channels (samples) last
+        frameNdim = 3 if series.axes.endswith('S') else 2
+        numFrames = int(np.prod(series.shape[:len(series.shape)-frameNdim]))
+
+        try:
+            stack = tifffile.memmap(inputFn, mode='r')
+        except ValueError:
+            # Compressed or scattered pages cannot be mapped
+            stack = None
+
+        if stack is not None:
+            frames = stack.reshape((numFrames,) + stack.shape[stack.ndim-frameNdim:])
+            for frame in frames:
+                yield getFrameImage(frame)
+        else:
+            # Do not keep the pages that have been read
+            tif.pages.cache = False
+            for index in range(numFrames):
+                yield getFrameImage(tif.asarray(key=index))
+
+
+def linkCellsByOverlap(prevLabelArray, prevTracks, labelArray, nextTrack,
+                       minOverlap=TRACK_MIN_OVERLAP):
+    """
+    Link the cells of a frame to those of the previous frame by how
+    much they overlap. Pairs of cells are matched one to one, the most
+    overlapping pairs first; a cell without a match at least
+    minOverlap (intersection over union) starts a new track.
+
+    Inputs:
+    - prevLabelArray: the label map of the previous frame, or None for
+                      the first frame (2D int array)
+    - prevTracks: the track of each label of the previous frame,
+                  indexed by label (int array)
+    - labelArray: the label map of this frame (2D int array)
+    - nextTrack: the number of the next new track (int)
+    - minOverlap: the smallest overlap that links two cells (float)
+
+    Returns:
+    - tracks: the track of each label of this frame, indexed by label
+              (uint32 array)
+    - nextTrack: the number of the next new track (int)
+    """
+    numLabels = int(labelArray.max()) if labelArray.size else 0
+    tracks = np.zeros(numLabels+1, dtype=np.uint32)
+
+    if prevLabelArray is not None and numLabels > 0:
+        # Count the pixels shared by every pair of overlapping cells
+        prevLabels = prevLabelArray.ravel().astype(np.int64)
+        labels = labelArray.ravel().astype(np.int64)
+        both = (prevLabels > 0) & (labels > 0)
+        pairs, shared = np.unique(prevLabels[both]*(numLabels+1) + labels[both],
+                                  return_counts=True)
+        pairPrev, pairLabel = np.divmod(pairs, numLabels+1)
+
+        prevAreas = np.bincount(prevLabels)
+        areas = np.bincount(labels, minlength=numLabels+1)
+        overlap = shared / (prevAreas[pairPrev] + areas[pairLabel] - shared)
+
+        # Match greedily, the most overlapping pairs first
+        prevUsed = np.zeros(len(prevAreas), dtype=bool)
+        for pair in np.argsort(-overlap, kind='stable'):
+            if overlap[pair] < minOverlap:
+                break
+            prevLabel, label = pairPrev[pair], pairLabel[pair]
+            if prevUsed[prevLabel] or tracks[label]:
+                continue
+            prevUsed[prevLabel] = True
+            tracks[label] = prevTracks[prevLabel]
+
+    # Every unmatched cell starts a new track
+    newTracks = np.nonzero(tracks[1:] == 0)[0] + 1
+    tracks[newTracks] = np.arange(nextTrack, nextTrack+len(newTracks))
+    return tracks, nextTrack+len(newTracks)
+
+
+def saveCurvatureTracks(tracks, figFilePath='./'):
+    """
+    Plot the mean curvature of every tracked cell against the frame.
+
+    Inputs:
+    - tracks: one record per cell per frame (numpy array of
+              TRACK_DTYPE)
+    - figFilePath: the path to the location where the figure
+                   will be saved (string)
+
+    Effects:
+    - Makes a plot of the curvature time series of the cells seen in
+    more than one frame and saves it in the designated location
+    """
+    import matplotlib.pyplot as plt
+
+    order = np.lexsort((tracks['frame'], tracks['track']))
+    tracks = tracks[order]
+    trackIds, starts, counts = np.unique(tracks['track'], return_index=True, return_counts=True)
+
+    plt.figure(figsize=(10,7))
+    for start, count in zip(starts, counts):
+        if count > 1:
+            trackRecords = tracks[start:start+count]
+            plt.plot(trackRecords['frame'], trackRecords['curvatureMean'], linewidth=0.8)
+    plt.title('Mean Curvature of the Tracked Cells')
+    plt.xlabel('Frame')
+    plt.ylabel(u'Mean curvature (${\mu}m^{-1}$)')
+    plt.savefig(figFilePath+'curvature-tracks.png', bbox_inches='tight')
+
+
+def processStack(inputFn, outDir='./figures/', makeFigures=True, contourEngine='marchingSquares',
+                 curvatureEngine='finiteDifference', minOverlap=TRACK_MIN_OVERLAP, profiler=None,
+                 cellFilter=None, numThreads=None):
+    """
+    Run the pipeline on every frame of a multi-frame TIFF time series
+    and track the cells from frame to frame. Frames are streamed: only
+    the current frame and the label map of the previous one are held,
+    however long the stack is.
+
+    Inputs:
+    - inputFn: the path to the TIFF stack (string)
+    - outDir: the directory holding the results of all images (string)
+    - makeFigures: flag to indicate whether to plot the curvature
+                   of the tracked cells (boolean)
+    - contourEngine: how to trace the cell contours, one of
+                     CONTOUR_ENGINES (string)
+    - curvatureEngine: how to calculate the curvature, one of
+                       CURVATURE_ENGINES (string)
+    - minOverlap: the smallest overlap that links a cell to one in
+                  the previous frame (float)
+    - profiler: measures each stage and logs a record of every frame
+                (PipelineProfiler)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out of every frame before contouring and tracking
+                  (CellFilter)
+    - numThreads: the number of threads of the SimpleITK filters
+                  and of the per-cell contouring and curvature; by
+                  default the filters use one per CPU and the per-cell
+                  work runs in one thread (int)
+
+    Returns:
+    - numFrames: the number of frames in the stack (int)
+    - numTracks: the number of tracked cells (int)
+
+    Effects:
+    - Writes tracks.npy with one record per cell per frame
+    """
+    setNumberOfThreads(numThreads)
+    figPath = getFigurePath(inputFn, outDir)
+    if not os.path.exists(figPath):
+        os.makedirs(figPath)
+
+    prevLabelArray, prevTracks, nextTrack = None, None, 1
+    records = []
+    frames = iterateStackFrames(inputFn)
+    for frame in itertools.count():
+        if profiler is not None:
+            profiler.startImage(inputFn, figPath, frame=frame)
+        with profileStage(profiler, 'load'):
+            image = next(frames, None)
+        if image is None:
+            break
+
+        # Segment, label and measure the cells of the frame
+        with profileStage(profiler, 'segmentation'):
+            segmentedImage = segmentCells(image)
+        with profileStage(profiler, 'labeling'):
+            labelMap = convertBinToLabelMap(segmentedImage)
+        with profileStage(profiler, 'cellStatistics'):
+            cells = getCellStatistics(labelMap)
+            if cellFilter is None:
+                measureCellShapes(labelMap, cells)
+            else:
+                cells, rejected = cellFilter.apply(labelMap, cells)
+                # The cells are tracked by the overlap of their labels,
+                # so the rejected cells leave the label map
+                if rejected['total'] > 0:
+                    labelMap, cells = keepCells(labelMap, cells)
+        with profileStage(profiler, 'contouring'):
+            labels, contours = extractCellContours(labelMap, cells=cells,
+                                                   contourEngine=contourEngine,
+                                                   numThreads=numThreads)
+        with profileStage(profiler, 'curvature'):
+            curvatures, curves, offsets = calculateContourCurvatures(contours,
+                                                                     curvatureEngine=curvatureEngine,
+                                                                     numThreads=numThreads)
+            summarizeCellContours(cells, contours, curvatures, offsets)
+
+        # Carry the tracks over from the previous frame
+        labelArray = sitk.GetArrayFromImage(labelMap)
+        tracks, nextTrack = linkCellsByOverlap(prevLabelArray, prevTracks, labelArray,
+                                               nextTrack, minOverlap)
+        frameRecords = np.zeros(len(cells), dtype=TRACK_DTYPE)
+        for name in TRACK_DTYPE.names[2:]:
+            frameRecords[name] = cells[name]
+        frameRecords['frame'] = frame
+        frameRecords['track'] = tracks[cells['label']]
+        records.append(frameRecords)
+
+        prevLabelArray, prevTracks = labelArray, tracks
+        print('Frame %d: %d cells, %d tracks so far' % (frame, len(cells), nextTrack-1))
+        if profiler is not None:
+            profiler.count('numCells', len(cells))
+            profiler.count('numPoints', len(curvatures))
+            profiler.finishImage()
+
+    tracks = np.concatenate(records) if records else np.zeros(0, dtype=TRACK_DTYPE)
+    saveArrayAtomically(figPath+TRACKS_FN, tracks)
+    if makeFigures:
+        saveCurvatureTracks(tracks, figFilePath=figPath)
+        sys.modules['matplotlib.pyplot'].close('all')
+
+    return len(records), nextTrack-1
+
+
+#=========================================================================
+# Tiled Mosaics
+#=========================================================================
+
+def getMosaicHistogram(inputFn, stripHeight=MOSAIC_TILE_SIZE):
+    """
+    Count the pixels of each value in the first channel of an image,
+    reading it one strip of rows at a time, so that the whole image
+    is never held in memory.
+
+    Inputs:
+    - inputFn: the path to the image (string)
+    - stripHeight: the number of rows read at a time (int)
+
+    Returns:
+    - histogram: the number of pixels of each value, indexed by the
+                 value (int64 array)
+    """
+    width, height = getImageSize(inputFn)
+    histogram = np.zeros(0, dtype=np.int64)
+    for yStart in range(0, height, stripHeight):
+        strip = readImageRegion(inputFn, (0, yStart, width, min(yStart+stripHeight, height)))
+        stripArray = sitk.GetArrayViewFromImage(strip)
+        if stripArray.dtype.kind != 'u':
+            raise ValueError("Tiled processing needs unsigned integer pixels, not "+str(stripArray.dtype))
+        counts = np.bincount(stripArray.reshape(-1), minlength=len(histogram))
+        counts[:len(histogram)] += histogram
+        histogram = counts
+
+    return histogram
+
+
+def getTileWindows(width, height, tileSize=MOSAIC_TILE_SIZE, overlap=MOSAIC_TILE_OVERLAP):
+    """
+    Split a mosaic into square tiles, each with a window that reaches
+    past the tile by the overlap on every side.
+
+    Inputs:
+    - width, height: the size of the mosaic (ints)
+    - tileSize: the side length of the tiles (int)
+    - overlap: how far each window reaches past its tile (int)
+
+    Returns:
+    - tiles: the (tile, window) boxes of every tile, row by row; each
+             box is (xStart, yStart, xEnd, yEnd), clipped to the
+             mosaic and end-exclusive (list of tuples)
+    """
+    tiles = []
+    for yStart in range(0, height, tileSize):
+        for xStart in range(0, width, tileSize):
+            tile = (xStart, yStart, min(xStart+tileSize, width), min(yStart+tileSize, height))
+            window = (max(tile[0]-overlap, 0), max(tile[1]-overlap, 0),
+                      min(tile[2]+overlap, width), min(tile[3]+overlap, height))
+            tiles.append((tile, window))
 
-    # Part 0: Preprocessing
-    # If the pixels have 4 components, they have been loaded as RGBA
-    # images. All 3 RGB channels contain the same information, and
-    # the 4th channel is full of 255s. We extract one channel and
-    # use that channel as the image for processing purposes.
-    if image.GetNumberOfComponentsPerPixel() == 4:
-        # Convert the image to an array
-        imageArray = sitk.GetArrayFromImage(image)
-        # Pull the first channel from the array
-        imageOneChannel = sitk.GetImageFromArray(imageArray[:,:,0])
-        # Check the information of the single channel image is correct
-        assert imageOneChannel.GetSize() == image.GetSize()
-        assert imageOneChannel.GetDimension() == image.GetDimension()
-        assert imageOneChannel.GetNumberOfComponentsPerPixel() == 1
-        assert imageOneChannel.GetPixelIDTypeAsString() == "8-bit unsigned integer"
-        # Use the first channel as the image
-        image = imageOneChannel
+    return tiles
 
-    # Part 1: Segment and identify the cells
-    # Segmentation
-    segmentedImage = segmentCells(image, 
-                                  saveIntermediate=saveIntermediateFigures,
-                                  figFilePath=figPath)
-    # Identify the cells
-    labelMap = convertBinToLabelMap(segmentedImage, 
-                                  saveIntermediate=saveIntermediateFigures,
-                                  figFilePath=figPath)
 
-    # Part 2: Calculate the curvature of each cell
-    # Calculate the curvatures for all cells in the image
-    curvatures = []
-    curves = []
-    labelArray = sitk.GetArrayFromImage(labelMap)
-
-    # Iterate through each label
-    for label in range(1,np.amax(labelArray)+1):
-        singleLabel = (labelMap==label)
-        # get the contour for the cell
-        singleCurve = getCellContour(singleLabel, 
-                                     saveIntermediate=saveIntermediateFigures,
-                                     figFilePath=figPath)
-        # get the curvature for the cell contour
-        singleCurvature, singleCurve = calculateContourCurvature(singleCurve)
-        # Add the contour points and the curvatures to the master lists of contours and curvatures
-        curvatures.extend(singleCurvature)
-        curves.extend(singleCurve)
+def isCutByWindow(cells, window, imageSize, origin=(0, 0)):
+    """
+    Find the cells that touch an edge of a window inside the mosaic,
+    and so may carry on outside the window.
 
-    # Part 3: Generate result figures
-    # Make the composite original image with curvatures
-    saveCurvatureOverlay(image, curves, curvatures, figFilePath=figPath)
-    # Show a histogram of curvatures
-    saveCurvatureHistogram(curvatures, figFilePath=figPath)
+    Inputs:
+    - cells: the cell records (numpy array of CELL_DTYPE)
+    - window: the window, as (xStart, yStart, xEnd, yEnd) (tuple)
+    - imageSize: the (width, height) of the mosaic (tuple)
+    - origin: the mosaic position the bounding boxes of the cells
+              and the window are measured from (tuple)
+
+    Returns:
+    - isCut: whether each cell may be cut by the window (boolean array)
+    """
+    xStart, yStart, xEnd, yEnd = window
+    width, height = imageSize
+    return (((cells['xStart'] <= xStart) & (xStart + origin[0] > 0))
+            | ((cells['yStart'] <= yStart) & (yStart + origin[1] > 0))
+            | ((cells['xEnd'] >= xEnd) & (xEnd + origin[0] < width))
+            | ((cells['yEnd'] >= yEnd) & (yEnd + origin[1] < height)))
+
+
+def measureRegion(inputFn, window, imageSize, thresholds, contourEngine='marchingSquares',
+                  cellFilter=None, numThreads=None):
+    """
+    Segment, label and contour the cells in one window of a mosaic.
+    The window is read with a margin as wide as the opening reaches,
+    so the segmentation inside the window is exactly the one of the
+    whole mosaic, and the cells that do not touch the edges of the
+    window are exactly the cells of the whole mosaic.
+
+    Inputs:
+    - inputFn: the path to the mosaic (string)
+    - window: the window, as (xStart, yStart, xEnd, yEnd) (tuple)
+    - imageSize: the (width, height) of the mosaic (tuple)
+    - thresholds: the Otsu thresholds of the whole mosaic (list of
+                  floats)
+    - contourEngine: how to trace the cell contours, one of
+                     CONTOUR_ENGINES (string)
+    - cellFilter: if given, the cells that fail its limits are not
+                  contoured; cells cut by the window are only checked
+                  once they are seen whole (CellFilter)
+    - numThreads: the number of threads to contour the cells on (int)
+
+    Returns:
+    - cells: one record per cell, with the bounding boxes in mosaic
+             coordinates and the labels of the window's label map
+             (numpy array of CELL_DTYPE)
+    - contours: the contour of each cell in mosaic coordinates, or
+                None for a rejected cell (list of arrays)
+    - anchors: the (x, y) mosaic position of the first pixel of each
+               cell in raster order (Nx2 int array)
+    - labelMap: the label map of the window, rejected cells included
+                (sitk Image)
+    - rejections: for each of FILTER_REASONS, whether each cell fails
+                  that limit (dict of boolean arrays)
+    """
+    xStart, yStart, xEnd, yEnd = window
+    width, height = imageSize
+    margin = 2*OPENING_KERNEL_RADIUS
+    readBox = (max(xStart-margin, 0), max(yStart-margin, 0),
+               min(xEnd+margin, width), min(yEnd+margin, height))
+    image = readImageRegion(inputFn, readBox)
+    segmentedImage = segmentCells(image, thresholds=thresholds)
+    segmentedImage = segmentedImage[xStart-readBox[0]:xEnd-readBox[0],
+                                    yStart-readBox[1]:yEnd-readBox[1]]
+    labelMap = convertBinToLabelMap(segmentedImage)
+    cells = getCellStatistics(labelMap)
+    pixels = getCellPixels(labelMap, cells)
+    measureCellOutlines(cells, pixels)
+
+    # Check the cells against the filter in mosaic coordinates, and
+    # fit and contour the ones that pass
+    rejections = {reason: np.zeros(len(cells), dtype=bool) for reason in FILTER_REASONS}
+    if cellFilter is not None:
+        isCut = isCutByWindow(cells, (0, 0, xEnd-xStart, yEnd-yStart), imageSize, origin=(xStart, yStart))
+        rejections = cellFilter.getRejections(cells, imageSize, origin=(xStart, yStart))
+        for reason in FILTER_REASONS:
+            rejections[reason] &= ~isCut
+    isRejected = isRejectedFor(rejections)
+    keptCells = cells[~isRejected]
+    measureCellCenterlines(keptCells, selectCellPixels(pixels, ~isRejected))
+    keptContours = extractCellContours(labelMap, cells=keptCells, contourEngine=contourEngine,
+                                       numThreads=numThreads)[1]
+    cells[~isRejected] = keptCells
+    contours = [None]*len(cells)
+    for i, contour in zip(np.flatnonzero(~isRejected), keptContours):
+        contours[i] = contour
+
+    # The first pixel of a cell is the leftmost one in its top row
+    labelArray = sitk.GetArrayViewFromImage(labelMap)
+    anchors = np.zeros((len(cells), 2), dtype=np.int64)
+    for i, cell in enumerate(cells):
+        topRow = labelArray[cell['yStart'], cell['xStart']:cell['xEnd']]
+        anchors[i] = (cell['xStart']+np.argmax(topRow == cell['label']), cell['yStart'])
+
+    # Move everything from window to mosaic coordinates
+    anchors += (xStart, yStart)
+    for name, offset in (('xStart', xStart), ('xEnd', xStart), ('yStart', yStart), ('yEnd', yStart)):
+        cells[name] += offset
+    contours = [np.asarray(contour, dtype=np.float64) + (xStart, yStart) if contour is not None else None
+                for contour in contours]
+
+    return cells, contours, anchors, labelMap, rejections
+
+
+def processMosaicTile(inputFn, tile, window, imageSize, thresholds,
+                      contourEngine='marchingSquares', curvatureEngine='finiteDifference',
+                      cellFilter=None, numThreads=None):
+    """
+    Measure the cells of one tile of a mosaic: the cells whose first
+    pixel is in the tile and that fit inside the tile's window. Cells
+    cut by the window are handed back to be followed across the seams
+    (see resolveCutCell).
+
+    Inputs:
+    - inputFn: the path to the mosaic (string)
+    - tile: the tile, as (xStart, yStart, xEnd, yEnd) (tuple)
+    - window: the tile's window (tuple)
+    - imageSize: the (width, height) of the mosaic (tuple)
+    - thresholds: the Otsu thresholds of the whole mosaic (list of
+                  floats)
+    - contourEngine: how to trace the cell contours, one of
+                     CONTOUR_ENGINES (string)
+    - curvatureEngine: how to calculate the curvature, one of
+                       CURVATURE_ENGINES (string)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out (CellFilter)
+    - numThreads: the number of threads of the SimpleITK filters and
+                  of the per-cell work of the tile (int)
+
+    Returns:
+    - cells: the records of the cells of the tile (numpy array of
+             CELL_DTYPE)
+    - contours: the contour of each cell (list of arrays)
+    - curvatures: the curvatures along each contour (list of arrays)
+    - anchors: the first pixel of each cell (Nx2 int array)
+    - cutAnchors: the first pixel of each cut cell, as far as the
+                  window shows it (Nx2 int array)
+    - cutCells: the records of the cut cells, as far as the window
+                shows them (numpy array of CELL_DTYPE)
+    - rejected: the number of cells of the tile rejected for each
+                reason and in total (dict of ints, see
+                countRejections)
+    """
+    setNumberOfThreads(numThreads)
+    cells, contours, anchors, labelMap, rejections = measureRegion(inputFn, window, imageSize,
+                                                                   thresholds, contourEngine=contourEngine,
+                                                                   cellFilter=cellFilter,
+                                                                   numThreads=numThreads)
+    isCut = isCutByWindow(cells, window, imageSize)
+    inTile = ((anchors[:, 0] >= tile[0]) & (anchors[:, 0] < tile[2])
+              & (anchors[:, 1] >= tile[1]) & (anchors[:, 1] < tile[3]))
+    keep = np.flatnonzero(inTile & ~isCut & ~isRejectedFor(rejections))
+
+    cellContours = [contours[i] for i in keep]
+    curvatures, curves, offsets = calculateContourCurvatures(cellContours,
+                                                             curvatureEngine=curvatureEngine,
+                                                             numThreads=numThreads)
+    tileCells = summarizeCellContours(cells[keep], cellContours, curvatures, offsets)
+    cellCurvatures = [curvatures[offsets[i]:offsets[i+1]] for i in range(len(keep))]
+
+    return (tileCells, cellContours, cellCurvatures, anchors[keep], anchors[isCut], cells[isCut],
+            countRejections(rejections, inTile))
+
+
+def resolveCutCell(inputFn, anchor, cell, imageSize, thresholds, growBy,
+                   contourEngine='marchingSquares', cellFilter=None):
+    """
+    Follow a cell that is cut by the window of a tile across the
+    seams: read a window around the part of the cell that was seen,
+    and widen it until the whole cell fits inside.
+
+    Inputs:
+    - inputFn: the path to the mosaic (string)
+    - anchor: a pixel of the cell (x, y) (ints)
+    - cell: the record of the part of the cell that was seen (numpy
+            record of CELL_DTYPE)
+    - imageSize: the (width, height) of the mosaic (tuple)
+    - thresholds: the Otsu thresholds of the whole mosaic (list of
+                  floats)
+    - growBy: how far the first window reaches past the part that
+              was seen; it doubles every time the cell is still cut
+              (int)
+    - contourEngine: how to trace the cell contours, one of
+                     CONTOUR_ENGINES (string)
+    - cellFilter: if given, the whole cell is checked against its
+                  limits (CellFilter)
+
+    Returns:
+    - cell: the record of the whole cell (numpy array of one
+            CELL_DTYPE record)
+    - contour: the contour of the cell, or None if it is rejected
+               (array)
+    - anchor: the first pixel of the cell (x, y) (int array)
+    - rejections: for each of FILTER_REASONS, whether the cell fails
+                  that limit (dict of boolean arrays of one value)
+    """
+    width, height = imageSize
+    box = (cell['xStart'], cell['yStart'], cell['xEnd'], cell['yEnd'])
+    while True:
+        window = (max(int(box[0])-growBy, 0), max(int(box[1])-growBy, 0),
+                  min(int(box[2])+growBy, width), min(int(box[3])+growBy, height))
+        cells, contours, anchors, labelMap, rejections = measureRegion(inputFn, window, imageSize,
+                                                                       thresholds,
+                                                                       contourEngine=contourEngine,
+                                                                       cellFilter=cellFilter)
+        label = labelMap.GetPixel(int(anchor[0])-window[0], int(anchor[1])-window[1])
+        i = int(np.flatnonzero(cells['label'] == label)[0])
+        if not isCutByWindow(cells[i:i+1], window, imageSize)[0]:
+            return (cells[i:i+1], contours[i], anchors[i],
+                    {reason: rejections[reason][i:i+1] for reason in FILTER_REASONS})
+        box = (cells[i]['xStart'], cells[i]['yStart'], cells[i]['xEnd'], cells[i]['yEnd'])
+        growBy *= 2
+
+
+def processMosaic(inputFn, outDir='./figures/', makeFigures=True, tileSize=MOSAIC_TILE_SIZE,
+                  overlap=MOSAIC_TILE_OVERLAP, numWorkers=None, contourEngine='marchingSquares',
+                  curvatureEngine='finiteDifference', cellFilter=None, numThreads=None):
+    """
+    Run the pipeline on a mosaic too large to process in one piece.
+    A first pass streams through the mosaic to build the histogram
+    its Otsu thresholds are computed from. The tiles are then
+    processed in parallel, each in a window that overlaps its
+    neighbours. Every cell is measured exactly once: by the tile
+    holding its first pixel if it fits inside that tile's window,
+    and otherwise on its own after following it across the seams.
+    The cell and point tables are the same as those of processImage
+    on the whole mosaic.
+
+    Inputs:
+    - inputFn: the path to the mosaic; an uncompressed format that
+               can be streamed (.mha, .nrrd) keeps each read to its
+               tile (string)
+    - outDir: the directory holding the results of all images (string)
+    - makeFigures: flag to indicate whether to save the curvature
+                   histogram; the overlay would need the whole
+                   mosaic in memory, so it is not made (boolean)
+    - tileSize: the side length of the tiles (int)
+    - overlap: how far each tile's window reaches past the tile (int)
+    - numWorkers: the number of worker processes; defaults to the
+                  number of CPUs (int)
+    - contourEngine: how to trace the cell contours, one of
+                     CONTOUR_ENGINES (string)
+    - curvatureEngine: how to calculate the curvature, one of
+                       CURVATURE_ENGINES (string)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out before contouring, and the number rejected for
+                  each reason is saved in summary.json (CellFilter)
+    - numThreads: the number of threads of each worker process (int)
+
+    Returns:
+    - numCells: the number of cells found in the mosaic (int)
+    """
+    setNumberOfThreads(numThreads)
+    figPath = getFigurePath(inputFn, outDir)
+    if not os.path.exists(figPath):
+        os.makedirs(figPath)
+
+    # First pass: the thresholds of the whole mosaic
+    imageSize = getImageSize(inputFn)
+    thresholds = getOtsuThresholds(getMosaicHistogram(inputFn, stripHeight=tileSize))
+    tiles = getTileWindows(imageSize[0], imageSize[1], tileSize, overlap)
+    print('Processing %dx%d mosaic in %d tiles (Otsu thresholds %s)'
+          % (imageSize[0], imageSize[1], len(tiles), ', '.join('%.2f' % t for t in thresholds)))
+
+    # Second pass: the tiles, in parallel
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers) as executor:
+        futures = [executor.submit(processMosaicTile, inputFn, tile, window, imageSize, thresholds,
+                                   contourEngine, curvatureEngine, cellFilter, numThreads)
+                   for tile, window in tiles]
+        results = [future.result() for future in futures]
+    cellTables = [result[0] for result in results]
+    contours = [contour for result in results for contour in result[1]]
+    curvatures = [curvature for result in results for curvature in result[2]]
+    anchors = [result[3] for result in results]
+    rejected = collections.Counter()
+    for result in results:
+        rejected.update(result[6])
+
+    # Follow the cut cells across the seams. A cell is kept only if
+    # the tile holding its first pixel could not measure it, and only
+    # once however many windows cut it
+    numTileColumns = len(range(0, imageSize[0], tileSize))
+    seamAnchors = set()
+    for result in results:
+        for cutAnchor, cutCell in zip(result[4], result[5]):
+            cell, contour, anchor, rejections = resolveCutCell(inputFn, cutAnchor, cutCell, imageSize,
+                                                               thresholds, max(overlap, 16),
+                                                               contourEngine=contourEngine,
+                                                               cellFilter=cellFilter)
+            tile, window = tiles[(anchor[1]//tileSize)*numTileColumns + anchor[0]//tileSize]
+            if tuple(anchor) in seamAnchors or not isCutByWindow(cell, window, imageSize)[0]:
+                continue
+            seamAnchors.add(tuple(anchor))
+            if contour is None:
+                rejected.update(countRejections(rejections))
+                continue
+            cellCurvatures, curves, offsets = calculateContourCurvatures([contour],
+                                                                         curvatureEngine=curvatureEngine)
+            cellTables.append(summarizeCellContours(cell, [contour], cellCurvatures, offsets))
+            contours.append(contour)
+            curvatures.append(cellCurvatures)
+            anchors.append(anchor.reshape(1, 2))
+    print('%d cells crossed the tile seams' % len(seamAnchors))
+
+    # Number the cells in raster order of their first pixels, as the
+    # label map of the whole mosaic would
+    cells = np.concatenate(cellTables)
+    anchors = np.concatenate(anchors)
+    order = np.lexsort((anchors[:, 0], anchors[:, 1]))
+    cells = cells[order]
+    cells['label'] = np.arange(1, len(cells)+1)
+    contours = [contours[i] for i in order]
+    curvatures = [curvatures[i] for i in order]
+    numPoints = [len(curvature) for curvature in curvatures]
+    cells['pointOffset'] = np.concatenate([[0], np.cumsum(numPoints)[:-1]]).astype(np.int64)
+    curvatures = np.concatenate(curvatures) if curvatures else np.zeros(0)
+    summaries = summarizeCurvatures(cells, curvatures)
+    if cellFilter is not None:
+        rejected = {name: rejected[name] for name in FILTER_REASONS + ('total',)}
+        print(formatRejections(rejected, len(cells)+rejected['total']))
+
+    if makeFigures:
+        saveCurvatureHistogram(curvatures, figFilePath=figPath)
+        sys.modules['matplotlib.pyplot'].close('all')
+    saveResults(cells, contours, curvatures, figFilePath=figPath, summaries=summaries,
+                **({'rejected': rejected} if cellFilter is not None else {}))
+
+    return len(cells)
+
+
+#=========================================================================
+# Parameter Sweeps
+#=========================================================================
+
+def getSweepConfigurations(grid):
+    """
+    Expand a parameter grid into its configurations, ordered so that
+    the configurations sharing a stage's result follow one another:
+    the parameters of the first stage change slowest.
+
+    Inputs:
+    - grid: the values to try for each parameter of SWEEP_DEFAULTS;
+            parameters left out keep their default, and a single value
+            need not be in a list (dict)
+
+    Returns:
+    - configurations: the value of every parameter in each
+                      configuration (list of dicts)
+    """
+    unknown = sorted(set(grid) - set(SWEEP_DEFAULTS))
+    if unknown:
+        raise ValueError("Unknown sweep parameters: " + ', '.join(unknown))
+    names = [name for stage, parameters in SWEEP_STAGES for name in parameters]
+    values = []
+    for name in names:
+        choices = grid.get(name, SWEEP_DEFAULTS[name])
+        if not isinstance(choices, (list, tuple)):
+            choices = [choices]
+        if len(choices) == 0:
+            raise ValueError("No values to sweep for " + name)
+        values.append(list(choices))
+    choices = dict(zip(names, values))
+    for choice in choices['contourEngine']:
+        if choice not in CONTOUR_ENGINES:
+            raise ValueError("Unknown contour engine: %s" % choice)
+    for choice in choices['curvatureEngine']:
+        if choice not in CURVATURE_ENGINES:
+            raise ValueError("Unknown curvature engine: %s" % choice)
+    # The curvature summaries are binned up to the cap
+    for choice in choices['curvatureCap']:
+        if not (isinstance(choice, (int, float)) and 0 < choice < np.inf):
+            raise ValueError("The curvature cap must be a positive number, not %s" % choice)
+
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def runSweepStage(stage, upstream, configuration, cellFilter=None, numThreads=None):
+    """
+    Compute the result of one stage of a sweep from the result of the
+    stage before it.
+
+    Inputs:
+    - stage: the name of one of SWEEP_STAGES (string)
+    - upstream: the result of the stage before, or the image for the
+                first stage
+    - configuration: the value of every sweep parameter (dict)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out after the opening (CellFilter)
+    - numThreads: the number of threads of the per-cell work (int)
+
+    Returns:
+    - result: the result of the stage; for the curvature stage, the
+              'points' and 'cells' summaries and the numbers of cells,
+              rejected cells and points and the total cell area (dict)
+    """
+    if stage == 'otsu':
+        return thresholdCells(upstream, numThresholds=configuration['numThresholds'])
+
+    if stage == 'opening':
+        openedImage = openSegmentation(upstream, kernelRadius=configuration['kernelRadius'])
+        labelMap = convertBinToLabelMap(openedImage)
+        cells = getCellStatistics(labelMap)
+        numRejected = 0
+        if cellFilter is None:
+            measureCellShapes(labelMap, cells)
+        else:
+            cells, rejected = cellFilter.apply(labelMap, cells, verbose=False)
+            numRejected = rejected['total']
+        return labelMap, cells, numRejected
+
+    if stage == 'contours':
+        labelMap, cells, numRejected = upstream
+        labels, contours = extractCellContours(labelMap, cells=cells,
+                                               contourEngine=configuration['contourEngine'],
+                                               numThreads=numThreads)
+        return cells, contours, numRejected
+
+    if stage == 'curvature':
+        cells, contours, numRejected = upstream
+        curvatures, curves, offsets = calculateContourCurvatures(
+            contours, curvatureEngine=configuration['curvatureEngine'], numThreads=numThreads,
+            fitLen=configuration['fitLen'], fitOrder=configuration['fitOrder'],
+            cutoffWavelength=configuration['cutoffWavelength'],
+            curvatureCap=configuration['curvatureCap'])
+        # Every curvature variant fills in its own copy of the cells
+        cells = summarizeCellContours(cells.copy(), contours, curvatures, offsets)
+        return {'summaries': summarizeCurvatures(cells, curvatures, configuration['curvatureCap']),
+                'numCells': len(cells),
+                'numRejected': numRejected,
+                'numPoints': len(curvatures),
+                'totalArea': int(np.sum(cells['area'], dtype=np.int64))}
+
+    raise ValueError("Unknown sweep stage: %s" % stage)
+
+
+def sweepImage(inputFn, configurations, cellFilter=None, numThreads=None):
+    """
+    Run every configuration of a sweep on one image, computing each
+    distinct stage result once. The configurations form a tree of
+    stages (a DAG with one root, the image) in which configurations
+    share the result of every stage whose parameters, and those of
+    the stages before it, are the same. Configurations that share a
+    stage's result follow one another, so the results under a stage
+    are dropped as soon as the sweep moves past it; the settings of
+    curvature engines other than the configuration's own are not
+    part of any result, so they never cause a rerun.
+
+    Inputs:
+    - inputFn: the path to the input image (string)
+    - configurations: the configurations, in the order of
+                      getSweepConfigurations (list of dicts)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out after the opening (CellFilter)
+    - numThreads: the number of threads of the SimpleITK filters and
+                  of the per-cell work (int)
+
+    Returns:
+    - results: the result of the curvature stage of each
+               configuration (list of dicts, see runSweepStage)
+    - numComputed: the number of times each stage was run (Counter)
+    """
+    setNumberOfThreads(numThreads)
+    image = extractFirstChannel(readImageFile(inputFn))
+
+    # The results of each stage under the current branch, by key, and
+    # the key of the current branch at each stage
+    stageResults = [{} for stage in SWEEP_STAGES]
+    branchKeys = [None]*len(SWEEP_STAGES)
+    numComputed = collections.Counter()
+    results = []
+    for configuration in configurations:
+        key = ()
+        result = image
+        for i, (stage, parameters) in enumerate(SWEEP_STAGES):
+            # A stage's key holds the parameters of every stage up to
+            # it, so a change upstream reruns everything below it; the
+            # settings of the other curvature engines are left out
+            key += tuple(configuration[name] for name in parameters
+                         if SWEEP_ENGINE_PARAMETERS.get(name, configuration['curvatureEngine'])
+                         == configuration['curvatureEngine'])
+            if branchKeys[i] != key:
+                # Moving to another branch: nothing below the old one
+                # is needed again
+                for later in stageResults[i+1:]:
+                    later.clear()
+                branchKeys[i] = key
+            if key not in stageResults[i]:
+                stageResults[i][key] = runSweepStage(stage, result, configuration,
+                                                     cellFilter=cellFilter, numThreads=numThreads)
+                numComputed[stage] += 1
+            result = stageResults[i][key]
+        results.append(result)
+
+    return results, numComputed
+
+
+def runSweep(inputFns, grid, outDir='./figures/', numWorkers=None, cellFilter=None,
+             numThreads=None):
+    """
+    Measure a set of images under every configuration of a parameter
+    grid and gather the results in one table. Each image is swept in
+    its own worker process by sweepImage, which shares the Otsu map,
+    opened mask, label map and contours of an image between every
+    configuration that leads to them. The curvature summaries of each
+    configuration are merged across the images.
+
+    Inputs:
+    - inputFns: the paths of the images to sweep (list of strings)
+    - grid: the values to try for each parameter (dict, see
+            getSweepConfigurations)
+    - outDir: the directory the sweep table is written to (string)
+    - numWorkers: the number of worker processes; defaults to the
+                  number of CPUs (int)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out after the opening (CellFilter)
+    - numThreads: the number of threads of each worker (int)
+
+    Returns:
+    - table: one row per configuration (numpy array of SWEEP_DTYPE)
+    - failures: the images that could not be swept and the reason
+                (list of (string, string) tuples)
+
+    Effects:
+    - Writes the table to sweep.npy in the output directory
+    """
+    configurations = getSweepConfigurations(grid)
+    print('Sweeping', len(configurations), 'configurations over', len(inputFns), 'images')
+
+    summaries = [{name: CurvatureSummary(binLimit=configuration['curvatureCap'])
+                  for name in ('points', 'cells')}
+                 for configuration in configurations]
+    counts = np.zeros((len(configurations), 4), dtype=np.int64)
+    numImages = 0
+    numComputed = collections.Counter()
+    failures = []
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers) as executor:
+        futures = {executor.submit(sweepImage, fn, configurations, cellFilter, numThreads): fn
+                   for fn in inputFns}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            inputFn = futures[future]
+            try:
+                results, imageComputed = future.result()
+            except Exception as err:
+                print('[%d/%d] %s: failed (%s)' % (done, len(inputFns), inputFn, err))
+                failures.append((inputFn, repr(err)))
+                continue
+            for i, result in enumerate(results):
+                for name in summaries[i]:
+                    summaries[i][name].merge(result['summaries'][name])
+                counts[i] += (result['numCells'], result['numRejected'], result['numPoints'],
+                              result['totalArea'])
+            numImages += 1
+            numComputed.update(imageComputed)
+            print('[%d/%d] %s' % (done, len(inputFns), inputFn))
+
+    # One comparable row per configuration
+    table = np.zeros(len(configurations), dtype=SWEEP_DTYPE)
+    for i, configuration in enumerate(configurations):
+        row = table[i]
+        for name, value in configuration.items():
+            row[name] = value
+        pointStatistics = summaries[i]['points'].getStatistics()
+        cellStatistics = summaries[i]['cells'].getStatistics()
+        row['numImages'] = numImages
+        row['numCells'], row['numRejected'], row['numPoints'] = counts[i, :3]
+        row['meanArea'] = counts[i, 3]/counts[i, 0] if counts[i, 0] > 0 else np.nan
+        for field, statistic in (('curvatureMean', 'mean'), ('curvatureStd', 'std'),
+                                 ('curvatureMedian', 'median'), ('curvatureP5', 'p5'),
+                                 ('curvatureP95', 'p95')):
+            row[field] = pointStatistics[statistic] if pointStatistics['count'] > 0 else np.nan
+        for field, statistic in (('cellCurvatureMean', 'mean'), ('cellCurvatureMedian', 'median')):
+            row[field] = cellStatistics[statistic] if cellStatistics['count'] > 0 else np.nan
+
+    if not os.path.exists(outDir):
+        os.makedirs(outDir)
+    saveArrayAtomically(os.path.join(outDir, SWEEP_FN), table)
+
+    print(formatSweepTable(table))
+    print('Computed ' + ', '.join('%d %s' % (numComputed[stage], stage)
+                                  for stage, parameters in SWEEP_STAGES)
+          + ' stage results for %d configurations of %d images'
+          % (len(configurations), numImages))
+
+    return table, failures
+
+
+def formatSweepTable(table):
+    """
+    Inputs:
+    - table: the sweep table (numpy array of SWEEP_DTYPE)
+
+    Returns:
+    - text: the table, one line per configuration under a header line
+            of the field names (string)
+    """
+    names = table.dtype.names
+    rows = [list(names)] + [[('%.4g' % value) if isinstance(value, float) else str(value)
+                             for value in row.tolist()] for row in table]
+    widths = [max(len(row[j]) for row in rows) for j in range(len(names))]
+    return '\n'.join('  '.join(value.rjust(width) for value, width in zip(row, widths))
+                     for row in rows)
+
+
+#=========================================================================
+# Library API
+#=========================================================================
+
+# The functions below take and return numpy arrays, so that the
+# pipeline can be used from other code without SimpleITK images or
+# files: nothing is saved or printed. Importing this script loads only
+# numpy and the standard library; SimpleITK is imported by the first
+# call, matplotlib only by the figures and contourpy only by its
+# contour engine.
+
+def segmentCellArray(imageArray, numThresholds=OTSU_NUM_THRESHOLDS,
+                     kernelRadius=OPENING_KERNEL_RADIUS, kernelType=OPENING_KERNEL_TYPE,
+                     thresholds=None):
+    """
+    Segment the cells of an image in memory, as segmentCells does.
+
+    Inputs:
+    - imageArray: the pixels of the image (2D array, or 3D with the
+                  channels last, of which the first is used)
+    - numThresholds, kernelRadius, kernelType, thresholds: see
+      segmentCells
+
+    Returns:
+    - maskArray: 1 inside the cells and 0 outside (2D uint8 array)
+    """
+    segImage = segmentCells(getFrameImage(np.asarray(imageArray)), numThresholds=numThresholds,
+                            kernelRadius=kernelRadius, kernelType=kernelType,
+                            thresholds=thresholds)
+    return sitk.GetArrayFromImage(segImage)
+
+
+def labelCellArray(maskArray, cellFilter=None):
+    """
+    Label the connected components of a cell mask, as
+    convertBinToLabelMap does, and measure each of them.
+
+    Inputs:
+    - maskArray: nonzero inside the cells (2D array)
+    - cellFilter: if given, the cells that fail its limits are
+                  removed from the label array and the records
+                  (CellFilter)
+
+    Returns:
+    - labelArray: the label of the cell each pixel belongs to, 0 for
+                  the background; the labels are those of the cell
+                  records (2D unsigned int array)
+    - cells: the statistics and shapes of each cell (numpy array of
+             CELL_DTYPE)
+    - rejected: the number of rejected cells for each reason and in
+                total, or None without a filter (dict of ints)
+    """
+    maskImage = getFrameImage((np.asarray(maskArray) != 0).astype(np.uint8))
+    labelImage = convertBinToLabelMap(maskImage, verbose=False)
+    cells = getCellStatistics(labelImage)
+    rejected = None
+    if cellFilter is None:
+        measureCellShapes(labelImage, cells)
+    else:
+        cells, rejected = cellFilter.apply(labelImage, cells, verbose=False)
+        labelImage, cells = keepCells(labelImage, cells)
+    return sitk.GetArrayFromImage(labelImage), cells, rejected
+
+
+def traceCellArray(labelArray, cells=None, contourEngine='marchingSquares', numThreads=None):
+    """
+    Get the contour of every cell of a label array, as
+    extractCellContours does.
+
+    Inputs:
+    - labelArray: the label of the cell each pixel belongs to, 0 for
+                  the background (2D unsigned int array)
+    - cells: the cell records of the label array, if they have
+             already been measured; the marching squares engine fills
+             in their ring counts (numpy array of CELL_DTYPE)
+    - contourEngine: one of CONTOUR_ENGINES (string)
+    - numThreads: the number of threads the per-cell engines contour
+                  the cells on (int)
+
+    Returns:
+    - labels: the label of each contour (list of ints)
+    - contours: the x, y coordinates of each cell contour (list of
+                Nx2 arrays)
+    """
+    return extractCellContours(getFrameImage(np.asarray(labelArray)), cells=cells,
+                               contourEngine=contourEngine, numThreads=numThreads)
+
+
+def measureCellArray(imageArray, contourEngine='marchingSquares',
+                     curvatureEngine='finiteDifference', cellFilter=None, numThreads=None):
+    """
+    Run the analysis of processImage on an image in memory and return
+    the tables it would save, without saving or printing anything.
+
+    Inputs:
+    - imageArray: the pixels of the image (2D array, or 3D with the
+                  channels last, of which the first is used)
+    - contourEngine: how to trace the cell contours, one of
+                     CONTOUR_ENGINES (string)
+    - curvatureEngine: how to calculate the curvature, one of
+                       CURVATURE_ENGINES (string)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out before contouring (CellFilter)
+    - numThreads: the number of threads of the per-cell work (int)
+
+    Returns:
+    - cells: one record per cell; the contour of a cell is the
+             numPoints points from pointOffset in the point table
+             (numpy array of CELL_DTYPE)
+    - points: one record per contour point (numpy array of
+              POINT_DTYPE)
+    - rejected: the number of rejected cells for each reason and in
+                total, or None without a filter (dict of ints)
+    """
+    # The curvature of a repeated contour point is undefined (nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cells, contours, curvatures, summaries, rejected = analyzeImage(
+            getFrameImage(np.asarray(imageArray)), contourEngine, curvatureEngine,
+            cellFilter=cellFilter, numThreads=numThreads, verbose=False)
+    return cells, getPointTable(contours, curvatures), rejected
+
+
+#=========================================================================
+# Analysis Service
+#=========================================================================
+
+def analyzeImage(image, contourEngine='marchingSquares', curvatureEngine='finiteDifference',
+                 cellFilter=None, numThreads=None, verbose=True):
+    """
+    Run the stages of processImage on an image in memory, without
+    saving anything.
+
+    Inputs:
+    - image: the single channel image (sitk Image)
+    - contourEngine: how to trace the cell contours, one of
+                     CONTOUR_ENGINES (string)
+    - curvatureEngine: how to calculate the curvature, one of
+                       CURVATURE_ENGINES (string)
+    - cellFilter: if given, the cells that fail its limits are left
+                  out before contouring (CellFilter)
+    - numThreads: the number of threads of the per-cell work (int)
+    - verbose: flag to indicate whether to print the number of labels
+               and of rejected cells (boolean)
+
+    Returns:
+    - cells: one record per cell (numpy array of CELL_DTYPE)
+    - contours: the x, y coordinates of each cell contour (list of
+                Nx2 arrays)
+    - curvatures: the curvature of every contour point (float32 array)
+    - summaries: the 'points' and 'cells' summaries (dict of
+                 CurvatureSummary)
+    - rejected: the number of rejected cells for each reason and in
+                total, or None without a filter (dict of ints)
+    """
+    labelMap = convertBinToLabelMap(segmentCells(image), verbose=verbose)
+    cells = getCellStatistics(labelMap)
+    rejected = None
+    if cellFilter is None:
+        measureCellShapes(labelMap, cells)
+    else:
+        cells, rejected = cellFilter.apply(labelMap, cells, verbose=verbose)
+    labels, contours = extractCellContours(labelMap, cells=cells, contourEngine=contourEngine,
+                                           numThreads=numThreads)
+    curvatures, curves, offsets = calculateContourCurvatures(contours,
+                                                             curvatureEngine=curvatureEngine,
+                                                             numThreads=numThreads)
+    summarizeCellContours(cells, contours, curvatures, offsets)
+    if cellFilter is not None:
+        numberKeptCells(cells)
+    return cells, contours, curvatures, summarizeCurvatures(cells, curvatures), rejected
+
+
+def getCellRecords(cells):
+    """
+    Inputs:
+    - cells: the cell records (numpy array of CELL_DTYPE)
+
+    Returns:
+    - records: one dict of fields per cell, with undefined (nan)
+               values as None, for sending as JSON (list of dicts)
+    """
+    return [{name: (None if isinstance(value, float) and np.isnan(value) else value)
+             for name, value in zip(cells.dtype.names, row)}
+            for row in cells.tolist()]
+
+
+class AnalysisService(object):
+    """
+    Resident worker that analyzes images as they are submitted. The
+    libraries are imported and the pipeline is run once on a small
+    synthetic image at start, so requests pay only for their own
+    image. Requests wait in a bounded queue for one of the worker
+    threads; when the queue is full, new requests are turned away
+    at once (backpressure) rather than piling up. The time each
+    request waited and was processed is kept for the most recent
+    requests, for latency percentiles.
+    """
+
+    def __init__(self, outDir='./figures/', queueSize=SERVICE_QUEUE_SIZE, numWorkers=1,
+                 contourEngine='marchingSquares', curvatureEngine='finiteDifference',
+                 cellFilter=None, numThreads=None):
+        """
+        Inputs:
+        - outDir: the directory the results of requests that ask to
+                  be saved are written to (string)
+        - queueSize: the number of requests that may wait (int)
+        - numWorkers: the number of worker threads (int)
+        - contourEngine: how to trace the cell contours, one of
+                         CONTOUR_ENGINES (string)
+        - curvatureEngine: how to calculate the curvature, one of
+                           CURVATURE_ENGINES (string)
+        - cellFilter: if given, the cells that fail its limits are left
+                      out before contouring (CellFilter)
+        - numThreads: the number of threads of the SimpleITK filters
+                      and of the per-cell work (int)
+        """
+        self.outDir = outDir
+        self.numWorkers = numWorkers
+        self.contourEngine = contourEngine
+        self.curvatureEngine = curvatureEngine
+        self.cellFilter = cellFilter
+        self.numThreads = numThreads
+        import queue
+        self.queue = queue.Queue(maxsize=queueSize)
+        # (wait, processing, total) seconds of the recent requests
+        self.latencies = collections.deque(maxlen=SERVICE_LATENCY_WINDOW)
+        self.counts = collections.Counter()
+        self.numBusy = 0
+        self.lock = threading.Lock()
+        self.workers = []
+        self.startTime = time.time()
+
+    def start(self):
+        """
+        Warm up the pipeline and start the worker threads.
+        """
+        setNumberOfThreads(self.numThreads)
+        # A dark rod on a bright background goes through every stage
+        warmUpArray = np.full((64, 64), 200, dtype=np.uint8)
+        warmUpArray[26:38, 12:52] = 40
+        with np.errstate(divide='ignore', invalid='ignore'):
+            analyzeImage(getFrameImage(warmUpArray), self.contourEngine, self.curvatureEngine,
+                         numThreads=self.numThreads, verbose=False)
+        for i in range(self.numWorkers):
+            worker = threading.Thread(target=self.work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        """
+        Let the workers finish the queued requests, then stop them.
+        """
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def submit(self, request):
+        """
+        Queue a request without waiting for room in the queue.
+
+        Inputs:
+        - request: the image, as 'path' (string) or 'image' (sitk
+                   Image), and optionally 'save' (boolean) to save its
+                   results under 'name' (string) in the output
+                   directory, as processImage does (dict)
+
+        Returns:
+        - job: the request, with a 'done' event that is set once its
+               'result' (dict) or 'error' (Exception) is filled in
+               (dict)
+
+        Raises:
+        - queue.Full: when the queue is full
+        """
+        import queue
+        job = {'request': request, 'submitted': time.perf_counter(), 'done': threading.Event(),
+               'result': None, 'error': None}
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.counts['rejected'] += 1
+            raise
+        return job
+
+    def work(self):
+        """
+        Take requests off the queue and process them, until a None
+        request arrives.
+        """
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            started = time.perf_counter()
+            with self.lock:
+                self.numBusy += 1
+            try:
+                job['result'] = self.process(job['request'])
+            except Exception as err:
+                job['error'] = err
+            finished = time.perf_counter()
+            latency = (started - job['submitted'], finished - started, finished - job['submitted'])
+            with self.lock:
+                self.numBusy -= 1
+                self.counts['failed' if job['error'] is not None else 'processed'] += 1
+                self.latencies.append(latency)
+            if job['result'] is not None:
+                job['result']['waitTime'], job['result']['processingTime'] = latency[:2]
+            job['done'].set()
+
+    def process(self, request):
+        """
+        Analyze the image of one request.
+
+        Inputs:
+        - request: the request (dict, see submit)
+
+        Returns:
+        - result: the numbers of cells and contour points, the record
+                  of every cell, the statistics of the curvatures of
+                  the contour points and of the cells and, with a cell
+                  filter, the rejections (dict)
+        """
+        if 'image' in request:
+            image = request['image']
+        else:
+            image = loadImage(request['path'])
+        # The curvature of a repeated contour point is undefined (nan);
+        # the resident service only logs requests and its status
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cells, contours, curvatures, summaries, rejected = analyzeImage(
+                image, self.contourEngine, self.curvatureEngine, cellFilter=self.cellFilter,
+                numThreads=self.numThreads, verbose=False)
+
+        if request.get('save'):
+            figPath = getFigurePath(request.get('name') or request['path'], self.outDir)
+            if not os.path.exists(figPath):
+                os.makedirs(figPath)
+            saveResults(cells, contours, curvatures, figFilePath=figPath, summaries=summaries,
+                        **({'rejected': rejected} if rejected is not None else {}))
+
+        result = {'numCells': len(cells),
+                  'numPoints': len(curvatures),
+                  'cells': getCellRecords(cells),
+                  'statistics': {name: summary.getStatistics()
+                                 for name, summary in summaries.items()}}
+        if rejected is not None:
+            result['rejected'] = rejected
+        return result
+
+    def getStatus(self):
+        """
+        Returns:
+        - status: the queue depth and size, the number of busy
+                  workers, the numbers of requests processed, failed
+                  and turned away, the uptime and the 50th, 90th and
+                  99th percentile and largest time the recent requests
+                  waited, were processed and took in all, in seconds
+                  (dict)
+        """
+        with self.lock:
+            latencies = np.array(self.latencies, dtype=np.float64).reshape(-1, 3)
+            status = {'queueDepth': self.queue.qsize(),
+                      'queueSize': self.queue.maxsize,
+                      'numWorkers': self.numWorkers,
+                      'numBusy': self.numBusy,
+                      'processed': self.counts['processed'],
+                      'failed': self.counts['failed'],
+                      'rejected': self.counts['rejected'],
+                      'uptime': time.time() - self.startTime}
+        for i, name in enumerate(('wait', 'processing', 'total')):
+            if len(latencies) == 0:
+                status[name+'Latency'] = None
+                continue
+            p50, p90, p99 = np.percentile(latencies[:, i], (50, 90, 99))
+            status[name+'Latency'] = {'p50': p50, 'p90': p90, 'p99': p99,
+                                      'max': latencies[:, i].max(), 'count': len(latencies)}
+        return status
+
+
+class ServiceRequestHandler(object):
+    """
+    HTTP front end of an AnalysisService (the server's service), mixed
+    into http.server.BaseHTTPRequestHandler when the server starts so
+    that the HTTP modules are only imported by the service.
+
+    - GET /status: the status of the service (see getStatus)
+    - POST /analyze: analyze one image and answer with its results
+      (see AnalysisService.process). The image is either a path, as
+      the JSON body {"path": ..., "save": ..., "name": ...}, an image
+      file (Content-Type image/png, image/tiff, etc) or raw pixels
+      (Content-Type application/octet-stream) with the query
+      parameters width, height and optionally dtype (default uint8)
+      and channels (default 1). Images sent in the body are saved,
+      with save=1, under the name query parameter. A full queue
+      answers 503 with a Retry-After header.
+    """
+
+    def sendJson(self, code, content, headers=()):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        import urllib.parse
+
+        if urllib.parse.urlparse(self.path).path == '/status':
+            self.sendJson(200, self.server.service.getStatus())
+        else:
+            self.sendJson(404, {'error': 'unknown path'})
+
+    def do_POST(self):
+        import queue
+        import urllib.parse
+
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/analyze':
+            self.sendJson(404, {'error': 'unknown path'})
+            return
+        try:
+            request = self.readRequest(urllib.parse.parse_qs(url.query))
+        except Exception as err:
+            self.sendJson(400, {'error': str(err)})
+            return
+
+        try:
+            job = self.server.service.submit(request)
+        except queue.Full:
+            self.sendJson(503, {'error': 'the queue is full'}, headers=[('Retry-After', '1')])
+            return
+        if not job['done'].wait(SERVICE_TIMEOUT):
+            self.sendJson(504, {'error': 'no result within %d s' % SERVICE_TIMEOUT})
+        elif job['error'] is not None:
+            self.sendJson(500, {'error': repr(job['error'])})
+        else:
+            self.sendJson(200, job['result'])
+
+    def readRequest(self, query):
+        """
+        Inputs:
+        - query: the query parameters (dict of lists of strings)
+
+        Returns:
+        - request: the request for AnalysisService.submit (dict)
+        """
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        contentType = self.headers.get('Content-Type', '').split(';')[0].strip()
+        if contentType == 'application/json':
+            request = json.loads(body)
+            if not isinstance(request, dict) or 'path' not in request:
+                raise ValueError("the JSON body needs a path")
+            return {'path': str(request['path']), 'save': bool(request.get('save')),
+                    'name': request.get('name')}
+
+        request = {'save': query.get('save', ['0'])[0] not in ('0', 'false'),
+                   'name': query.get('name', [None])[0]}
+        if request['save'] and not request['name']:
+            raise ValueError("saving an image sent in the body needs a name")
+        if contentType == 'application/octet-stream':
+            width, height = int(query['width'][0]), int(query['height'][0])
+            channels = int(query.get('channels', ['1'])[0])
+            shape = (height, width, channels) if channels > 1 else (height, width)
+            frameArray = np.frombuffer(body, dtype=np.dtype(query.get('dtype', ['uint8'])[0]))
+            request['image'] = getFrameImage(frameArray.reshape(shape))
+        elif contentType.startswith('image/'):
+            import tempfile
+
+            # SimpleITK reads images from files only
+            suffix = '.' + contentType.split('/')[1].replace('jpeg', 'jpg')
+            with tempfile.NamedTemporaryFile(suffix=suffix) as imageFile:
+                imageFile.write(body)
+                imageFile.flush()
+                request['image'] = loadImage(imageFile.name)
+        else:
+            raise ValueError("unsupported Content-Type: %s" % contentType)
+        return request
+
+
+def startServiceServer(service, host=SERVICE_HOST, port=0):
+    """
+    Start an analysis service and the HTTP server in front of it; the
+    caller runs the server with serve_forever.
+
+    Inputs:
+    - service: the service (AnalysisService)
+    - host: the address to listen on (string)
+    - port: the port to listen on; 0 picks a free one (int)
+
+    Returns:
+    - server: the server, whose server_address gives its address
+              (http.server.ThreadingHTTPServer)
+    """
+    import http.server
+
+    service.start()
+    handlerClass = type('ServiceHTTPRequestHandler',
+                        (ServiceRequestHandler, http.server.BaseHTTPRequestHandler), {})
+    server = http.server.ThreadingHTTPServer((host, port), handlerClass)
+    server.service = service
+    return server
+
+
+def runService(service, host=SERVICE_HOST, port=0):
+    """
+    Serve requests until interrupted (Ctrl-C or SIGTERM), then finish
+    the queued ones.
+
+    Inputs:
+    - service: the service (AnalysisService)
+    - host: the address to listen on (string)
+    - port: the port to listen on (int)
+    """
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+
+    server = startServiceServer(service, host, port)
+    signal.signal(signal.SIGTERM, interrupt)
+    print('Serving on http://%s:%d (POST /analyze, GET /status)' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+def submitToService(url, inputFn=None, imageArray=None, save=False, name=None,
+                    timeout=SERVICE_TIMEOUT):
+    """
+    Send one image to an analysis service and wait for its results.
+
+    Inputs:
+    - url: the address of the service, e.g. http://127.0.0.1:8000
+           (string)
+    - inputFn: the path of the image, which the service reads itself
+               (string)
+    - imageArray: the pixels of the image, sent instead of a path
+                  (2D array, or 3D with the channels last)
+    - save: flag to indicate that the service should save the results
+            in its output directory (boolean)
+    - name: the name the results of an imageArray are saved under
+            (string)
+    - timeout: how long to wait for the results, in seconds (float)
+
+    Returns:
+    - result: the results of the image (dict, see
+              AnalysisService.process)
+
+    Raises:
+    - urllib.error.HTTPError: when the service turns the request away
+      (503 when its queue is full) or fails
+    """
+    import urllib.parse
+    import urllib.request
+
+    if imageArray is None:
+        body = json.dumps({'path': os.path.abspath(inputFn), 'save': save, 'name': name}).encode()
+        request = urllib.request.Request(url+'/analyze', data=body,
+                                         headers={'Content-Type': 'application/json'})
+    else:
+        imageArray = np.ascontiguousarray(imageArray)
+        query = {'width': imageArray.shape[1], 'height': imageArray.shape[0],
+                 'dtype': imageArray.dtype.str,
+                 'channels': imageArray.shape[2] if imageArray.ndim == 3 else 1}
+        if save:
+            query.update(save=1, name=name)
+        request = urllib.request.Request(url+'/analyze?'+urllib.parse.urlencode(query),
+                                         data=imageArray.tobytes(),
+                                         headers={'Content-Type': 'application/octet-stream'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+#=========================================================================
+# Main
+#=========================================================================
+
+def main():
+    # Set up the arg parser
+    parser = argparse.ArgumentParser(description="Identify individual caulobacter bacteria cells and calculate their curvatures.")
+    # Arguments
+    # - input image, or a batch of input images
+    inputGroup = parser.add_mutually_exclusive_group(required=True)
+    inputGroup.add_argument('--inFn', type=str, help='Full path to the input image (.png, .jpg, etc; NOT .nd2)')
+    inputGroup.add_argument('--batch', type=str, help='Directory, glob (quoted) or manifest file listing the input images to process.')
+    inputGroup.add_argument('--stack', type=str, help='Multi-frame TIFF time series whose cells are tracked from frame to frame.')
+    inputGroup.add_argument('--serve', type=int, metavar='PORT', help='Run as a resident service that analyzes the images sent to http://<host>:PORT/analyze and reports its queue and latencies at /status (0 picks a free port).')
+    # - address and queue of the service
+    parser.add_argument('--host', type=str, default=SERVICE_HOST, help='Address the --serve service listens on (default: %(default)s).')
+    parser.add_argument('--queueSize', type=int, default=SERVICE_QUEUE_SIZE, help='Number of requests that may wait for the --serve service; more are turned away until there is room (default: %(default)s).')
+    # - number of worker processes in batch mode
+    parser.add_argument('--numWorkers', type=int, default=None, help='Number of worker processes in batch or tiled mode (default: number of CPUs), or of worker threads of the --serve service (default: 1).')
+    # - number of threads within each process
+    parser.add_argument('--numThreads', type=int, default=None, help='Number of threads of the SimpleITK filters and of the per-cell contouring and curvature, in each process (default: one per CPU for the filters, one for the per-cell work).')
+    # - directory the results are written to
+    parser.add_argument('--outDir', type=str, default='./figures/', help='Directory in which a results subdirectory is made for each image.')
+    # - save intermediate images (boolean)
+    saveFlag = 'saveIntermediateFigures'  # need a variable to indicate whether this arg is used
+    parser.add_argument('--saveIntermediateFigures', dest=saveFlag, action='store_true', help='Include this flag to indicate that the intermediately generated figures should be saved.')
+    # - contour tracing engine
+    parser.add_argument('--contourEngine', type=str, default='marchingSquares', choices=CONTOUR_ENGINES, help='How to trace the cell contours (default: marchingSquares).')
+    # - curvature engine
+    parser.add_argument('--curvatureEngine', type=str, default='finiteDifference', choices=CURVATURE_ENGINES, help='How to calculate the curvature along the contours (default: finiteDifference). The spectral engine leaves cells cut by the image border undefined; --rejectBorder leaves them out altogether.')
+    # - overlap that links cells across the frames of a stack
+    parser.add_argument('--minOverlap', type=float, default=TRACK_MIN_OVERLAP, help='Smallest overlap (intersection over union) that links a cell to one in the previous frame of a stack (default: %(default)s).')
+    # - filter that rejects debris and clumps before contouring
+    parser.add_argument('--minArea', type=int, default=None, help='Reject components with fewer pixels than this before contouring (default: no limit).')
+    parser.add_argument('--maxArea', type=int, default=None, help='Reject components with more pixels than this before contouring (default: no limit).')
+    parser.add_argument('--minAspect', type=float, default=None, help='Reject components whose major axis is less than this many times their minor axis, such as round clumps (default: no limit).')
+    parser.add_argument('--maxAspect', type=float, default=None, help='Reject components whose major axis is more than this many times their minor axis, such as streaks of debris (default: no limit).')
+    parser.add_argument('--minSolidity', type=float, default=None, help='Reject components that fill less than this fraction of their convex hull, such as clumps of cells (default: no limit).')
+    parser.add_argument('--rejectBorder', action='store_true', help='Reject components that touch the edge of the image.')
+    # - tiled processing of a large mosaic
+    parser.add_argument('--tileSize', type=int, default=None, help='Process the --inFn image as a mosaic, in square tiles of this many pixels a side, in parallel (default: process the image in one piece; %d is a good size).' % MOSAIC_TILE_SIZE)
+    parser.add_argument('--tileOverlap', type=int, default=MOSAIC_TILE_OVERLAP, help='How far the window of each tile reaches past the tile, in pixels; cells that do not fit are followed across the seams (default: %(default)s).')
+    # - parameter sweep
+    parser.add_argument('--sweep', type=str, default=None, help='Instead of processing the --inFn or --batch images, measure them under every combination of a parameter grid and write one row per combination to sweep.npy in --outDir. The grid is a JSON file or string giving the values to try for any of: %s; e.g. \'{"numThresholds": [2, 3], "kernelRadius": [1, 2, 3]}\'.' % ', '.join(SWEEP_DEFAULTS))
+    # - cache of the segmentation, label map and contours
+    parser.add_argument('--cacheDir', type=str, default=None, help='Directory in which to cache the segmentation, label map and contours of each image between runs (default: no cache).')
+    parser.add_argument('--cacheMaxMB', type=float, default=CACHE_MAX_MB, help='Size limit of the cache in MB; the least recently used entries are removed beyond it (default: %(default)s).')
+    # - profiling
+    parser.add_argument('--profile', type=str, default=None, help='JSON lines file to which the wall time, CPU time and peak memory of each stage, and the cell and point counts, of every image are appended (default: no profiling).')
+    parser.add_argument('--profileStage', type=str, default=None, choices=PROFILE_STAGES, help='Also run this stage under cProfile and save its statistics as profile-<stage>.prof next to the results of each image (needs --profile).')
+    # - skip the figures, or only make the figures from saved results
+    parser.add_argument('--previewSize', type=int, default=None, help='Also save curvatures-preview.png, the curvature overlay shrunk so that its longer side is at most this many pixels (default: no preview).')
+    figureGroup = parser.add_mutually_exclusive_group()
+    figureGroup.add_argument('--noFigures', '--no-figures', dest='noFigures', action='store_true', help='Only save the cell and point tables; matplotlib is not used and no figures are made.')
+    figureGroup.add_argument('--figuresOnly', dest='figuresOnly', action='store_true', help='Make the figures from the saved cell and point tables instead of processing the images.')
+    # Parse the arguments
+    args = parser.parse_args()
+    saveIntermediateFigures = args.saveIntermediateFigures
+    cache = None
+    if args.cacheDir is not None:
+        cache = StageCache(args.cacheDir, maxBytes=int(args.cacheMaxMB*2**20))
+    profiler = None
+    if args.profile is not None:
+        profiler = PipelineProfiler(args.profile, cProfileStage=args.profileStage)
+    elif args.profileStage is not None:
+        parser.error('--profileStage needs --profile')
+    cellFilter = None
+    filterLimits = (args.minArea, args.maxArea, args.minAspect, args.maxAspect, args.minSolidity)
+    if args.rejectBorder or any(limit is not None for limit in filterLimits):
+        cellFilter = CellFilter(*filterLimits, rejectBorder=args.rejectBorder)
+
+    if args.tileSize is not None:
+        if args.inFn is None:
+            parser.error('--tileSize only applies to --inFn')
+        if saveIntermediateFigures or cache is not None or profiler is not None:
+            parser.error('--saveIntermediateFigures, --cacheDir and --profile do not apply to --tileSize')
+
+    if args.serve is not None:
+        if (saveIntermediateFigures or args.figuresOnly or args.tileSize is not None
+                or args.sweep is not None or cache is not None or profiler is not None):
+            parser.error('--saveIntermediateFigures, --figuresOnly, --tileSize, --sweep, --cacheDir and --profile do not apply to --serve')
+        service = AnalysisService(args.outDir,
+                                  queueSize=args.queueSize,
+                                  numWorkers=args.numWorkers or 1,
+                                  contourEngine=args.contourEngine,
+                                  curvatureEngine=args.curvatureEngine,
+                                  cellFilter=cellFilter,
+                                  numThreads=args.numThreads)
+        runService(service, args.host, args.serve)
+    elif args.sweep is not None:
+        if args.stack is not None or args.tileSize is not None:
+            parser.error('--sweep only applies to --inFn and --batch')
+        if (saveIntermediateFigures or args.figuresOnly or cache is not None
+                or profiler is not None):
+            parser.error('--saveIntermediateFigures, --figuresOnly, --cacheDir and --profile do not apply to --sweep')
+        try:
+            if os.path.isfile(args.sweep):
+                with open(args.sweep) as gridFile:
+                    grid = json.load(gridFile)
+            else:
+                grid = json.loads(args.sweep)
+            if not isinstance(grid, dict):
+                raise ValueError("the grid must be a JSON object")
+            getSweepConfigurations(grid)
+        except ValueError as err:
+            parser.error('--sweep: %s' % err)
+        inputFns = [args.inFn] if args.inFn is not None else getBatchFilenames(args.batch)
+        table, failures = runSweep(inputFns, grid, args.outDir,
+                                   numWorkers=args.numWorkers,
+                                   cellFilter=cellFilter,
+                                   numThreads=args.numThreads)
+        if failures:
+            sys.exit(1)
+    elif args.stack is not None:
+        if args.figuresOnly:
+            parser.error('--figuresOnly does not apply to --stack')
+        processStack(args.stack, args.outDir,
+                     makeFigures=not args.noFigures,
+                     contourEngine=args.contourEngine,
+                     curvatureEngine=args.curvatureEngine,
+                     minOverlap=args.minOverlap,
+                     profiler=profiler,
+                     cellFilter=cellFilter,
+                     numThreads=args.numThreads)
+    elif args.inFn is not None:
+        if args.figuresOnly:
+            renderFigures(args.inFn, args.outDir, previewSize=args.previewSize)
+        elif args.tileSize is not None:
+            processMosaic(args.inFn, args.outDir,
+                          makeFigures=not args.noFigures,
+                          tileSize=args.tileSize,
+                          overlap=args.tileOverlap,
+                          numWorkers=args.numWorkers,
+                          contourEngine=args.contourEngine,
+                          curvatureEngine=args.curvatureEngine,
+                          cellFilter=cellFilter,
+                          numThreads=args.numThreads)
+        else:
+            processImage(args.inFn, saveIntermediateFigures, args.outDir,
+                         makeFigures=not args.noFigures,
+                         contourEngine=args.contourEngine,
+                         curvatureEngine=args.curvatureEngine,
+                         cache=cache,
+                         profiler=profiler,
+                         previewSize=args.previewSize,
+                         cellFilter=cellFilter,
+                         numThreads=args.numThreads)
+            if cache is not None:
+                print(cache.getReport())
+    else:
+        try:
+            failures = runBatch(getBatchFilenames(args.batch),
+                                numWorkers=args.numWorkers,
+                                saveIntermediateFigures=saveIntermediateFigures,
+                                outDir=args.outDir,
+                                makeFigures=not args.noFigures,
+                                figuresOnly=args.figuresOnly,
+                                contourEngine=args.contourEngine,
+                                curvatureEngine=args.curvatureEngine,
+                                cache=cache,
+                                profiler=profiler,
+                                previewSize=args.previewSize,
+                                cellFilter=cellFilter,
+                                numThreads=args.numThreads)
+        except ValueError as err:
+            parser.error('--batch: %s' % err)
+        if cache is not None:
+            print(cache.getReport())
+        if failures:
+            sys.exit(1)
 
 
 if __name__ == "__main__":
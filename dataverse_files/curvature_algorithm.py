@@ -54,6 +54,7 @@ def calculate_curvature( data, number_of_points, **kwds ):
 		
 		# figure out which exact sub-pixel distances we'll calculate the curvature for (only calculate curvature within a 1 pixel range for a given loop cycle)
 		min_, max_ = (dists[i]+dists[i-1])/2, (dists[i]+dists[i+1])/2
+		eval_idx = np.where((interp_eval >= min_) & (interp_eval < max_))[0]
 		eval_d = interp_eval[eval_idx]
 		
 		# evaluate the curvature at the given distances eval_d, using our fit derivatives
@@ -1,98 +1,135 @@
 
 
 #include "find_contours.h"
-#include <iostream>
 #include <math.h>
 
 using namespace std;
 
-// we'll use globals to make this all work with python...
-vector<vector<double> > x_vals;
-vector<vector<double> > y_vals;
-vector<int> filtered;
+// every call to trace_contour gets its own set of contours, so several
+// images can be traced at once from different threads
+struct contour_set {
+	vector<vector<double> > x_vals;
+	vector<vector<double> > y_vals;
+};
 
 //					   edge 1	     edge 2        edge 3        edge 4
 //				   ([    ][    ])([    ][    ])([    ][    ])([    ][    ])
-static int edges[16] = { 0, 0, 1, 0,   1, 0, 1, 1,   1, 1, 0, 1,   0, 1, 0, 0 };
+static const int edges[16] = { 0, 0, 1, 0,   1, 0, 1, 1,   1, 1, 0, 1,   0, 1, 0, 0 };
 //static int edges[16] = { 0, 0, 1, 0,   1, 0, 1, 1,   0, 1, 1, 1,   0, 0, 0, 1 };
 
 // little macro to determine if a given square crosses the threshold across a given side of the square
 #define IS_EDGE(px,py,edge) thresholded[img_x*(py+edges[edge*4+1])+px+edges[edge*4]] ^ thresholded[img_x*(py+edges[edge*4+3])+px+edges[edge*4+2]]
 
 
-extern "C" int get_num_contours( void )
+extern "C" void free_contours( contour_set * contours )
 {
-	return x_vals.size();
+	delete contours;
 }
 
-extern "C" int get_contour_length( int num ) {
-	if( num > x_vals.size() ) { return -1; }
-	return x_vals[num].size();
+extern "C" int get_num_contours( const contour_set * contours )
+{
+	return contours->x_vals.size();
 }
 
-extern "C" void set_contour( double * array, int len, int num )
+extern "C" int get_contour_length( const contour_set * contours, int num )
 {
-	if( num > x_vals.size() ) { return; }
-	if( len > x_vals[num].size() ) { return; }
-	
+	if( num < 0 || num >= (int)contours->x_vals.size() ) { return -1; }
+	return contours->x_vals[num].size();
+}
+
+extern "C" long get_total_length( const contour_set * contours )
+{
+	long total = 0;
+	for( size_t i=0; i<contours->x_vals.size(); i++ ) {
+		total += contours->x_vals[i].size();
+	}
+	return total;
+}
+
+extern "C" void set_contour( const contour_set * contours, double * array, int len, int num )
+{
+	if( num < 0 || num >= (int)contours->x_vals.size() ) { return; }
+	if( len > (int)contours->x_vals[num].size() ) { return; }
 	
+	const vector<double> & xs = contours->x_vals[num];
+	const vector<double> & ys = contours->y_vals[num];
 	for( int i=0; i<len; i++ ) {
-		array[2*i] = x_vals[num][i];
-		array[2*i+1] = y_vals[num][i];
+		array[2*i] = xs[i];
+		array[2*i+1] = ys[i];
 	}
 }
 
-extern "C" void set_contour_rev( double * array, int len, int num )
+extern "C" void set_contour_rev( const contour_set * contours, double * array, int len, int num )
 {
-	if( num > x_vals.size() ) { return; }
-	if( len > x_vals[num].size() ) { return; }
+	if( num < 0 || num >= (int)contours->x_vals.size() ) { return; }
+	if( len > (int)contours->x_vals[num].size() ) { return; }
 	
+	// copy the last len points, last point first
+	const vector<double> & xs = contours->x_vals[num];
+	const vector<double> & ys = contours->y_vals[num];
+	int last = xs.size()-1;
 	for( int i=0; i<len; i++ ) {
-		array[2*i] = x_vals[num][i];
-		array[2*i+1] = y_vals[num][i];
+		array[2*i] = xs[last-i];
+		array[2*i+1] = ys[last-i];
 	}
 }
 
-double polygon_area( int num )
+extern "C" void copy_contours( const contour_set * contours, const int * list, int num, int reverse,
+                               double * array, long * offsets )
+{
+	// copy contours list[0..num) (or all of them if list is null) into one
+	// flat array of x, y pairs; offsets[i] is where contour i starts, and
+	// offsets[num] is the total number of points
+	long start = 0;
+	for( int i=0; i<num; i++ ) {
+		int which = list ? list[i] : i;
+		int len = get_contour_length(contours, which);
+		if( len < 0 ) len = 0;
+		
+		offsets[i] = start;
+		if( reverse ) set_contour_rev(contours, array+2*start, len, which);
+		else set_contour(contours, array+2*start, len, which);
+		start += len;
+	}
+	offsets[num] = start;
+}
+
+extern "C" double polygon_area( const contour_set * contours, int num )
 {
 	double area = 0;
 	int j = 0; int i = 0;
-	int points = x_vals[num].size();
+	const vector<double> & xs = contours->x_vals[num];
+	const vector<double> & ys = contours->y_vals[num];
+	int points = xs.size();
 	
 	for( i=0; i<points; i++ ) {
 		j++; if( j == points ) j = 0;
-		area += (x_vals[num][i]+x_vals[num][j])*(y_vals[num][i]-y_vals[num][j]);
+		area += (xs[i]+xs[j])*(ys[i]-ys[j]);
 	}
 	
 	return fabs(area*0.5);
 }
 
-extern "C" int filter_by_area( double min, double max )
+extern "C" int filter_by_area( const contour_set * contours, double min, double max, int * list, int max_num )
 {
-	filtered.clear();
-	
+	// write the indices of the contours with min < area < max into list, up
+	// to max_num of them, and return how many contours passed
+	int num = 0;
 	double area;
 	
-	for( int i=0; i<x_vals.size(); i++ ) {
-		area = polygon_area(i);
-		if( area > min && area < max )
-			filtered.push_back(i);
+	for( int i=0; i<(int)contours->x_vals.size(); i++ ) {
+		area = polygon_area(contours, i);
+		if( area > min && area < max ) {
+			if( num < max_num ) list[num] = i;
+			num++;
+		}
 	}
 	
-	return filtered.size();
-}
-
-extern "C" void return_filtered( int * list, int num )
-{
-	if( num < filtered.size() ) return;
-	
-	for( int i=0; i<num; i++ ) {
-		list[i] = filtered[i];
-	}
+	return num;
 }
 
 
-extern "C" void trace_contour( double * img, int img_x, int img_y, double threshold )
+extern "C" contour_set * trace_contour( const double * img, int img_x, int img_y, double threshold )
 {
 	// yowzer, this function is a big annoying one. but it has been tested quite extensively.
 	// send it an image, img, with dimensions img_x, img_y, and a contour level on that image,
@@ -101,17 +138,19 @@ extern "C" void trace_contour( double * img, int img_x, int img_y, double thresh
 	// square. it's basically identical to the matlab function contourf or whatever.
 	
 	
-	// the coordinates of the contours
+	// the coordinates of the contours; the caller owns them and frees them
+	// with free_contours
+	contour_set * contours = new contour_set;
+	vector<vector<double> > & x_vals = contours->x_vals;
+	vector<vector<double> > & y_vals = contours->y_vals;
 	vector<double> empty;
-	x_vals.clear();
-	y_vals.clear();
 		
 	x_vals.push_back(empty);
 	y_vals.push_back(empty);
 	
 	// an array that stores whether or not we've visited each element
-	int * visited = new int[img_x*img_y];			// we wont use the last element of every row...
-	bool * thresholded = new bool[img_x*img_y];     // thresholded element
+	vector<int> visited(img_x*img_y);			// we wont use the last element of every row...
+	vector<char> thresholded(img_x*img_y);     // thresholded element
 	
 	bool walking, testing, first;
 	bool is_saddle, next_saddle;
@@ -128,9 +167,6 @@ extern "C" void trace_contour( double * img, int img_x, int img_y, double thresh
 	double t;
 	int edge;
 	
-	cout << img_x << " " << img_y<< endl;
-	
-	
 	// look ahead at who's above an who's below the threshold. also, initialize the visited array
 	for( int y=0; y < img_y; y++ ) {
 		for( int x=0; x < img_x; x++ ) {
@@ -282,7 +318,6 @@ extern "C" void trace_contour( double * img, int img_x, int img_y, double thresh
 	x_vals.pop_back();
 	y_vals.pop_back();
 	
-	delete[] visited;
-	delete[] thresholded;
+	return contours;
 }
 	
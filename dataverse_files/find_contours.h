@@ -1,12 +1,19 @@
 #include <vector>
 
 
-extern "C" void trace_contour( double * img, int img_x, int img_y, double threshold );
-extern "C" int get_contour_length( int num );
-extern "C" int get_num_contours( void );
-extern "C" void set_contour( double * array, int len, int num );
-extern "C" void set_contour_rev( double * array, int len, int num );
-extern "C" void return_filtered( int * list, int num );
-extern "C" int filter_by_area( double min, double max );
-double polygon_area( int num );
+// the contours found by one call to trace_contour
+struct contour_set;
+
+extern "C" contour_set * trace_contour( const double * img, int img_x, int img_y, double threshold );
+extern "C" void free_contours( contour_set * contours );
+extern "C" int get_contour_length( const contour_set * contours, int num );
+extern "C" int get_num_contours( const contour_set * contours );
+extern "C" long get_total_length( const contour_set * contours );
+extern "C" void set_contour( const contour_set * contours, double * array, int len, int num );
+extern "C" void set_contour_rev( const contour_set * contours, double * array, int len, int num );
+extern "C" void copy_contours( const contour_set * contours, const int * list, int num, int reverse,
+                               double * array, long * offsets );
+extern "C" int filter_by_area( const contour_set * contours, double min, double max, int * list, int max_num );
+extern "C" double polygon_area( const contour_set * contours, int num );
+
 
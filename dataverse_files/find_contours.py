@@ -1,17 +1,9 @@
-
 import ctypes as C
 import numpy as np
-import scipy.misc
-import math
 import os
 import re
 import os.path as path
 
-import time
-lines_time = 0
-midlines_time = 0
-inner_loop = 0
-
 
 
 
@@ -29,10 +21,10 @@ if sys.platform.startswith('win32'):
 
 
 full_path = ''
-path_ = path.dirname(__file__)
+path_ = path.dirname(path.abspath(__file__))
 
 
-# for py2exe.. comment out all 
+# for py2exe.. comment out all
 #full_path = path_ + '\\..\\..\\' + lib_name
 
 files = os.listdir(path_)
@@ -41,14 +33,134 @@ for fn in files:
 		full_path = path.join(path_,fn)
 		break
 if full_path == '':
-	raise IOError("could not find library1!!!!111!!11!!!!!!!1!!!!")
+	raise IOError("could not find the contour library " + lib_name + " in " + path_ + "; build it with compile_contours")
 
-# load the lib
+# load the lib. ctypes releases the GIL while a function of a cdll runs, and
+# every trace gets its own result handle, so several threads can trace images
+# at the same time
 _thelib = C.cdll.LoadLibrary(full_path)
 
 
 # set the types for the functions
 _thelib.trace_contour.argtypes = [C.POINTER(C.c_double), C.c_int, C.c_int, C.c_double]
+_thelib.trace_contour.restype = C.c_void_p
+_thelib.free_contours.argtypes = [C.c_void_p]
+_thelib.free_contours.restype = None
+_thelib.get_num_contours.argtypes = [C.c_void_p]
+_thelib.get_num_contours.restype = C.c_int
+_thelib.get_contour_length.argtypes = [C.c_void_p, C.c_int]
+_thelib.get_contour_length.restype = C.c_int
+_thelib.get_total_length.argtypes = [C.c_void_p]
+_thelib.get_total_length.restype = C.c_long
+_thelib.copy_contours.argtypes = [C.c_void_p, C.POINTER(C.c_int), C.c_int, C.c_int,
+                                  C.POINTER(C.c_double), C.POINTER(C.c_long)]
+_thelib.copy_contours.restype = None
+_thelib.filter_by_area.argtypes = [C.c_void_p, C.c_double, C.c_double, C.POINTER(C.c_int), C.c_int]
+_thelib.filter_by_area.restype = C.c_int
+_thelib.polygon_area.argtypes = [C.c_void_p, C.c_int]
+_thelib.polygon_area.restype = C.c_double
+
+
+class ContourSet(object):
+	""" Handle on the contours found by one call to the tracer. The contours
+	live in the library until the handle is closed (or garbage collected).
+	"""
+
+	def __init__(self, handle):
+		self._handle = handle
+
+	def __len__(self):
+		return _thelib.get_num_contours(self._handle)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __del__(self):
+		self.close()
+
+	def close(self):
+		if self._handle is not None:
+			_thelib.free_contours(self._handle)
+			self._handle = None
+
+	def filter_by_area(self, min_area, max_area):
+		""" Indices of the contours whose area is between min_area and max_area. """
+		num = len(self)
+		selected = np.empty(num, dtype=np.intc)
+		count = _thelib.filter_by_area(self._handle, C.c_double(min_area), C.c_double(max_area),
+		                               selected.ctypes.data_as(C.POINTER(C.c_int)), C.c_int(num))
+		return selected[:count]
+
+	def copy_flat(self, which=None, reverse=False, points=None, offsets=None):
+		""" Copy contours into one flat (N, 2) array of x, y points, plus an offsets
+		array where contour i is points[offsets[i]:offsets[i+1]]. "which" selects
+		contours by index (default: all). Caller-provided "points" and "offsets"
+		buffers are filled in place if given; they must be C contiguous, writeable
+		float64 and C long (dtype 'l') arrays large enough to hold the result.
+		Raises TypeError or ValueError for other buffers and IndexError for
+		indices in "which" that are not contours of the set.
+		"""
+		if which is None:
+			num = len(self)
+			list_ptr = None
+			total = _thelib.get_total_length(self._handle)
+		else:
+			which = np.ascontiguousarray(which, dtype=np.intc).reshape(-1)
+			num = len(which)
+			# the library would count a contour that does not exist as empty
+			if np.any((which < 0) | (which >= len(self))):
+				raise IndexError("contour indices must be between 0 and %d" % (len(self)-1))
+			list_ptr = which.ctypes.data_as(C.POINTER(C.c_int))
+			total = sum(_thelib.get_contour_length(self._handle, C.c_int(int(i))) for i in which)
+
+		if points is None:
+			points = np.empty((total, 2), dtype=np.double)
+		if offsets is None:
+			offsets = np.empty(num+1, dtype='l')
+		# the library writes straight into the buffers as C doubles and longs
+		for name, buf, dtype in (('points', points, np.dtype(np.double)), ('offsets', offsets, np.dtype('l'))):
+			if not isinstance(buf, np.ndarray) or buf.dtype != dtype:
+				raise TypeError("%s must be a numpy array of %s" % (name, dtype))
+			if not buf.flags.c_contiguous or not buf.flags.writeable:
+				raise ValueError("%s must be C contiguous and writeable" % name)
+		if points.size < 2*total or offsets.size < num+1:
+			raise ValueError("buffers are too small for %d contours with %d points" % (num, total))
+
+		_thelib.copy_contours(self._handle, list_ptr, C.c_int(num), C.c_int(bool(reverse)),
+		                      points.ctypes.data_as(C.POINTER(C.c_double)),
+		                      offsets.ctypes.data_as(C.POINTER(C.c_long)))
+		return points, offsets
+
+
+def trace_contour_set(image, threshold):
+	""" Trace contours in input image data at a specified contour level ("threshold")
+	and return a ContourSet handle on them. Pixels >= threshold are inside.
+	"""
+
+	# pad with zeros
+	image = np.array(image, dtype="double")
+	image = np.pad(image, 1)
+
+	# the library walks the image as one C contiguous block of doubles
+	image = np.ascontiguousarray(image)
+
+	# fire off to the c function
+	handle = _thelib.trace_contour(image.ctypes.data_as(C.POINTER(C.c_double)), C.c_int(image.shape[1]), C.c_int(image.shape[0]), C.c_double(threshold))
+	return ContourSet(handle)
+
+
+def trace_contour_flat(image, threshold, **kwargs):
+	""" Like trace_contour, but return all the contours in one flat (N, 2) array
+	of x, y points plus an offsets array (see ContourSet.copy_flat).
+	"""
+	with trace_contour_set(image, threshold) as contours:
+		which = None
+		if 'area' in kwargs:
+			which = contours.filter_by_area(kwargs['area'][0], kwargs['area'][1])
+		return contours.copy_flat(which, reverse=kwargs.get('reverse', False))
 
 
 def trace_contour(image, threshold, **kwargs):
@@ -56,38 +168,5 @@ def trace_contour(image, threshold, **kwargs):
 	Optionally filter by kwarg input argument "area". Also, optionally reverse the
 	orientation of the contours (from CCW/CW) using the kwargs param "reverse"
 	"""
-	
-	# pad with zeros
-	image = np.array(image, dtype="double")
-	image = np.vstack((np.zeros((1,image.shape[1]),dtype=image.dtype), image, np.zeros((1,image.shape[1]),dtype=image.dtype)))
-	image = np.hstack((np.zeros((image.shape[0],1),dtype=image.dtype), image, np.zeros((image.shape[0],1),dtype=image.dtype)))
-	
-	# ok there's a funny thing happening here. at some point, the arrays going in seemed to be striding
-	# differently or some BS.... so here's a temporary hack. got to figure this out. if things stop working
-	# look at the striding. 
-	print image.strides, image.shape
-	
-	# fire off to the c function
-	_thelib.trace_contour(image.ctypes.data_as(C.POINTER(C.c_double)), C.c_int(image.shape[1]), C.c_int(image.shape[0]), C.c_double(threshold))
-	
-	
-	to_copy = []
-	if 'area' in kwargs:
-		num = _thelib.filter_by_area(C.c_double(kwargs['area'][0]), C.c_double(kwargs['area'][1]))
-		to_copy = np.empty(num, dtype='i4')
-		_thelib.return_filtered( to_copy.ctypes.data_as(C.POINTER(C.c_int)), C.c_int(num) )
-	else:
-		# how many contours....
-		to_copy = range( _thelib.get_num_contours() )
-	
-	# copy the data over
-	reverse = kwargs.get('reverse', False)
-	
-	contours = []
-	for i in to_copy:
-		contours.append(np.empty(( _thelib.get_contour_length(C.c_int(i)), 2 ), dtype="double" ))
-		if reverse == False: _thelib.set_contour( contours[-1].ctypes.data_as(C.POINTER(C.c_double)), C.c_int(contours[-1].shape[0]), C.c_int(i) )
-		else: _thelib.set_contour_rev( contours[-1].ctypes.data_as(C.POINTER(C.c_double)), C.c_int(contours[-1].shape[0]), C.c_int(i) )
-	
-	return contours
-
+	points, offsets = trace_contour_flat(image, threshold, **kwargs)
+	return [points[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
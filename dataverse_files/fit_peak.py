@@ -1,8 +1,19 @@
 from numpy import *
 from scipy import optimize
-from scipy.ndimage.filters import gaussian_filter
-	
-def fit(self, data, x, y, **kwds):
+from scipy.ndimage import gaussian_filter
+
+
+# the fit results of one spot per record. x is along the first axis of the image data and y
+# along the second, as for fit(). spots too close to the edge of the frame are all nan
+SPOT_DTYPE = dtype([('x', float64),
+                    ('y', float64),
+                    ('sigma', float64),
+                    ('amplitude', float64),
+                    ('background', float64),
+                    ('corrcoef', float64)])
+
+
+def fit(data, x, y, **kwds):
 	"""Fit a round (as opposed to an eliptical) 2-D gaussian to a spot in an ndarray of floats.
 	Must specify a reasonable guess for the x y position, as the algorithm cuts a small window,
 	of width gf_size*2+1, out of the data for refinement. Returns the final fit params."""
@@ -20,7 +31,7 @@ def fit(self, data, x, y, **kwds):
 	points = indices(((2*gf_size+1),(2*gf_size+1))) # indices at which to evaluate the gaussian functions
 	
 	# a nested function to do the actual gaussian fitting
-	def gaussfit(self, data, points, p0):
+	def gaussfit(data, points, p0):
 		"""This function will refine a 2-D gaussian on the target data,
 		with the x,y positions of each point in the array provided by
 		points (generally this should be: numpy.indices(data.shape)),
@@ -36,7 +47,7 @@ def fit(self, data, x, y, **kwds):
 			out = optimize.leastsq(gauss_2D_fixedsigma_err, p0_nosigma, args=(fixed_sigma, points, data),maxfev=2000)
 			# use numpy's built in corrcoef calculator. output is a matrix, just pull one value out.
 			corco = corrcoef( ravel(data), gauss_2D_fixedsigma(out[0], fixed_sigma, points) )[1,0]
-			out = [out[0][0], out[0][1], fixed_sigma, out[0][2], out[0][3], corco, 0], out[1]
+			out = array([out[0][0], out[0][1], fixed_sigma, out[0][2], out[0][3], corco, 0]), out[1]
 			return out 
 		else:
 			out = optimize.leastsq(gauss_2D_err, p0, args=(points, data),maxfev=2000)
@@ -52,6 +63,7 @@ def fit(self, data, x, y, **kwds):
 		return None
 	
 	# cut out a slice out of the input array for gaussian refinement
+	x, y = int(rint(x)), int(rint(y))
 	the_slice = array(data[x-gf_size:x+gf_size+1,y-gf_size:y+gf_size+1])
 	
 	# make the initial guess object array. order is p[0]: x position, p[1]: y position,
@@ -62,9 +74,9 @@ def fit(self, data, x, y, **kwds):
 	# do the fitting. catch shape errors. it shouldn't happen, but every once and a while it
 	# does, and this makes it easier to find...
 	try:	
-		result, num = gaussfit(the_slice,p0)
+		result, num = gaussfit(the_slice, points, p0)
 	except ValueError:
-		print "Error with sizing... probably running into a boundary?"
+		print("Error with sizing... probably running into a boundary?")
 		raise
 	
 	# recenter back in the absolute coordinate system
@@ -75,6 +87,174 @@ def fit(self, data, x, y, **kwds):
 
 
 
+def extract_windows(data, x, y, gf_size=5):
+	""" Cut the (2*gf_size+1) square window around every guessed spot position out of the
+	data, as fit() does for one spot, into one stacked array. Positions whose window would go
+	off the edge of the frame get an all zero window and are flagged in the returned mask.
+	"""
+	x = rint(asarray(x)).astype(intp)
+	y = rint(asarray(y)).astype(intp)
+	inside = (x > gf_size) & (x < data.shape[0] - gf_size) & (y > gf_size) & (y < data.shape[1] - gf_size)
+	
+	# a read only view of every window in the frame; fancy indexing copies out the ones we want
+	all_windows = lib.stride_tricks.sliding_window_view(data, (2*gf_size+1, 2*gf_size+1))
+	windows = zeros((len(x), 2*gf_size+1, 2*gf_size+1), dtype="float")
+	windows[inside] = all_windows[x[inside]-gf_size, y[inside]-gf_size]
+	return windows, inside
+
+
+
+def gaussfit_batch(windows, p0, fixed_sigma=False, max_iter=200, tol=1e-10):
+	""" Refine a round 2-D gaussian on every window of a stack at once with Levenberg-Marquardt,
+	the algorithm leastsq uses for one window at a time. p0 holds one initial guess per window,
+	ordered p[0]: x center p[1]: y center p[2]: width p[3]: amplitude p[4]: background. With
+	fixed_sigma, the width is held at that value. Returns the refined parameters, same shape as
+	p0, and the correlation coefficient between each window and its fit.
+	"""
+	num, size = windows.shape[0], windows.shape[1]
+	points = indices((size, size)).reshape(2, -1).astype("float")
+	data = windows.reshape(num, -1)
+	params = array(p0, dtype="float")
+	if fixed_sigma:
+		params[:,2] = fixed_sigma
+	free = [0, 1, 3, 4] if fixed_sigma else [0, 1, 2, 3, 4]
+	
+	def model(params):
+		dx = params[:,0,None] - points[0]
+		dy = params[:,1,None] - points[1]
+		gauss = exp( -(dx**2 + dy**2)/(2*params[:,2,None]**2) )
+		return params[:,4,None] + params[:,3,None]*gauss, gauss, dx, dy
+	
+	def jacobian(params, gauss, dx, dy):
+		# derivatives of the model in each parameter, one (num, pixels) array per parameter
+		sigma = params[:,2,None]
+		amp_gauss = params[:,3,None]*gauss
+		columns = [-amp_gauss*dx/sigma**2,
+		           -amp_gauss*dy/sigma**2,
+		           amp_gauss*(dx**2 + dy**2)/sigma**3,
+		           gauss,
+		           ones_like(gauss)]
+		return stack([columns[i] for i in free], axis=2)
+	
+	fitted, gauss, dx, dy = model(params)
+	residuals = fitted - data
+	cost = einsum('ij,ij->i', residuals, residuals)
+	damping = full(num, 1e-3)
+	active = ones(num, dtype=bool)
+	
+	for iteration in range(max_iter):
+		if not active.any():
+			break
+		# solve the damped normal equations of the windows still being refined
+		jac = jacobian(params[active], gauss[active], dx[active], dy[active])
+		jtj = einsum('npi,npj->nij', jac, jac)
+		jtr = einsum('npi,np->ni', jac, residuals[active])
+		diagonal = einsum('nii->ni', jtj)
+		damped = jtj + (damping[active,None]*maximum(diagonal, 1e-12))[:,:,None]*eye(len(free))
+		try:
+			step = linalg.solve(damped, -jtr[:,:,None])[:,:,0]
+		except linalg.LinAlgError:
+			step = einsum('nij,nj->ni', linalg.pinv(damped), -jtr)
+		
+		trial = params[active].copy()
+		trial[:,free] += step
+		trial_fitted, trial_gauss, trial_dx, trial_dy = model(trial)
+		trial_residuals = trial_fitted - data[active]
+		trial_cost = einsum('ij,ij->i', trial_residuals, trial_residuals)
+		
+		# keep the steps that lower the cost and relax their damping; damp the others harder
+		better = trial_cost < cost[active]
+		idx = flatnonzero(active)
+		accepted = idx[better]
+		# (a tiny drop under heavy damping only means the step was cut short, not converged)
+		converged = better & (cost[active] - trial_cost <= tol*maximum(cost[active], 1e-300)) & (damping[active] <= 1)
+		params[accepted] = trial[better]
+		fitted[accepted], gauss[accepted] = trial_fitted[better], trial_gauss[better]
+		dx[accepted], dy[accepted] = trial_dx[better], trial_dy[better]
+		residuals[accepted] = trial_residuals[better]
+		cost[accepted] = trial_cost[better]
+		damping[accepted] /= 10
+		damping[idx[~better]] *= 10
+		
+		# stop refining windows whose cost no longer drops or whose steps have vanished
+		stalled = ~better & (damping[idx] > 1e10)
+		active[idx[converged | stalled]] = False
+	
+	# correlation coefficient between each window and its fit
+	data_centred = data - data.mean(axis=1, keepdims=True)
+	fitted_centred = fitted - fitted.mean(axis=1, keepdims=True)
+	with errstate(invalid='ignore', divide='ignore'):
+		corco = einsum('ij,ij->i', data_centred, fitted_centred)/sqrt(
+			einsum('ij,ij->i', data_centred, data_centred)*einsum('ij,ij->i', fitted_centred, fitted_centred))
+	
+	return params, corco
+
+
+
+def fit_spots(data, x, y, **kwds):
+	""" Fit a round 2-D gaussian to every spot in an ndarray of floats at once. x and y are
+	arrays of guessed positions, with x along the first axis of the data as for fit(). Takes
+	the same gf_size and fixed_sigma kwds as fit(). Returns a structured array of SPOT_DTYPE,
+	one record per spot; spots whose window would go off the edge of the frame are all nan.
+	"""
+	gf_size = kwds.get('gf_size', 5)
+	fixed_sigma = kwds.get('fixed_sigma', False)
+	
+	windows, inside = extract_windows(data, x, y, gf_size)
+	windows = windows[inside]
+	
+	# the same initial guess as fit()
+	p0 = zeros((len(windows), 5))
+	p0[:,0] = p0[:,1] = gf_size
+	p0[:,2] = 1.5
+	p0[:,3] = windows.reshape(len(windows), -1).max(axis=1) if len(windows) else 0
+	params, corco = gaussfit_batch(windows, p0, fixed_sigma=fixed_sigma)
+	
+	# recenter back in the absolute coordinate system
+	spots = full(len(inside), nan, dtype=SPOT_DTYPE)
+	spots['x'][inside] = params[:,0] + rint(asarray(x)[inside]) - gf_size
+	spots['y'][inside] = params[:,1] + rint(asarray(y)[inside]) - gf_size
+	spots['sigma'][inside] = abs(params[:,2])
+	spots['amplitude'][inside] = params[:,3]
+	spots['background'][inside] = params[:,4]
+	spots['corrcoef'][inside] = corco
+	return spots
+
+
+
+def quantify_spots( image_data, peak_positions, **kwds ):
+	""" Fit all of the given peaks in an image of a cell at once. The background is subtracted
+	from the image once, then every peak is fit as in return_peak_intensity, including refitting
+	with a fixed sigma the peaks whose sigma got out of control. peak_positions is an (N, 2)
+	array ordered like the peak_position of return_peak_intensity (column, row). Returns a
+	structured array of SPOT_DTYPE, with x and y in the same order as peak_positions.
+	The integrated intensity of a peak is amplitude*sigma**2.
+	"""
+	background_filter_size = kwds.get('bkg_filt_sz', 2.7) # background filter size, in um
+	px_sz = kwds.get('px_sz', .108)                       # image pixel size, in um
+	
+	image_data = asarray(image_data, dtype="float")
+	img_data_background_subtracted = image_data - gaussian_filter(image_data, background_filter_size/px_sz)  # use a big gaussian to do local backgroudn subtraction
+	
+	peak_positions = asarray(peak_positions).reshape(-1, 2)
+	rows, cols = peak_positions[:,1], peak_positions[:,0]
+	if kwds.get('fixed_sigma',False):
+		spots = fit_spots(img_data_background_subtracted, rows, cols, fixed_sigma=.108/px_sz)   # fit the peaks using a sigma that is roughlty a diffraction limited spot
+	else:
+		spots = fit_spots(img_data_background_subtracted, rows, cols) # fit the peaks using a free sigma
+	
+	# if the sigma got out of control, i.e. greater than 0.3 um, which is much bigger than a diffraction limited spot, fix the sigma
+	# so we don't get total garbage out
+	wild = flatnonzero(spots['sigma'] > 0.3/px_sz)
+	if len(wild):
+		spots[wild] = fit_spots(img_data_background_subtracted, rows[wild], cols[wild], fixed_sigma=.162/px_sz)
+	
+	# report the positions in the (column, row) order they were given in
+	spots['x'], spots['y'] = spots['y'].copy(), spots['x'].copy()
+	return spots
+
+
+
 def return_peak_intensity( image_data, peak_position, **kwds ):
 	""" Calculate the intensity of a given peak in an image of a cell. Provide the raw image data,
 	the coordinates of the peak, and a couple parameters, and it sends back the integrated intensity
@@ -93,9 +273,7 @@ def return_peak_intensity( image_data, peak_position, **kwds ):
 	
 	# if the sigma got out of control, i.e. greater than 0.3 um, which is much bigger than a diffraction limited spot, fix the sigma
 	# so we don't get total garbage out
-	if res[2] > 0.3/kwds['pixel_size']:
+	if res[2] > 0.3/px_sz:
 		res = fit(img_data_background_subtracted, peak_position[1], peak_position[0], fixed_sigma=.162/px_sz)
 	
 	return res[3]*res[2]**2    # return the integrated area, peak height * (peak width)^2 ok, it's not exactly the integrated area, but its proportional (missing a 2*pi or something)
-
-